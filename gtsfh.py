@@ -1,86 +1,995 @@
 import sys
 import os
 import base64
+import io
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
                              QLabel, QLineEdit, QPushButton, QComboBox, QFrame, 
-                             QTextEdit, QSpinBox, QGroupBox)
-from PyQt5.QtGui import QFont, QColor, QPixmap
-from PyQt5.QtCore import Qt, QEvent, QThread, pyqtSignal
+                             QTextEdit, QSpinBox, QGroupBox, QFileDialog, QCheckBox,
+                             QListWidget, QListWidgetItem, QTableWidget, QTableWidgetItem,
+                             QDoubleSpinBox, QPlainTextEdit)
+from PyQt5.QtGui import QFont, QColor, QImageReader, QTextCursor, QTextDocument
+from PyQt5.QtCore import (Qt, QEvent, QObject, QTimer, QBuffer, QByteArray, QIODevice, QUrl,
+                          QCoreApplication, pyqtSignal)
+from PyQt5.QtNetwork import QLocalServer, QLocalSocket
 import json
+import argparse
+import getpass
+import subprocess
+import sqlite3
+import difflib
 from pynput import keyboard
 import time
-from datetime import datetime
-import requests
+import hashlib
+from datetime import datetime, timedelta
+import re
+import asyncio
+import threading
+import contextlib
+import contextvars
+import itertools
+import cProfile
+import codecs
+import tempfile
+import shutil
+import bisect
+from array import array
+from collections import OrderedDict, deque
+from html.parser import HTMLParser
+from gtsfh_core import (build_prompt_messages, _split_system_messages, parse_api_keys, _error_status,
+                        is_transient_error, KeyPool, JobQueue, Glossary, GLOSSARY_FIX_PROMPT,
+                        BatchTranslator, estimate_tokens, LOCALIZATION_FORMATS, SUBTITLE_FORMATS)
 
 # 条件付きインポート
-try:
-    import google.generativeai as genai
-    from google.generativeai.types import HarmCategory, HarmBlockThreshold
-    GENAI_AVAILABLE = True
-except ImportError:
-    GENAI_AVAILABLE = False
-
-try:
-    from openai import OpenAI
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-
-try:
-    import PIL.Image
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
-
-
-# プロバイダー設定
-PROVIDERS = {
-    "Gemini": {
-        "base_url": None,
-        "api_type": "gemini",
-        "default_models": ["gemini-2.0-flash-exp", "gemini-1.5-pro", "gemini-1.5-flash"],
-        "vision_keywords": ["vision", "pro", "flash", "2.0"],
-    },
-    "GitHub Models": {
-        "base_url": "https://models.inference.ai.azure.com",
-        "api_type": "openai",
-        "default_models": ["gpt-4o", "gpt-4o-mini", "o1", "o1-mini", "o1-preview"],
-        "vision_keywords": ["gpt-4o", "gpt-4-turbo", "o1"],
-        "models_endpoint": None,
-    },
-    "OpenRouter": {
-        "base_url": "https://openrouter.ai/api/v1",
-        "api_type": "openai",
-        "default_models": [
-            "google/gemini-2.0-flash-exp:free",
-            "google/gemini-exp-1206:free",
-            "meta-llama/llama-3.3-70b-instruct",
-        ],
-        "vision_keywords": ["vision", "gpt-4", "claude-3", "gemini"],
-        "models_endpoint": "https://openrouter.ai/api/v1/models",
-    },
-    "Cerebras": {
-        "base_url": "https://api.cerebras.ai/v1",
-        "api_type": "openai",
-        "default_models": ["llama-3.3-70b", "llama3.1-70b", "llama3.1-8b"],
-        "vision_keywords": [],
-        "models_endpoint": "https://api.cerebras.ai/v1/models",
-    },
-}
+# SDKの読み込みには時間がかかるため、起動済みのインスタンスへ処理を渡すだけの呼び出しでは読み込まない。
+# GUIを起動する場合は load_optional_modules() で読み込む
+GENAI_AVAILABLE = False
+GENAI_CACHING_AVAILABLE = False
+OPENAI_AVAILABLE = False
+HTTPX_AVAILABLE = False
+PYPDF_AVAILABLE = False
+PYTESSERACT_AVAILABLE = False
+
+
+def load_optional_modules():
+    global genai, HarmCategory, HarmBlockThreshold, GENAI_AVAILABLE
+    global genai_caching, GENAI_CACHING_AVAILABLE
+    global AsyncOpenAI, OPENAI_AVAILABLE
+    global httpx, HTTPX_AVAILABLE
+    global pypdf, PYPDF_AVAILABLE
+    global pytesseract, PIL, PYTESSERACT_AVAILABLE
+    
+    try:
+        import google.generativeai as genai
+        from google.generativeai.types import HarmCategory, HarmBlockThreshold
+        GENAI_AVAILABLE = True
+    except ImportError:
+        GENAI_AVAILABLE = False
+
+    try:
+        from google.generativeai import caching as genai_caching
+        GENAI_CACHING_AVAILABLE = True
+    except ImportError:
+        GENAI_CACHING_AVAILABLE = False
+
+    try:
+        from openai import AsyncOpenAI
+        OPENAI_AVAILABLE = True
+    except ImportError:
+        OPENAI_AVAILABLE = False
+
+    try:
+        import httpx
+        HTTPX_AVAILABLE = True
+    except ImportError:
+        HTTPX_AVAILABLE = False
+
+    try:
+        import pypdf
+        PYPDF_AVAILABLE = True
+    except ImportError:
+        PYPDF_AVAILABLE = False
+
+    try:
+        import pytesseract
+        import PIL.Image
+        PYTESSERACT_AVAILABLE = True
+    except ImportError:
+        PYTESSERACT_AVAILABLE = False
+
+
+class AsyncEngine:
+    """バックグラウンドスレッド上で動く単一の asyncio イベントループ
+    
+    すべてのプロバイダー呼び出しはこのループ上のコルーチンとして実行され、
+    HTTPクライアントも使い回される。
+    """
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._http_client = None
+        self._thread = threading.Thread(target=self._run, name="AsyncEngine", daemon=True)
+        self._thread.start()
+        
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        
+    def submit(self, coro):
+        """コルーチンをループに投入し concurrent.futures.Future を返す"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def http_client(self):
+        """共有の非同期HTTPクライアント（ループ上からのみ呼ぶ）"""
+        if not HTTPX_AVAILABLE:
+            raise Exception("httpx パッケージがインストールされていません")
+        if self._http_client is None:
+            self._http_client = httpx.AsyncClient(timeout=30)
+        return self._http_client
+    
+    async def _shutdown(self):
+        for backend in PROVIDERS.values():
+            await backend.aclose()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            
+    def stop(self):
+        try:
+            self.submit(self._shutdown()).result(timeout=2)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=2)
+
+
+_engine = None
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = AsyncEngine()
+    return _engine
+
+
+# パフォーマンス計測
+_trace_track = contextvars.ContextVar('trace_track', default=None)
+
+
+class Profiler:
+    """有効な間だけ処理の区間を記録し、Chrome trace（Perfetto で開ける JSON）として書き出す
+    
+    span() は呼び出したスレッドの区間、async_span() はエンジン上のリクエストのように並行する処理の区間で、
+    同じトラック（track=True で開始したもの）の中では入れ子になる。
+    GUIのイベントループは一定間隔のタイマーの遅れで停止（stall）を検出し、
+    cProfile を有効にした場合はGUIスレッドとエンジンのスレッドの統計も書き出す。
+    """
+    # 記録するイベント数の上限（古いものから捨てる）
+    MAX_EVENTS = 200000
+    STALL_INTERVAL_MS = 50
+    
+    def __init__(self):
+        self.enabled = False
+        self._events = deque(maxlen=self.MAX_EVENTS)
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._origin = time.perf_counter_ns()
+        self._stall_timer = None
+        self._stall_ms = 0
+        self._last_tick = 0
+        self._profiles = {}
+        self.use_cprofile = False
+        
+    def _now(self):
+        return (time.perf_counter_ns() - self._origin) // 1000
+    
+    def _add(self, event):
+        thread = threading.current_thread()
+        event.setdefault('pid', os.getpid())
+        event.setdefault('tid', thread.ident)
+        with self._lock:
+            self._threads.setdefault(thread.ident, thread.name)
+            self._events.append(event)
+            
+    def start(self, stall_ms=100, use_cprofile=False):
+        """GUIスレッドから呼ぶ"""
+        if self.enabled:
+            return
+        self.enabled = True
+        self._events.clear()
+        self._origin = time.perf_counter_ns()
+        self._profiles = {}
+        self.use_cprofile = use_cprofile
+        if stall_ms:
+            self._stall_ms = stall_ms
+            self._last_tick = time.perf_counter()
+            self._stall_timer = QTimer()
+            self._stall_timer.timeout.connect(self._check_stall)
+            self._stall_timer.start(self.STALL_INTERVAL_MS)
+        if use_cprofile:
+            self._profiles = {'gui': cProfile.Profile(), 'engine': cProfile.Profile()}
+            self._profiles['gui'].enable()
+            # cProfile は有効にしたスレッドだけを計測する
+            get_engine().loop.call_soon_threadsafe(self._profiles['engine'].enable)
+            
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self._stall_timer is not None:
+            self._stall_timer.stop()
+            self._stall_timer = None
+        if self._profiles:
+            self._profiles['gui'].disable()
+            
+            async def disable():
+                self._profiles['engine'].disable()
+            try:
+                get_engine().submit(disable()).result(timeout=2)
+            except Exception:
+                pass
+    
+    def _check_stall(self):
+        now = time.perf_counter()
+        late = (now - self._last_tick) * 1000 - self.STALL_INTERVAL_MS
+        if late >= self._stall_ms:
+            self._add({'name': "event loop stall", 'cat': 'stall', 'ph': 'X',
+                       'ts': self._now() - int(late * 1000), 'dur': int(late * 1000),
+                       'args': {'ms': round(late, 1)}})
+        self._last_tick = now
+    
+    def span(self, name, cat='gui', **args):
+        """呼び出したスレッド上の区間"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, cat, args)
+    
+    @contextlib.contextmanager
+    def _span(self, name, cat, args):
+        start = self._now()
+        try:
+            yield
+        finally:
+            self._add({'name': name, 'cat': cat, 'ph': 'X', 'ts': start, 'dur': self._now() - start, 'args': args})
+            
+    def async_span(self, name, cat='request', track=False, **args):
+        """コルーチン内の区間。track=True なら新しいトラックを開始し、中の async_span をそこに入れる"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._async_span(name, cat, track, args)
+    
+    @contextlib.contextmanager
+    def _async_span(self, name, cat, track, args):
+        track_id = None if track else _trace_track.get()
+        token = None
+        if track_id is None:
+            track_id = next(self._ids)
+            token = _trace_track.set(track_id)
+        event = {'name': name, 'cat': cat, 'id': track_id}
+        self._add(dict(event, ph='b', ts=self._now(), args=args))
+        try:
+            yield
+        finally:
+            self._add(dict(event, ph='e', ts=self._now()))
+            if token is not None:
+                _trace_track.reset(token)
+                
+    def instant(self, name, cat='request', **args):
+        if self.enabled:
+            track_id = _trace_track.get()
+            if track_id is not None:
+                self._add({'name': name, 'cat': cat, 'ph': 'n', 'id': track_id, 'ts': self._now(), 'args': args})
+            else:
+                self._add({'name': name, 'cat': cat, 'ph': 'i', 's': 't', 'ts': self._now(), 'args': args})
+                
+    def export(self, directory):
+        """記録したイベントを書き出し、保存したファイルのパスのリストを返す"""
+        os.makedirs(directory, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                    for tid, name in threads.items()]
+        stalls = [e['args']['ms'] for e in events if e['cat'] == 'stall']
+        trace = {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'stalls': len(stalls), 'max_stall_ms': max(stalls, default=0)},
+        }
+        paths = [os.path.join(directory, f"trace_{timestamp}.json")]
+        with open(paths[0], 'w', encoding='utf-8') as f:
+            json.dump(trace, f, ensure_ascii=False)
+        for name, profile in self._profiles.items():
+            paths.append(os.path.join(directory, f"cprofile_{name}_{timestamp}.prof"))
+            profile.dump_stats(paths[-1])
+        return paths
+
+
+_NULL_SPAN = contextlib.nullcontext()
+PROFILER = Profiler()
+
+
+def _add_usage(total, usage):
+    for key, value in usage.items():
+        total[key] = total.get(key, 0) + (value or 0)
+
+
+# genai.configure はプロセス全体の設定なので、キャッシュ作成スレッドとエンジンスレッドで
+# 「configure してからクライアントを確定する」までをこのロックで直列化する
+_GENAI_CONFIGURE_LOCK = threading.Lock()
+
+
+async def _acquire_genai_configure():
+    """イベントループを止めずに _GENAI_CONFIGURE_LOCK を取得する（キャンセルされても取りこぼさない）"""
+    while not _GENAI_CONFIGURE_LOCK.acquire(blocking=False):
+        await asyncio.sleep(0.01)
+
+
+class ContextCacheManager:
+    """Gemini のコンテキストキャッシュ（CachedContent）をモデル・プレフィックスごとに管理"""
+    # 期限切れ間近のハンドルは使わずに作り直す
+    REFRESH_MARGIN = 60
+    
+    def __init__(self):
+        self.enabled = True
+        self.ttl = 3600
+        self.min_tokens = 4096
+        self._entries = {}
+        self._locks = {}
+        self._unsupported = set()
+        
+    def configure(self, config):
+        self.enabled = config.get('context_cache', True)
+        self.ttl = config.get('context_cache_ttl', 3600)
+        self.min_tokens = config.get('context_cache_min_tokens', 4096)
+        self._unsupported.clear()
+        
+    async def get(self, api_key, model, system_instruction):
+        """使用可能なキャッシュハンドルを返す（対象外・作成失敗時は None）"""
+        if (not self.enabled or not GENAI_CACHING_AVAILABLE or not system_instruction
+                or model in self._unsupported or estimate_tokens(system_instruction) < self.min_tokens):
+            return None
+        
+        key = (api_key, model, hashlib.sha256(system_instruction.encode('utf-8')).hexdigest())
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] - self.REFRESH_MARGIN > time.time():
+                return entry[0]
+            try:
+                handle = await asyncio.to_thread(self._create, api_key, model, system_instruction)
+            except Exception as e:
+                self._entries.pop(key, None)
+                # 非対応モデルやトークン数不足（400/404）のときだけ、以後このモデルではキャッシュを試みない。
+                # 一時的なエラーでは今回だけキャッシュなしで送る
+                if _error_status(e) in (400, 404):
+                    self._unsupported.add(model)
+                return None
+            self._entries[key] = (handle, time.time() + self.ttl)
+            return handle
+        
+    def _create(self, api_key, model, system_instruction):
+        with _GENAI_CONFIGURE_LOCK:
+            genai.configure(api_key=api_key)
+            return genai_caching.CachedContent.create(
+                model=f"models/{model}",
+                system_instruction=system_instruction,
+                ttl=timedelta(seconds=self.ttl),
+            )
+
+
+# プロバイダーバックエンド
+class ProviderBackend:
+    """プロバイダーバックエンドの基底クラス
+    
+    新しいプロバイダーはこのクラスを継承し、register_provider() で登録する。
+    """
+    name = ""
+    base_url = None
+    default_models = []
+    vision_keywords = []
+    requires_api_key = True
+    supports_streaming = True
+    supports_batching = True
+    # None の場合は設定値 batch_token_budget を使用
+    batch_token_budget = None
+    # モデル名の前方一致 → (入力, 出力) USD / 100万トークン
+    pricing = {}
+    # 接続確認に使うURL（None の場合は base_url）
+    health_url = None
+    # プロバイダー選択・設定画面に表示しない（テスト用）
+    hidden = False
+    
+    def __init__(self):
+        self.keys = KeyPool()
+        # 接続エラー時に回復を待つ最大秒数
+        self.offline_max_wait = 0
+    
+    def configure(self, config):
+        """設定の読み込み・保存時に呼ばれる"""
+        base_url = config.get('provider_base_urls', {}).get(self.name)
+        if base_url:
+            self.base_url = base_url
+        limits = config.get('key_rate_limits', {}).get(self.name, {})
+        self.keys.configure(parse_api_keys(config.get('api_keys', {}).get(self.name)),
+                            limits.get('rpm', 0), limits.get('tpm', 0))
+        self.offline_max_wait = config.get('offline_max_wait', 120)
+    
+    def has_credentials(self):
+        return bool(self.keys) or not self.requires_api_key
+    
+    def capabilities(self, model):
+        return {
+            'vision': self.supports_vision(model),
+            'streaming': self.supports_streaming,
+            'batching': self.supports_batching,
+        }
+    
+    def supports_vision(self, model):
+        return any(kw.lower() in model.lower() for kw in self.vision_keywords)
+    
+    async def list_models(self, api_key):
+        return list(self.default_models)
+    
+    async def complete(self, api_key, model, messages, image=None, usage=None):
+        """応答テキストを返す。image は ImageData、usage を渡すとトークン使用量を書き込む"""
+        raise NotImplementedError
+    
+    async def stream(self, api_key, model, messages, image=None, usage=None):
+        """テキストの差分を順に返す（未対応の場合は一括で返す）"""
+        yield await self.complete(api_key, model, messages, image, usage)
+    
+    async def aclose(self):
+        """エンジン停止時に保持しているクライアントを閉じる"""
+    
+    async def request(self, call, usage=None, on_waiting=None, max_wait=None, model='', operation=''):
+        """キープールから割り当てたキーで call(api_key, usage) を実行する
+        
+        レート制限・認証エラーの場合は、まだ試していないキーで再試行する。
+        接続エラー・一時的なサーバーエラーの場合は、接続が回復するまで待って同じリクエストをやり直す。
+        on_waiting(error) は接続待ちに入るときにエラーを、抜けるときに None を渡して呼ばれる。
+        成功したリクエストの使用量は usage に加算する。max_wait で接続待ちの上限を上書きできる。
+        結果（使用量・コスト・エラー）は model / operation とともに使用量ストアに記録する。
+        """
+        call_usage = {}
+        started = time.perf_counter()
+        try:
+            with PROFILER.async_span("request", track=True, provider=self.name, model=model, operation=operation):
+                result = await self._request_with_retry(call, call_usage, on_waiting, max_wait)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._log_usage(model, operation, call_usage, time.perf_counter() - started, str(e))
+            raise
+        await self._log_usage(model, operation, call_usage, time.perf_counter() - started)
+        if usage is not None:
+            _add_usage(usage, call_usage)
+        return result
+    
+    async def _log_usage(self, model, operation, usage, latency, error=None):
+        store = get_usage_store()
+        if store is None or self.hidden:
+            return
+        cost = self.estimate_cost(model, usage.get('input_tokens', 0), usage.get('output_tokens', 0))
+        await asyncio.to_thread(store.record, self.name, model, operation, usage, cost, latency, error)
+    
+    async def _request_with_retry(self, call, usage, on_waiting, max_wait):
+        attempts = max(len(self.keys), 1)
+        attempt = 0
+        deadline = None
+        delay = 2
+        while True:
+            with PROFILER.async_span("acquire key"):
+                api_key = await self.keys.acquire()
+            call_usage = {}
+            try:
+                with PROFILER.async_span("call", attempt=attempt):
+                    result = await call(api_key, call_usage)
+            except asyncio.CancelledError:
+                self.keys.release(api_key)
+                raise
+            except Exception as e:
+                if self.keys.release(api_key, error=e) and attempt + 1 < attempts:
+                    attempt += 1
+                    continue
+                if not is_transient_error(e):
+                    raise
+                if deadline is None:
+                    deadline = time.monotonic() + (self.offline_max_wait if max_wait is None else max_wait)
+                if time.monotonic() >= deadline:
+                    raise
+                if on_waiting:
+                    await on_waiting(e)
+                with PROFILER.async_span("wait for network", error=str(e)):
+                    reachable = await self.wait_until_reachable(delay, deadline)
+                if on_waiting:
+                    await on_waiting(None)
+                if not reachable:
+                    raise
+                attempt = 0
+                delay = min(delay * 2, 60)
+                continue
+            self.keys.release(api_key, call_usage.get('input_tokens', 0) + call_usage.get('output_tokens', 0))
+            if usage is not None:
+                _add_usage(usage, call_usage)
+            return result
+    
+    async def wait_until_reachable(self, delay, deadline):
+        """サーバーに接続できるまで待つ。deadline（time.monotonic()）までに回復しなければ False"""
+        while time.monotonic() < deadline:
+            await asyncio.sleep(max(0, min(delay, deadline - time.monotonic())))
+            url = self.health_url or self.base_url
+            if not url or not HTTPX_AVAILABLE:
+                return True
+            try:
+                # ステータスに関係なく応答があれば接続できている
+                await get_engine().http_client().head(url, timeout=5)
+                return True
+            except Exception:
+                delay = min(delay * 2, 60)
+        return False
+    
+    def price(self, model):
+        matches = [prefix for prefix in self.pricing if model.startswith(prefix)]
+        if not matches:
+            return None
+        return self.pricing[max(matches, key=len)]
+    
+    def estimate_cost(self, model, input_tokens, output_tokens):
+        price = self.price(model)
+        if price is None:
+            return 0.0
+        return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+def _messages_to_text(messages):
+    prompt_parts = []
+    for msg in messages:
+        content = msg.get('content', '')
+        if isinstance(content, str):
+            prompt_parts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'text':
+                    prompt_parts.append(part.get('text', ''))
+    return "\n".join(prompt_parts)
+
+
+class ImageData:
+    """ドロップされた画像のバイト列（ディスクからは1回だけ読み込み、表示とアップロードで共有）"""
+    MAGIC_NUMBERS = [
+        (b'\x89PNG', 'image/png'),
+        (b'\xff\xd8', 'image/jpeg'),
+        (b'GIF8', 'image/gif'),
+        (b'BM', 'image/bmp'),
+    ]
+    
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.mime_type = self._detect_mime_type()
+        
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls(path, f.read())
+        
+    def _detect_mime_type(self):
+        if self.data[:4] == b'RIFF' and self.data[8:12] == b'WEBP':
+            return 'image/webp'
+        for magic, mime_type in self.MAGIC_NUMBERS:
+            if self.data.startswith(magic):
+                return mime_type
+        ext = os.path.splitext(self.path.lower())[1]
+        return {
+            '.png': 'image/png',
+            '.jpg': 'image/jpeg',
+            '.jpeg': 'image/jpeg',
+            '.gif': 'image/gif',
+            '.webp': 'image/webp',
+        }.get(ext, 'image/png')
+
+
+class GeminiBackend(ProviderBackend):
+    name = "Gemini"
+    health_url = "https://generativelanguage.googleapis.com/"
+    default_models = ["gemini-2.0-flash-exp", "gemini-1.5-pro", "gemini-1.5-flash"]
+    vision_keywords = ["vision", "pro", "flash", "2.0"]
+    pricing = {
+        "gemini-1.5-flash": (0.075, 0.30),
+        "gemini-1.5-flash-8b": (0.0375, 0.15),
+        "gemini-1.5-pro": (1.25, 5.00),
+        "gemini-2.0-flash": (0.10, 0.40),
+        "gemini-2.0-flash-exp": (0.0, 0.0),
+        "gemini-exp": (0.0, 0.0),
+    }
+    # system_instruction を受け付けないモデル（前方一致）。プレフィックスはユーザーテキストに含める
+    system_instruction_unsupported = ("gemma",)
+    
+    models_endpoint = "https://generativelanguage.googleapis.com/v1beta/models"
+    
+    async def list_models(self, api_key):
+        if not HTTPX_AVAILABLE or not api_key:
+            return list(self.default_models)
+        
+        try:
+            response = await get_engine().http_client().get(
+                self.models_endpoint, params={"key": api_key, "pageSize": 1000}, timeout=10)
+            if response.status_code == 200:
+                model_names = []
+                for model in response.json().get('models', []):
+                    if "generateContent" in model.get('supportedGenerationMethods', []):
+                        name = model['name']
+                        if name.startswith("models/"):
+                            name = name[7:]
+                        model_names.append(name)
+                return model_names if model_names else list(self.default_models)
+        except Exception:
+            pass
+        return list(self.default_models)
+    
+    # 使い回す GenerativeModel の数。モデルは最初のリクエストで非同期クライアント（gRPCチャネル）を保持する
+    MODEL_CACHE_SIZE = 32
+    
+    def __init__(self):
+        super().__init__()
+        self.context_cache = ContextCacheManager()
+        self._models = OrderedDict()
+        
+    def configure(self, config):
+        super().configure(config)
+        self.context_cache.configure(config)
+        self._models.clear()
+        
+    async def aclose(self):
+        self._models.clear()
+    
+    async def _generate(self, api_key, model, messages, image, stream=False):
+        if not GENAI_AVAILABLE:
+            raise Exception("google-generativeai パッケージがインストールされていません")
+        
+        safety_settings = {
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+        }
+        
+        system_instruction, messages = _split_system_messages(messages)
+        prompt = _messages_to_text(messages)
+        if system_instruction and model.startswith(self.system_instruction_unsupported):
+            prompt = system_instruction + "\n\n" + prompt
+            system_instruction = ""
+        cached_content = await self.context_cache.get(api_key, model, system_instruction)
+        if image is not None:
+            # 読み込み済みのバイト列をそのまま送る（再デコードしない）
+            prompt = [prompt, {"mime_type": image.mime_type, "data": image.data}]
+        
+        # 作成済みのモデルは自分のクライアントを保持しているので、configure せずにそのまま使う
+        key = (api_key, model, system_instruction, getattr(cached_content, 'name', None))
+        generative_model = self._models.get(key)
+        task = None
+        if generative_model is None:
+            # genai.configure はグローバル設定（既定のクライアントも作り直される）のため、キャッシュ作成スレッドと
+            # 同じロックを持ったままモデルを作成し、リクエストの最初のステップ（クライアントの確定）まで進めてから解放する
+            await _acquire_genai_configure()
+            try:
+                # ロックを待つ間に同じモデルが作成されていればそれを使う
+                generative_model = self._models.get(key)
+                if generative_model is None:
+                    genai.configure(api_key=api_key)
+                    if cached_content is not None:
+                        generative_model = genai.GenerativeModel.from_cached_content(
+                            cached_content=cached_content, safety_settings=safety_settings)
+                    else:
+                        generative_model = genai.GenerativeModel(
+                            model, safety_settings=safety_settings, system_instruction=system_instruction or None)
+                    task = asyncio.ensure_future(generative_model.generate_content_async(prompt, stream=stream))
+                    try:
+                        await asyncio.sleep(0)
+                    except BaseException:
+                        task.cancel()
+                        raise
+                    if not task.done():
+                        self._models[key] = generative_model
+                        while len(self._models) > self.MODEL_CACHE_SIZE:
+                            self._models.popitem(last=False)
+            finally:
+                _GENAI_CONFIGURE_LOCK.release()
+        if task is None:
+            self._models.move_to_end(key)
+            return await generative_model.generate_content_async(prompt, stream=stream)
+        return await task
+    
+    def _response_text(self, response):
+        result = ""
+        for part in response.parts:
+            if hasattr(part, 'text'):
+                result += part.text
+        return result
+    
+    def _record_usage(self, response, usage):
+        metadata = getattr(response, 'usage_metadata', None)
+        if usage is None or not metadata:
+            return
+        usage['input_tokens'] = getattr(metadata, 'prompt_token_count', 0) or 0
+        usage['output_tokens'] = getattr(metadata, 'candidates_token_count', 0) or 0
+        usage['cached_tokens'] = getattr(metadata, 'cached_content_token_count', 0) or 0
+    
+    async def complete(self, api_key, model, messages, image=None, usage=None):
+        response = await self._generate(api_key, model, messages, image)
+        self._record_usage(response, usage)
+        return self._response_text(response)
+    
+    async def stream(self, api_key, model, messages, image=None, usage=None):
+        response = await self._generate(api_key, model, messages, image, stream=True)
+        async for chunk in response:
+            # 使用量は最後のチャンクの値が最終値になる
+            self._record_usage(chunk, usage)
+            text = self._response_text(chunk)
+            if text:
+                yield text
+
+
+class OpenAICompatibleBackend(ProviderBackend):
+    """OpenAI互換APIのプロバイダー"""
+    models_endpoint = None
+    default_headers = None
+    # system ロールを受け付けないモデル（前方一致）
+    system_role_unsupported = ("o1-mini", "o1-preview")
+    # ストリーミング時に stream_options で使用量を要求するか
+    stream_usage = True
+    
+    def __init__(self):
+        super().__init__()
+        self._clients = {}
+    
+    def _auth_headers(self, api_key):
+        return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    
+    def _models_endpoint(self):
+        return self.models_endpoint
+    
+    def _parse_models(self, data):
+        return [m['id'] for m in data.get('data', [])]
+    
+    async def list_models(self, api_key):
+        endpoint = self._models_endpoint()
+        if not endpoint or not HTTPX_AVAILABLE or (self.requires_api_key and not api_key):
+            return list(self.default_models)
+        
+        try:
+            response = await get_engine().http_client().get(
+                endpoint, headers=self._auth_headers(api_key), timeout=10)
+            if response.status_code == 200:
+                models = self._parse_models(response.json())
+                return models if models else list(self.default_models)
+        except Exception:
+            pass
+        return list(self.default_models)
+    
+    def _client(self, api_key):
+        """APIキーごとのクライアントを使い回す（接続プールを共有するため）"""
+        if not OPENAI_AVAILABLE:
+            raise Exception("openai パッケージがインストールされていません")
+        key = (self.base_url, api_key)
+        if key not in self._clients:
+            self._clients[key] = AsyncOpenAI(
+                api_key=api_key or "not-needed",
+                base_url=self.base_url,
+                default_headers=self.default_headers
+            )
+        return self._clients[key]
+    
+    async def aclose(self):
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+    
+    def _encode_image(self, image):
+        return base64.b64encode(image.data).decode('utf-8')
+    
+    async def _build_messages(self, model, messages, image):
+        if image is not None:
+            base64_image = await asyncio.to_thread(self._encode_image, image)
+            mime_type = image.mime_type
+            return [{
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": _messages_to_text(messages)},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}
+                    }
+                ]
+            }]
+        
+        if model.startswith(self.system_role_unsupported):
+            system, others = _split_system_messages(messages)
+            if system:
+                return [{"role": "user", "content": system + "\n\n" + _messages_to_text(others)}]
+        return messages
+    
+    def _record_usage(self, response_usage, usage):
+        if usage is None or response_usage is None:
+            return
+        usage['input_tokens'] = getattr(response_usage, 'prompt_tokens', 0) or 0
+        usage['output_tokens'] = getattr(response_usage, 'completion_tokens', 0) or 0
+        details = getattr(response_usage, 'prompt_tokens_details', None)
+        usage['cached_tokens'] = (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+    
+    async def complete(self, api_key, model, messages, image=None, usage=None):
+        response = await self._client(api_key).chat.completions.create(
+            model=model,
+            messages=await self._build_messages(model, messages, image),
+            max_tokens=4096,
+        )
+        self._record_usage(response.usage, usage)
+        return response.choices[0].message.content
+    
+    async def stream(self, api_key, model, messages, image=None, usage=None):
+        extra = {"stream_options": {"include_usage": True}} if self.stream_usage else {}
+        response = await self._client(api_key).chat.completions.create(
+            model=model,
+            messages=await self._build_messages(model, messages, image),
+            max_tokens=4096,
+            stream=True,
+            **extra
+        )
+        async for chunk in response:
+            if getattr(chunk, 'usage', None):
+                self._record_usage(chunk.usage, usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class GitHubModelsBackend(OpenAICompatibleBackend):
+    name = "GitHub Models"
+    base_url = "https://models.inference.ai.azure.com"
+    default_models = ["gpt-4o", "gpt-4o-mini", "o1", "o1-mini", "o1-preview"]
+    vision_keywords = ["gpt-4o", "gpt-4-turbo", "o1"]
+    # GitHub Models はレート制限内で無料
+    pricing = {"": (0.0, 0.0)}
+
+
+class OpenRouterBackend(OpenAICompatibleBackend):
+    name = "OpenRouter"
+    base_url = "https://openrouter.ai/api/v1"
+    models_endpoint = "https://openrouter.ai/api/v1/models"
+    default_models = [
+        "google/gemini-2.0-flash-exp:free",
+        "google/gemini-exp-1206:free",
+        "meta-llama/llama-3.3-70b-instruct",
+    ]
+    vision_keywords = ["vision", "gpt-4", "claude-3", "gemini"]
+    default_headers = {
+        "HTTP-Referer": "https://github.com/translator-app",
+        "X-Title": "Multi-Provider Translator"
+    }
+    
+    def __init__(self):
+        super().__init__()
+        self.model_pricing = {}
+    
+    def _parse_models(self, data):
+        models = []
+        for m in data.get('data', []):
+            models.append(m['id'])
+            pricing = m.get('pricing') or {}
+            try:
+                # OpenRouter の価格は 1トークンあたり
+                self.model_pricing[m['id']] = (float(pricing['prompt']) * 1_000_000,
+                                               float(pricing['completion']) * 1_000_000)
+            except (KeyError, TypeError, ValueError):
+                pass
+        free_models = [m for m in models if ':free' in m]
+        paid_models = [m for m in models if ':free' not in m]
+        return free_models + paid_models
+    
+    def price(self, model):
+        if model.endswith(':free'):
+            return (0.0, 0.0)
+        return self.model_pricing.get(model)
+
+
+class CerebrasBackend(OpenAICompatibleBackend):
+    name = "Cerebras"
+    base_url = "https://api.cerebras.ai/v1"
+    models_endpoint = "https://api.cerebras.ai/v1/models"
+    default_models = ["llama-3.3-70b", "llama3.1-70b", "llama3.1-8b"]
+    vision_keywords = []
+    stream_usage = False
+    pricing = {
+        "llama3.1-8b": (0.10, 0.10),
+        "llama3.1-70b": (0.60, 0.60),
+        "llama-3.3-70b": (0.85, 1.20),
+    }
+
+
+class LocalBackend(OpenAICompatibleBackend):
+    """llama.cpp / Ollama / vLLM などローカルのOpenAI互換サーバー"""
+    name = "Local"
+    base_url = "http://localhost:11434/v1"
+    default_models = ["llama3.1:8b", "qwen2.5:7b"]
+    vision_keywords = ["llava", "vision", "-vl", "gemma3"]
+    requires_api_key = False
+    stream_usage = False
+    # 小さなローカルモデルは長い番号付きバッチを崩しやすい
+    batch_token_budget = 800
+    pricing = {"": (0.0, 0.0)}
+    
+    def _models_endpoint(self):
+        return self.base_url.rstrip('/') + "/models"
+
+
+PROVIDERS = {}
+
+
+def register_provider(backend):
+    PROVIDERS[backend.name] = backend
+    return backend
+
+
+class StubBackend(ProviderBackend):
+    """ネットワークを使わないテスト用プロバイダー（ベンチマークの動作確認用）
+    
+    echo は入力をそのまま、upper は大文字にして、単語ごとに遅延を入れながら返す。
+    """
+    name = "Stub"
+    hidden = True
+    requires_api_key = False
+    default_models = ["echo", "upper"]
+    # 単価の計算を確認するための仮の値
+    pricing = {"": (1.0, 2.0)}
+    
+    def __init__(self, latency=0.05, word_delay=0.002):
+        super().__init__()
+        self.latency = latency
+        self.word_delay = word_delay
+        
+    def _respond(self, model, messages):
+        text = _split_system_messages(messages)[1][-1]['content'] if messages else ""
+        return text.upper() if model == "upper" else text
+    
+    async def complete(self, api_key, model, messages, image=None, usage=None):
+        return "".join([delta async for delta in self.stream(api_key, model, messages, image, usage)])
+    
+    async def stream(self, api_key, model, messages, image=None, usage=None):
+        await asyncio.sleep(self.latency)
+        output = self._respond(model, messages)
+        for word in re.findall(r'\S*\s*', output):
+            if word:
+                await asyncio.sleep(self.word_delay)
+                yield word
+        if usage is not None:
+            usage['input_tokens'] = estimate_tokens(_messages_to_text(messages))
+            usage['output_tokens'] = estimate_tokens(output)
+
+
+for _backend in (GeminiBackend(), GitHubModelsBackend(), OpenRouterBackend(), CerebrasBackend(), LocalBackend(),
+                 StubBackend()):
+    register_provider(_backend)
 
 
 class ImageDropTextEdit(QTextEdit):
     """画像ドロップをサポートするカスタムTextEdit"""
+    file_dropped = pyqtSignal(str)
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setAcceptDrops(True)
         self.dropped_image_path = None
+        # 読み込み済みの ImageData（サムネイル生成が終わるまでは None）
+        self.dropped_image = None
+        self._thumbnail_worker = None
         
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
             for url in event.mimeData().urls():
-                if self._is_image_file(url.toLocalFile()):
+                file_path = url.toLocalFile()
+                if self._is_image_file(file_path) or self._is_translatable_file(file_path):
                     event.acceptProposedAction()
                     return
         if event.mimeData().hasText():
@@ -99,8 +1008,11 @@ class ImageDropTextEdit(QTextEdit):
             for url in event.mimeData().urls():
                 file_path = url.toLocalFile()
                 if self._is_image_file(file_path):
-                    self.dropped_image_path = file_path
-                    self._display_image(file_path)
+                    self.load_image(file_path)
+                    event.acceptProposedAction()
+                    return
+                if self._is_translatable_file(file_path):
+                    self.file_dropped.emit(file_path)
                     event.acceptProposedAction()
                     return
         super().dropEvent(event)
@@ -109,266 +1021,1487 @@ class ImageDropTextEdit(QTextEdit):
         image_extensions = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'}
         _, ext = os.path.splitext(file_path.lower())
         return ext in image_extensions
+    
+    def _is_translatable_file(self, file_path):
+        _, ext = os.path.splitext(file_path.lower())
+        return ext in LOCALIZATION_FORMATS or ext in SUBTITLE_FORMATS or ext in DOCUMENT_FORMATS
+        
+    def load_image(self, file_path):
+        self.dropped_image_path = file_path
+        self._display_image(file_path)
         
     def _display_image(self, file_path):
+        # 読み込みとデコードはワーカーで行い、GUIスレッドでは完成したサムネイルを貼るだけにする
+        if self._thumbnail_worker is not None:
+            self._thumbnail_worker.requestInterruption()
+        self.dropped_image = None
         self.clear()
-        pixmap = QPixmap(file_path)
-        if pixmap.isNull():
-            self.setPlainText(f"画像の読み込みに失敗: {file_path}")
-            return
-            
-        max_w = self.width() - 20
-        max_h = self.height() - 20
-        if pixmap.width() > max_w or pixmap.height() > max_h:
-            pixmap = pixmap.scaled(max_w, max_h, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.textCursor().insertHtml(
+            f'<p style="color: #888;">⏳ 画像を読み込み中... {os.path.basename(file_path)}</p>')
+        
+        worker = ThumbnailWorker(file_path, max(self.width() - 20, 1), max(self.height() - 20, 1))
+        worker.finished.connect(lambda result, w=worker: self._on_thumbnail_ready(w, result))
+        worker.error.connect(lambda message, w=worker: self._on_thumbnail_error(w, message))
+        self._thumbnail_worker = worker
+        worker.start()
+        
+    def _on_thumbnail_ready(self, worker, result):
+        if worker is not self._thumbnail_worker:
+            return  # 後から別の画像がドロップされた
+        self._thumbnail_worker = None
+        image, thumbnail = result
+        self.dropped_image = image
         
+        self.clear()
+        # デコード済みのQImageをリソースとして登録し、Qtに元ファイルを再デコードさせない
+        url = QUrl(f"thumb://image/{image.digest}")
+        self.document().addResource(QTextDocument.ImageResource, url, thumbnail)
         cursor = self.textCursor()
-        cursor.insertHtml(f'<p><img src="{file_path}" width="{pixmap.width()}" height="{pixmap.height()}"></p>')
-        cursor.insertHtml(f'<p style="color: #888;">📷 {os.path.basename(file_path)}</p>')
+        cursor.insertHtml(f'<p><img src="{url.toString()}" width="{thumbnail.width()}" height="{thumbnail.height()}"></p>')
+        cursor.insertHtml(f'<p style="color: #888;">📷 {os.path.basename(image.path)}</p>')
+        
+    def _on_thumbnail_error(self, worker, message):
+        if worker is not self._thumbnail_worker:
+            return
+        self._thumbnail_worker = None
+        self.setPlainText(f"画像の読み込みに失敗: {self.dropped_image_path}\n{message}")
         
     def get_dropped_image_path(self):
         return self.dropped_image_path
+    
+    def get_dropped_image(self):
+        return self.dropped_image
         
     def clear_image(self):
+        if self._thumbnail_worker is not None:
+            self._thumbnail_worker.requestInterruption()
+            self._thumbnail_worker = None
         self.dropped_image_path = None
+        self.dropped_image = None
         self.clear()
 
 
-class ModelFetchWorker(QThread):
-    """モデルリスト取得用ワーカー"""
-    finished = pyqtSignal(list)
-    error = pyqtSignal(str)
+class ResultView(QPlainTextEdit):
+    """大きな結果を扱うためのプレーンテキストの結果ビュー
     
-    def __init__(self, provider, api_key, parent=None):
+    全文は一時ファイルに書き出して表示行の開始位置だけを索引に持ち、画面には window_lines 行かつ
+    MAX_WINDOW_BYTES 以内の範囲だけを描画する。スクロールが範囲の端に達したら範囲をずらす。
+    MAX_LINE_CHARS を超える行は表示上だけ折り返す。
+    """
+    MAX_LINE_CHARS = 10000
+    # 描画範囲の上限（UTF-8 のバイト数。文字数はこれを超えない）。改行の少ない長い出力でも描画量を抑える
+    MAX_WINDOW_BYTES = 1 << 20
+    
+    def __init__(self, window_lines=5000, parent=None):
         super().__init__(parent)
-        self.provider = provider
-        self.api_key = api_key
+        self.window_lines = max(window_lines, 100)
+        self._store = tempfile.TemporaryFile()
+        # 描画範囲の書き換えによるスクロールでは範囲をずらさない
+        self._rendering = False
+        self._reset()
+        self.setReadOnly(True)
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll)
+        
+    def _reset(self):
+        self._store.seek(0)
+        self._store.truncate()
+        # 表示行ごとの開始位置（バイト）。最後の行は改行で閉じていない
+        self._offsets = array('q', [0])
+        self._size = 0
+        self._length = 0
+        self._tail_chars = 0
+        self._digest = hashlib.sha1()
+        # 描画中の最初の表示行
+        self._start = 0
+        # 表示上だけ折り返した行があるか
+        self._wrapped = False
+        
+    def _write(self, text):
+        """text を末尾に書き足して索引を更新し、描画用の文字列（表示上の折り返しを含む）を返す"""
+        data = text.encode('utf-8')
+        self._store.seek(0, os.SEEK_END)
+        self._store.write(data)
+        self._digest.update(data)
+        self._length += len(text)
+        
+        pieces = []
+        position = self._size
+        for i, line in enumerate(text.split('\n')):
+            if i:
+                position += 1
+                self._offsets.append(position)
+                self._tail_chars = 0
+                pieces.append('\n')
+            while self._tail_chars + len(line) > self.MAX_LINE_CHARS:
+                head, line = line[:self.MAX_LINE_CHARS - self._tail_chars], line[self.MAX_LINE_CHARS - self._tail_chars:]
+                position += len(head.encode('utf-8'))
+                self._offsets.append(position)
+                self._tail_chars = 0
+                self._wrapped = True
+                pieces.append(head)
+                pieces.append('\n')
+            position += len(line.encode('utf-8'))
+            self._tail_chars += len(line)
+            pieces.append(line)
+        self._size = position
+        return "".join(pieces)
+    
+    def _read_lines(self, first, last):
+        """表示行 first 〜 last - 1 を描画用の文字列で返す"""
+        begin = self._offsets[first]
+        end = self._offsets[last] if last < len(self._offsets) else self._size
+        self._store.seek(begin)
+        data = self._store.read(end - begin)
+        bounds = list(self._offsets[first:last]) + [end]
+        lines = []
+        for a, b in zip(bounds, bounds[1:]):
+            segment = data[a - begin:b - begin]
+            lines.append(segment[:-1] if segment.endswith(b'\n') else segment)
+        return "\n".join(segment.decode('utf-8') for segment in lines)
+    
+    def _line_offset(self, index):
+        return self._offsets[index] if index < len(self._offsets) else self._size
+    
+    def _window_end(self, start):
+        """start から描画できる範囲の終わりの表示行（少なくとも1行）"""
+        last = min(start + self.window_lines, len(self._offsets))
+        limit = self._offsets[start] + self.MAX_WINDOW_BYTES
+        if self._line_offset(last) <= limit:
+            return last
+        return max(start + 1, bisect.bisect_right(self._offsets, limit, start + 1, last) - 1)
+    
+    def _window_start(self, end):
+        """end で終わる範囲として描画できる最初の表示行（少なくとも1行）"""
+        first = max(0, end - self.window_lines)
+        return min(bisect.bisect_left(self._offsets, self._line_offset(end) - self.MAX_WINDOW_BYTES, first, end),
+                   end - 1)
+    
+    def _render(self, start):
+        # 末尾付近では末尾までを描画範囲いっぱいに表示する
+        start = max(0, min(start, self._window_start(len(self._offsets))))
+        end = self._window_end(start)
+        with PROFILER.span("result render", lines=end - start):
+            self._replace_rendered(self._read_lines(start, end))
+        self._start = start
         
-    def run(self):
+    def _replace_rendered(self, text):
+        self._rendering = True
         try:
-            models = self._fetch_models()
-            self.finished.emit(models)
-        except Exception as e:
-            self.error.emit(str(e))
+            super().setPlainText(text)
+        finally:
+            self._rendering = False
+        
+    def _on_scroll(self, value):
+        if self._rendering:
+            return
+        # スクロールバーの値は折り返し後の行単位のため、先頭に表示中の行で判定する
+        first = self.firstVisibleBlock().blockNumber()
+        # 描画範囲はバイト数でも制限されるため、実際に描画している行数を基準にする
+        rendered = self.blockCount()
+        margin = max(rendered // 10, 1)
+        step = max(rendered // 2, 1)
+        top = self._start + first
+        if first >= rendered - margin and self._start + rendered < len(self._offsets):
+            self._render(self._start + step)
+        elif first < margin and self._start > 0:
+            # 表示中の行が新しい範囲に収まるよう、範囲の終わりから開始行を決める
+            start = self._window_start(min(top + step, len(self._offsets)))
+            if start >= self._start:
+                return
+            self._render(start)
+        else:
+            return
+        # 範囲をずらしても同じ行を表示し続ける
+        self._rendering = True
+        self.verticalScrollBar().setValue(self.document().findBlockByNumber(top - self._start).firstLineNumber())
+        self._rendering = False
+        
+    def set_text(self, text):
+        """全文を置き換えて先頭から表示する（同じ内容なら何もしない）"""
+        if len(text) == self._length and hashlib.sha1(text.encode('utf-8')).digest() == self._digest.digest():
+            return
+        self._reset()
+        display = self._write(text)
+        if len(self._offsets) <= self.window_lines and self._size <= self.MAX_WINDOW_BYTES:
+            self._replace_rendered(display)
+        else:
+            self._render(0)
             
-    def _fetch_models(self):
-        provider_config = PROVIDERS[self.provider]
+    def setPlainText(self, text):
+        self.set_text(text)
         
-        if self.provider == "Gemini":
-            return self._fetch_gemini_models()
-        elif self.provider == "OpenRouter":
-            return self._fetch_openrouter_models()
-        elif self.provider == "Cerebras":
-            return self._fetch_openai_compatible_models(provider_config)
-        elif self.provider == "GitHub Models":
-            return provider_config['default_models']
+    def clear(self):
+        self.set_text("")
         
-        return provider_config.get('default_models', [])
-    
-    def _fetch_gemini_models(self):
-        if not GENAI_AVAILABLE or not self.api_key:
-            return PROVIDERS["Gemini"]['default_models']
+    def append_text(self, text):
+        """末尾に追加する。末尾を表示中なら描画範囲にも追加して追従する"""
+        if not text:
+            return
+        bar = self.verticalScrollBar()
+        at_bottom = bar.value() >= bar.maximum()
+        shows_end = self._start + self.blockCount() >= len(self._offsets)
+        display = self._write(text)
+        fits = self._window_start(len(self._offsets)) <= self._start
+        if not shows_end or not (at_bottom or fits):
+            # 描画範囲の外。スクロールで末尾に達したときに描画する
+            return
+        self._rendering = True
+        try:
+            cursor = QTextCursor(self.document())
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(display)
+            excess = self._window_start(len(self._offsets)) - self._start
+            if excess > 0:
+                cursor.movePosition(QTextCursor.Start)
+                cursor.movePosition(QTextCursor.NextBlock, QTextCursor.KeepAnchor, excess)
+                cursor.removeSelectedText()
+                self._start += excess
+            if at_bottom:
+                bar.setValue(bar.maximum())
+        finally:
+            self._rendering = False
+            
+    def splice(self, start, end, replacement, text):
+        """描画中の [start, end)（UTF-16 位置）を replacement に置き換え、全文を text にする
         
+        全文を描画していない場合は全体を描き直す。
+        """
+        if self._start or self._wrapped or self.blockCount() < len(self._offsets):
+            self.set_text(text)
+            return
+        self._rendering = True
         try:
-            genai.configure(api_key=self.api_key)
-            models = genai.list_models()
-            model_names = []
-            for model in models:
-                if "generateContent" in model.supported_generation_methods:
-                    name = model.name
-                    if name.startswith("models/"):
-                        name = name[7:]
-                    model_names.append(name)
-            return model_names if model_names else PROVIDERS["Gemini"]['default_models']
-        except Exception:
-            return PROVIDERS["Gemini"]['default_models']
+            cursor = QTextCursor(self.document())
+            cursor.beginEditBlock()
+            cursor.setPosition(start)
+            cursor.setPosition(end, QTextCursor.KeepAnchor)
+            cursor.insertText(replacement)
+            cursor.endEditBlock()
+        finally:
+            self._rendering = False
+        self._reset()
+        self._write(text)
+        if self._wrapped or len(self._offsets) > self.window_lines or self._size > self.MAX_WINDOW_BYTES:
+            self._render(0)
+            
+    def text(self):
+        """全文（表示上の折り返しを含まない）"""
+        self._store.seek(0)
+        return self._store.read().decode('utf-8')
+    
+    def length(self):
+        return self._length
     
-    def _fetch_openrouter_models(self):
-        if not self.api_key:
-            return PROVIDERS["OpenRouter"]['default_models']
+    def save_to(self, path):
+        """全文をメモリに読み込まずにファイルへ書き出す"""
+        self._store.seek(0)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(self._store, f)
+
+
+# 使用量・コストの記録
+class UsageStore(QObject):
+    """リクエストごとの使用量・コスト・レイテンシをSQLiteに記録する時系列ストア
+    
+    エンジンのスレッドプールから record() され、ダッシュボードと予算の確認ではGUIスレッドから集計する。
+    recorded シグナルはGUIスレッドに届く。
+    """
+    recorded = pyqtSignal()
+    
+    def __init__(self, path, retention_days=400):
+        super().__init__()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ts REAL NOT NULL,
+                    provider TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    input_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0,
+                    cost REAL NOT NULL DEFAULT 0,
+                    latency REAL NOT NULL DEFAULT 0,
+                    error TEXT
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts)")
+            self._conn.execute("DELETE FROM usage WHERE ts < ?", (time.time() - retention_days * 86400,))
+            
+    def record(self, provider, model, operation, usage, cost, latency, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO usage (ts, provider, model, operation, input_tokens, output_tokens, cached_tokens, "
+                "cost, latency, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), provider, model, operation, usage.get('input_tokens', 0),
+                 usage.get('output_tokens', 0), usage.get('cached_tokens', 0), cost, latency, error))
+        self.recorded.emit()
         
-        try:
-            response = requests.get(
-                "https://openrouter.ai/api/v1/models",
-                headers={"Authorization": f"Bearer {self.api_key}"},
-                timeout=10
-            )
-            if response.status_code == 200:
-                data = response.json()
-                models = [m['id'] for m in data.get('data', [])]
-                free_models = [m for m in models if ':free' in m]
-                paid_models = [m for m in models if ':free' not in m]
-                return free_models + paid_models if models else PROVIDERS["OpenRouter"]['default_models']
-        except Exception:
-            pass
-        return PROVIDERS["OpenRouter"]['default_models']
+    def _query(self, sql, args=()):
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [dict(row) for row in rows]
+    
+    _AGGREGATES = """
+        COUNT(*) AS requests,
+        COALESCE(SUM(error IS NOT NULL), 0) AS errors,
+        COALESCE(SUM(input_tokens), 0) AS input_tokens,
+        COALESCE(SUM(output_tokens), 0) AS output_tokens,
+        COALESCE(SUM(cached_tokens), 0) AS cached_tokens,
+        COALESCE(SUM(cost), 0) AS cost,
+        AVG(CASE WHEN error IS NULL THEN latency END) AS latency"""
+    
+    def totals(self, since):
+        return self._query(f"SELECT {self._AGGREGATES} FROM usage WHERE ts >= ?", (since,))[0]
+    
+    def breakdown(self, since):
+        """プロバイダー・モデル・操作ごとの集計（コストの大きい順）"""
+        return self._query(
+            f"SELECT provider, model, operation, {self._AGGREGATES} FROM usage WHERE ts >= ? "
+            "GROUP BY provider, model, operation ORDER BY cost DESC, requests DESC", (since,))
+    
+    def daily(self, since):
+        """日ごと（ローカル時刻）の集計"""
+        return self._query(
+            f"SELECT date(ts, 'unixepoch', 'localtime') AS day, {self._AGGREGATES} FROM usage WHERE ts >= ? "
+            "GROUP BY day ORDER BY day", (since,))
     
-    def _fetch_openai_compatible_models(self, provider_config):
-        endpoint = provider_config.get('models_endpoint')
-        if not endpoint or not self.api_key:
-            return provider_config['default_models']
+    def spend_since(self, since):
+        return self.totals(since)['cost']
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_usage_store = None
+
+
+def open_usage_store(path):
+    """使用量の記録先を開く。開いていない間（常駐インスタンスへの転送など）は記録しない"""
+    global _usage_store
+    if _usage_store is None:
+        _usage_store = UsageStore(path)
+    return _usage_store
+
+
+def get_usage_store():
+    return _usage_store
+
+
+def usage_period_start(period):
+    """集計期間の開始時刻（ローカル時刻の0時）。period は today / 7d / 30d / month"""
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'month':
+        start = start.replace(day=1)
+    elif period == '7d':
+        start -= timedelta(days=6)
+    elif period == '30d':
+        start -= timedelta(days=29)
+    return start.timestamp()
+
+
+def usage_bar(value, maximum, width=20):
+    if maximum <= 0:
+        return ""
+    filled = min(value / maximum, 1) * width
+    return "█" * int(filled) + ("▌" if filled - int(filled) >= 0.5 else "")
+
+
+USAGE_COLUMNS = ["Provider / Model", "Operation", "Requests", "Errors", "Input", "Output", "Cached",
+                 "Cost", "Latency"]
+
+
+def usage_breakdown_rows(rows):
+    """集計結果を表示用の文字列の行にする"""
+    return [[
+        f"{row['provider']} / {row['model']}",
+        row['operation'] or "-",
+        f"{row['requests']:,}",
+        f"{row['errors']:,}",
+        f"{row['input_tokens']:,}",
+        f"{row['output_tokens']:,}",
+        f"{row['cached_tokens']:,}",
+        f"${row['cost']:.4f}",
+        _format_metric(row['latency'], "{:.2f}s"),
+    ] for row in rows]
+
+
+class EngineWorker(QObject):
+    """AsyncEngine 上で実行されるジョブの基底クラス
+    
+    サブクラスは finished / error シグナルと run_async() を定義する。
+    シグナルはGUIスレッドのオブジェクトから発行されるため、接続先はGUIスレッドで実行される。
+    job_queue / job_id を設定すると、実行状態と結果を JobQueue に記録する。
+    """
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.future = None
+        self.job_queue = None
+        self.job_id = None
         
+    def start(self):
+        self.future = get_engine().submit(self._main())
+        return self.future
+    
+    async def _update_job(self, method, *args):
+        if self.job_id is not None:
+            await asyncio.to_thread(getattr(self.job_queue, method), self.job_id, *args)
+    
+    async def _main(self):
         try:
-            response = requests.get(
-                endpoint,
-                headers={"Authorization": f"Bearer {self.api_key}"},
-                timeout=10
-            )
-            if response.status_code == 200:
-                data = response.json()
-                models = [m['id'] for m in data.get('data', [])]
-                return models if models else provider_config['default_models']
-        except Exception:
-            pass
-        return provider_config['default_models']
+            await self._update_job('start')
+            with PROFILER.async_span(type(self).__name__, 'worker', track=True):
+                result = await self.run_async()
+        except asyncio.CancelledError:
+            # ジョブは実行中のまま残り、次回起動時に再実行される
+            raise
+        except Exception as e:
+            await self._update_job('fail', str(e))
+            self.error.emit(str(e))
+        else:
+            await self._update_job('finish', result)
+            self.finished.emit(result)
+            
+    async def run_async(self):
+        raise NotImplementedError
+    
+    def isRunning(self):
+        return self.future is not None and not self.future.done()
+    
+    def requestInterruption(self):
+        if self.future is not None:
+            self.future.cancel()
+
+
+class ModelFetchWorker(EngineWorker):
+    """モデルリスト取得用ワーカー"""
+    finished = pyqtSignal(list)
+    error = pyqtSignal(str)
+    
+    def __init__(self, provider, parent=None):
+        super().__init__(parent)
+        self.provider = provider
+        
+    async def run_async(self):
+        backend = PROVIDERS[self.provider]
+        return await backend.list_models(backend.keys.peek())
+
+
+class ThumbnailCache:
+    """画像内容のハッシュと表示サイズをキーにしたサムネイルのLRUキャッシュ（スレッドセーフ）"""
+    
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        
+    def get(self, key):
+        with self._lock:
+            thumbnail = self._entries.get(key)
+            if thumbnail is not None:
+                self._entries.move_to_end(key)
+            return thumbnail
+        
+    def put(self, key, thumbnail):
+        with self._lock:
+            self._entries[key] = thumbnail
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+THUMBNAIL_CACHE = ThumbnailCache()
 
 
-class APIWorker(QThread):
+class ThumbnailWorker(EngineWorker):
+    """画像の読み込みとサムネイル生成用ワーカー
+    
+    QPixmap はGUIスレッド専用のため、スレッドプール上では QImage にデコードする。
+    QImageReader に縮小後のサイズを指定すると、JPEGなどは縮小しながらデコードされる。
+    """
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+    
+    def __init__(self, path, max_width, max_height, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.max_width = max_width
+        self.max_height = max_height
+        
+    async def run_async(self):
+        return await asyncio.to_thread(self._load)
+    
+    def _load(self):
+        image = ImageData.load(self.path)
+        key = (image.digest, self.max_width, self.max_height)
+        thumbnail = THUMBNAIL_CACHE.get(key)
+        if thumbnail is None:
+            with PROFILER.span("decode thumbnail", 'image', bytes=len(image.data)):
+                thumbnail = self._decode(image.data)
+            THUMBNAIL_CACHE.put(key, thumbnail)
+        return image, thumbnail
+    
+    def _decode(self, data):
+        buffer = QBuffer()
+        buffer.setData(QByteArray(data))
+        buffer.open(QIODevice.ReadOnly)
+        reader = QImageReader(buffer)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if size.isValid() and (size.width() > self.max_width or size.height() > self.max_height):
+            reader.setScaledSize(size.scaled(self.max_width, self.max_height, Qt.KeepAspectRatio))
+        # アニメーションGIFなどは先頭フレームのみ
+        thumbnail = reader.read()
+        if thumbnail.isNull():
+            raise ValueError(reader.errorString())
+        return thumbnail
+
+
+class APIWorker(EngineWorker):
     """API呼び出し用ワーカー"""
     finished = pyqtSignal(str)
+    partial = pyqtSignal(str)
     error = pyqtSignal(str)
+    # 接続エラーで回復待ちに入った（エラーメッセージ）
+    retrying = pyqtSignal(str)
     
-    def __init__(self, provider, api_key, model, messages, image_path=None, parent=None):
+    def __init__(self, provider, model, messages, image=None,
+                 glossary=None, source_text=None, parent=None):
         super().__init__(parent)
         self.provider = provider
-        self.api_key = api_key
         self.model = model
         self.messages = messages
-        self.image_path = image_path
+        self.image = image
+        # 用語集を適用する場合の原文（翻訳のみ）
+        self.glossary = glossary
+        self.source_text = source_text
+        # このワーカーで行った全リクエストの合計使用量
+        self.usage = {}
+        # 使用量の記録で使う操作名
+        self.operation = ""
+        
+    async def run_async(self):
+        entries = self.glossary.match(self.source_text) if self.glossary and self.source_text else []
+        messages = self.glossary.inject(self.messages, entries) if entries else self.messages
+        
+        backend = PROVIDERS[self.provider]
+        if not backend.supports_streaming:
+            result = await self._complete(messages, self.image)
+        else:
+            async def stream(api_key, usage):
+                parts = []
+                try:
+                    async for delta in backend.stream(api_key, self.model, messages, self.image, usage):
+                        if not parts:
+                            PROFILER.instant("first token")
+                        parts.append(delta)
+                        self.partial.emit(delta)
+                except Exception as e:
+                    if parts:
+                        # 途中まで表示済みのため、別のキーでやり直さない
+                        raise Exception(str(e)) from e
+                    raise
+                return "".join(parts)
+            result = await self._with_key(stream)
         
-    def run(self):
+        if entries:
+            result = await self._enforce_glossary(self.source_text, result, entries)
+        return result
+    
+    async def _complete(self, messages, image=None):
+        backend = PROVIDERS[self.provider]
+        return await self._with_key(
+            lambda api_key, usage: backend.complete(api_key, self.model, messages, image, usage))
+    
+    async def _with_key(self, request):
+        return await PROVIDERS[self.provider].request(request, self.usage, self._on_waiting,
+                                                      model=self.model, operation=self.operation)
+    
+    async def _on_waiting(self, error):
+        if error is not None:
+            self.retrying.emit(str(error))
+            await self._update_job('set_state', JobQueue.WAITING)
+        else:
+            await self._update_job('set_state', JobQueue.RUNNING)
+    
+    async def _complete_with_glossary(self, messages, source_text):
+        entries = self.glossary.match(source_text) if self.glossary else []
+        result = await self._complete(self.glossary.inject(messages, entries) if entries else messages)
+        if entries:
+            result = await self._enforce_glossary(source_text, result, entries)
+        return result
+    
+    async def _enforce_glossary(self, source_text, result, entries):
+        """必須訳語が欠けていれば、欠けた用語だけを示して修正を依頼する"""
+        for _ in range(self.glossary.max_retries):
+            missing = self.glossary.verify(result, entries)
+            if not missing:
+                break
+            prompt = GLOSSARY_FIX_PROMPT.format(
+                terms=self.glossary.format_entries(missing), source=source_text, translation=result)
+            result = await self._complete([{"role": "user", "content": prompt}]) or result
+        return result
+
+
+# ローカルOCR
+_tesseract_installed = None
+
+
+def ocr_available():
+    """pytesseract と tesseract 本体の両方が使えるか（本体の確認結果はキャッシュする）"""
+    global _tesseract_installed
+    if not PYTESSERACT_AVAILABLE:
+        return False
+    if _tesseract_installed is None:
         try:
-            if PROVIDERS[self.provider]['api_type'] == 'gemini':
-                result = self._call_gemini()
-            else:
-                result = self._call_openai_compatible()
-            self.finished.emit(result)
-        except Exception as e:
-            self.error.emit(str(e))
+            pytesseract.get_tesseract_version()
+            _tesseract_installed = True
+        except Exception:
+            _tesseract_installed = False
+    return _tesseract_installed
+
+
+def _join_ocr_words(words):
+    # 日本語などは1文字ずつ単語として返るため、全角文字同士の間には空白を入れない
+    text = ""
+    for word in words:
+        if text and not (ord(text[-1]) >= 0x2E80 and ord(word[0]) >= 0x2E80):
+            text += " "
+        text += word
+    return text
+
+
+def run_ocr(image, languages='eng'):
+    """画像の文字を読み取り (テキスト, 信頼度 0〜100) を返す
     
-    def _call_gemini(self):
-        if not GENAI_AVAILABLE:
-            raise Exception("google-generativeai パッケージがインストールされていません")
+    信頼度は単語ごとの信頼度を文字数で重み付けした平均。
+    """
+    with PIL.Image.open(io.BytesIO(image.data)) as picture:
+        data = pytesseract.image_to_data(picture, lang=languages, output_type=pytesseract.Output.DICT)
+    
+    lines = OrderedDict()
+    total = weight = 0.0
+    for i, word in enumerate(data['text']):
+        word = word.strip()
+        confidence = float(data['conf'][i])
+        if not word or confidence < 0:
+            continue
+        paragraph = (data['block_num'][i], data['par_num'][i])
+        lines.setdefault(paragraph, OrderedDict()).setdefault(data['line_num'][i], []).append(word)
+        total += confidence * len(word)
+        weight += len(word)
         
-        genai.configure(api_key=self.api_key)
+    paragraphs = ["\n".join(_join_ocr_words(words) for words in paragraph_lines.values())
+                  for paragraph_lines in lines.values()]
+    return "\n\n".join(paragraphs), (total / weight if weight else 0.0)
+
+
+class ImageTranslateWorker(APIWorker):
+    """画像翻訳用ワーカー
+    
+    ローカルOCRで十分な信頼度で読み取れた場合は、読み取ったテキストだけを通常の翻訳として送る。
+    読み取れなかった場合は、ビジョン対応モデルなら画像をそのまま送る。min_confidence=None でOCRを使わない。
+    """
+    
+    def __init__(self, provider, model, image, translate_prompt, image_prompt,
+                 ocr_languages='eng', min_confidence=80, glossary=None, parent=None):
+        super().__init__(provider, model, [], image, glossary=glossary, parent=parent)
+        self.translate_prompt = translate_prompt
+        self.image_prompt = image_prompt
+        self.ocr_languages = ocr_languages
+        self.min_confidence = min_confidence
+        self.ocr_confidence = None
         
-        safety_settings = {
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-        }
+    async def run_async(self):
+        text = ""
+        if self.min_confidence is not None and ocr_available():
+            try:
+                with PROFILER.async_span("ocr"):
+                    text, self.ocr_confidence = await asyncio.to_thread(run_ocr, self.image, self.ocr_languages)
+            except Exception:
+                # 言語データがない・画像形式が未対応など。ビジョンに任せる
+                text, self.ocr_confidence = "", None
+            
+        if text and self.ocr_confidence >= self.min_confidence:
+            # 画像翻訳プロンプトと同じく、元テキストと翻訳の両方を表示する
+            header = f"{text}\n\n---\n\n"
+            self.partial.emit(header)
+            self.messages = build_prompt_messages(self.translate_prompt, text)
+            self.source_text = text
+            self.image = None
+            return header + await super().run_async()
         
-        model = genai.GenerativeModel(self.model, safety_settings=safety_settings)
+        if not PROVIDERS[self.provider].supports_vision(self.model):
+            if self.ocr_confidence is None:
+                raise Exception("このモデルは画像に対応していません（OCRも利用できません）")
+            raise Exception(f"OCRの信頼度が低く（{self.ocr_confidence:.0f}%）、このモデルは画像に対応していません")
+        self.messages = [{"role": "user", "content": self.image_prompt}]
+        return await super().run_async()
+
+
+class GlossaryLoadWorker(EngineWorker):
+    """用語集の読み込み用ワーカー"""
+    finished = pyqtSignal(object)
+    error = pyqtSignal(str)
+    
+    def __init__(self, path, target_lang='', max_retries=1, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.target_lang = target_lang
+        self.max_retries = max_retries
         
-        prompt_parts = []
-        for msg in self.messages:
-            content = msg.get('content', '')
-            if isinstance(content, str):
-                prompt_parts.append(content)
-            elif isinstance(content, list):
-                for part in content:
-                    if part.get('type') == 'text':
-                        prompt_parts.append(part.get('text', ''))
+    async def run_async(self):
+        return await asyncio.to_thread(
+            Glossary.load, self.path, self.target_lang, max_retries=self.max_retries)
+
+
+class BatchTranslateWorker(APIWorker):
+    """ローカライズファイルのバッチ翻訳用ワーカー"""
+    progress = pyqtSignal(int, int)
+    
+    def __init__(self, provider, model, prompt_template, input_path, output_path,
+                 token_budget=1500, max_items=80, context_size=0, concurrency=1, glossary=None, parent=None):
+        super().__init__(provider, model, [], glossary=glossary, parent=parent)
+        self.prompt_template = prompt_template
+        self.input_path = input_path
+        self.output_path = output_path
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self.context_size = context_size
+        self.concurrency = concurrency
         
-        prompt = "\n".join(prompt_parts)
+    async def run_async(self):
+        ext = os.path.splitext(self.input_path.lower())[1]
+        document_class = LOCALIZATION_FORMATS.get(ext) or SUBTITLE_FORMATS[ext]
+        document = await asyncio.to_thread(document_class, self.input_path)
+        translator = BatchTranslator(
+            self._complete,
+            self.prompt_template, self.token_budget, self.max_items,
+            context_size=self.context_size, concurrency=self.concurrency, glossary=self.glossary
+        )
+        translations, failed = await translator.translate(
+            document.texts, self.progress.emit, getattr(document, 'breaks', ()))
+        # 未翻訳の項目は原文のまま残る（.po では msgstr を空のままにする）
+        await asyncio.to_thread(document.save, self.output_path, translations, failed)
         
-        if self.image_path and PIL_AVAILABLE:
-            image = PIL.Image.open(self.image_path)
-            response = model.generate_content([prompt, image])
+        summary = [
+            f"✓ {len(document.texts) - len(failed)} / {len(document.texts)} 件を翻訳しました "
+            f"({translator.request_count} リクエスト)",
+            f"出力: {self.output_path}",
+        ]
+        if failed:
+            summary.append(f"\n⚠️ 未翻訳のまま残した項目 ({len(failed)} 件):")
+            summary += [f"  {document.keys[i]}" for i in failed[:50]]
+        return "\n".join(summary)
+
+
+DOCUMENT_FORMATS = {'.txt', '.md', '.html', '.htm', '.pdf'}
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """HTMLを逐次パースして本文テキストを取り出す"""
+    BLOCK_TAGS = {'p', 'div', 'section', 'article', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+                  'ul', 'ol', 'table', 'blockquote', 'pre', 'header', 'footer'}
+    LINE_TAGS = {'br', 'li', 'tr'}
+    SKIP_TAGS = {'script', 'style', 'head'}
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+        
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP_TAGS:
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n\n')
+        elif tag in self.LINE_TAGS:
+            self.parts.append('\n')
+            
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append('\n\n')
+            
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(re.sub(r'\s+', ' ', data))
+            
+    def pop_text(self):
+        text = "".join(self.parts)
+        self.parts = []
+        return re.sub(r'\n{3,}', '\n\n', text)
+
+
+class DocumentReader:
+    """大きなテキスト系ファイルをストリーミングで読み込み、チャンクに分割"""
+    READ_SIZE = 64 * 1024
+    
+    def __init__(self, path):
+        self.path = path
+        self.ext = os.path.splitext(path.lower())[1]
+        self.position = 0
+        self.total = os.path.getsize(path) or 1
+        
+    def _detect_encoding(self):
+        with open(self.path, 'rb') as f:
+            head = f.read(self.READ_SIZE)
+        if head.startswith(b'\xef\xbb\xbf'):
+            return 'utf-8-sig'
+        try:
+            codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            return 'cp932'
+    
+    def _iter_raw_text(self):
+        decoder = codecs.getincrementaldecoder(self._detect_encoding())(errors='replace')
+        with open(self.path, 'rb') as f:
+            while True:
+                raw = f.readline(self.READ_SIZE)
+                if not raw:
+                    break
+                self.position += len(raw)
+                yield decoder.decode(raw)
+        yield decoder.decode(b'', final=True)
+        
+    def _iter_html(self):
+        parser = _HTMLTextExtractor()
+        for piece in self._iter_raw_text():
+            parser.feed(piece)
+            yield parser.pop_text()
+        parser.close()
+        yield parser.pop_text()
+        
+    def _iter_pdf(self):
+        if not PYPDF_AVAILABLE:
+            raise Exception("pypdf パッケージがインストールされていません")
+        reader = pypdf.PdfReader(self.path)
+        self.total = len(reader.pages) or 1
+        for index, page in enumerate(reader.pages):
+            self.position = index + 1
+            yield (page.extract_text() or '') + '\n\n'
+            
+    def iter_text(self):
+        if self.ext == '.pdf':
+            return self._iter_pdf()
+        if self.ext in ('.html', '.htm'):
+            return self._iter_html()
+        return self._iter_raw_text()
+    
+    def chunks(self, chunk_chars):
+        """段落境界でおよそ chunk_chars 文字ずつに区切ったチャンクを返す"""
+        buffer, size = [], 0
+        for piece in self.iter_text():
+            if not piece:
+                continue
+            buffer.append(piece)
+            size += len(piece)
+            while size >= chunk_chars:
+                text = "".join(buffer)
+                cut = self._find_break(text, chunk_chars)
+                if not cut:
+                    buffer = [text]
+                    break
+                yield text[:cut]
+                rest = text[cut:]
+                buffer, size = [rest], len(rest)
+        tail = "".join(buffer)
+        if tail:
+            yield tail
+            
+    def _find_break(self, text, chunk_chars):
+        limit = min(len(text), chunk_chars * 2)
+        for sep in ('\n\n', '\n', '。', '. '):
+            cut = text.rfind(sep, chunk_chars // 4, limit)
+            if cut != -1:
+                return cut + len(sep)
+        return chunk_chars if len(text) >= chunk_chars * 2 else None
+
+
+class DocumentTranslateWorker(APIWorker):
+    """大きな文書ファイルのストリーミング翻訳用ワーカー"""
+    chunk_translated = pyqtSignal(str)
+    progress = pyqtSignal(int)
+    
+    def __init__(self, provider, model, prompt_template, input_path, output_path,
+                 chunk_chars=4000, concurrency=4, glossary=None, parent=None):
+        super().__init__(provider, model, [], glossary=glossary, parent=parent)
+        self.prompt_template = prompt_template
+        self.input_path = input_path
+        self.output_path = output_path
+        self.chunk_chars = chunk_chars
+        self.concurrency = concurrency
+        
+    async def _translate_chunk(self, chunk):
+        body = chunk.strip()
+        if not body:
+            return chunk, False
+        translated = await self._complete_with_glossary(build_prompt_messages(self.prompt_template, body), body) or ''
+        # 段落区切りの空白は原文のまま残す
+        head = chunk[:len(chunk) - len(chunk.lstrip())]
+        tail = chunk[len(chunk.rstrip()):]
+        return head + translated.strip() + tail, True
+        
+    async def run_async(self):
+        reader = DocumentReader(self.input_path)
+        chunks = reader.chunks(self.chunk_chars)
+        # 先読みするチャンク数を制限し、訳文は原文の順に書き出す
+        pending = deque()
+        exhausted = False
+        count = 0
+        try:
+            with open(self.output_path, 'w', encoding='utf-8') as out:
+                while True:
+                    while not exhausted and len(pending) < self.concurrency:
+                        chunk = await asyncio.to_thread(next, chunks, None)
+                        if chunk is None:
+                            exhausted = True
+                        else:
+                            pending.append((asyncio.ensure_future(self._translate_chunk(chunk)), reader.position))
+                    if not pending:
+                        break
+                    task, position = pending.popleft()
+                    chunk, translated = await task
+                    count += translated
+                    out.write(chunk)
+                    out.flush()
+                    self.chunk_translated.emit(chunk)
+                    self.progress.emit(min(100, position * 100 // reader.total))
+        finally:
+            for task, _ in pending:
+                task.cancel()
+        return f"✓ 完了しました ({count} チャンク)\n出力: {self.output_path}"
+
+
+PARAGRAPH_SEPARATOR = "\n\n"
+
+
+def split_paragraphs(text):
+    """空行区切りで段落に分割（空の段落は除く）"""
+    return [p.strip() for p in re.split(r'\n[ \t]*\n', text) if p.strip()]
+
+
+def _utf16_len(text):
+    # QTextCursor の位置は UTF-16 コード単位で数える
+    return len(text.encode('utf-16-le')) // 2
+
+
+class LiveTranslator(QObject):
+    """入力中のテキストを段落単位でインクリメンタルに翻訳
+    
+    段落は内容のハッシュで識別し、変更された段落だけをリクエストする。
+    同時に送るリクエストは live_concurrency 件までで、残りは先頭の段落から順に待たせる。
+    翻訳済みの段落はメモリ上のキャッシュから返し、結果ビューは変わった範囲だけを書き換える。
+    """
+    
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.errors = {}
+        self.paragraphs = []
+        self.rendered = []
+        self._revision = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.refresh)
+        
+    def schedule(self):
+        self.timer.start(self.app.config.get('live_debounce_ms', 800))
+        
+    def stop(self):
+        self.timer.stop()
+        for worker in self.pending.values():
+            worker.requestInterruption()
+        self.pending.clear()
+        self.rendered = []
+        self._revision = None
+        
+    def _key(self, provider, model, template, paragraph):
+        data = "\0".join((provider, model, template, paragraph))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+    
+    def refresh(self):
+        app = self.app
+        if app.source_text.get_dropped_image_path():
+            return
+        provider = app.config['provider']
+        model = app.current_model()
+        if not model or not PROVIDERS[provider].has_credentials():
+            return
+        
+        template = app.config['translate_prompt']
+        self.paragraphs = [(self._key(provider, model, template, p), p)
+                           for p in split_paragraphs(app.source_text.toPlainText())]
+        current = {key for key, _ in self.paragraphs}
+        
+        # 編集で不要になった段落のリクエストは取り消す
+        for key in [k for k in self.pending if k not in current]:
+            self.pending.pop(key).requestInterruption()
+            
+        for key, paragraph in self.paragraphs:
+            if key in self.cache or key in self.pending:
+                continue
+            self.errors.pop(key, None)
+            worker = APIWorker(provider, model, build_prompt_messages(template, paragraph),
+                               glossary=app.glossary, source_text=paragraph)
+            worker.operation = "ライブ翻訳"
+            worker.finished.connect(lambda r, k=key: self._on_done(k, r))
+            worker.error.connect(lambda e, k=key: self._on_error(k, e))
+            self.pending[key] = worker
+        self._start_pending()
+            
+        if self.pending:
+            app.status_label.setText(f"🔄 Live {len(self.pending)} 段落...")
+        self.render()
+        
+    def _start_pending(self):
+        """実行中のリクエストが live_concurrency 件になるまで、待機中の段落を順に開始する"""
+        limit = max(1, self.app.config.get('live_concurrency', 3))
+        running = sum(1 for worker in self.pending.values() if worker.future is not None)
+        for worker in self.pending.values():
+            if running >= limit:
+                break
+            if worker.future is None:
+                worker.start()
+                running += 1
+        
+    def _on_done(self, key, result):
+        if self.pending.pop(key, None) is None:
+            return
+        self._start_pending()
+        self.cache[key] = (result or '').strip()
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.app.config.get('live_cache_size', 2000):
+            self.cache.popitem(last=False)
+        if not self.pending:
+            self.app.status_label.setText("✓ Live")
+        self.render()
+        
+    def _on_error(self, key, error):
+        if self.pending.pop(key, None) is None:
+            return
+        self._start_pending()
+        self.errors[key] = error
+        self.app.status_label.setText(f"⚠️ {error[:30]}")
+        self.render()
+        
+    def render(self):
+        texts = []
+        for index, (key, paragraph) in enumerate(self.paragraphs):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                texts.append(self.cache[key])
+            elif key in self.errors:
+                texts.append("⚠️ 翻訳失敗")
+            elif index < len(self.rendered):
+                # 翻訳待ちの間は同じ位置の直前の表示を残してちらつきを抑える
+                texts.append(self.rendered[index])
+            else:
+                texts.append("⏳")
+        with PROFILER.span("live render", paragraphs=len(texts)):
+            self._patch(texts)
+        
+    def _patch(self, texts):
+        view = self.app.result_text
+        document = view.document()
+        new_text = PARAGRAPH_SEPARATOR.join(texts)
+        if self._revision != document.revision():
+            # 他の操作で結果ビューが書き換えられていたら全体を描き直す
+            view.set_text(new_text)
         else:
-            response = model.generate_content(prompt)
+            old = self.rendered
+            prefix = 0
+            while prefix < min(len(old), len(texts)) and old[prefix] == texts[prefix]:
+                prefix += 1
+            suffix = 0
+            while (suffix < min(len(old), len(texts)) - prefix
+                   and old[len(old) - 1 - suffix] == texts[len(texts) - 1 - suffix]):
+                suffix += 1
+            if prefix == len(old) == len(texts):
+                return
+            
+            old_text = PARAGRAPH_SEPARATOR.join(old)
+            start = min(sum(len(t) + len(PARAGRAPH_SEPARATOR) for t in old[:prefix]), len(old_text), len(new_text))
+            tail = len(PARAGRAPH_SEPARATOR.join(old[len(old) - suffix:])) if suffix else 0
+            tail = min(tail, len(old_text) - start, len(new_text) - start)
+            
+            view.splice(_utf16_len(old_text[:start]), _utf16_len(old_text[:len(old_text) - tail]),
+                        new_text[start:len(new_text) - tail], new_text)
+        self.rendered = texts
+        self._revision = document.revision()
+
+
+DEFAULT_TRANSLATE_PROMPT = "Translate the following text to Japanese. Output only the translation:\n\n{text}"
+
+
+# ベンチマーク
+def agreement_scores(outputs):
+    """各出力と他の出力との類似度（0〜1）の平均。出力が1つ以下なら None"""
+    scores = []
+    for i, output in enumerate(outputs):
+        others = [other for j, other in enumerate(outputs) if j != i and other is not None]
+        if output is None or not others:
+            scores.append(None)
+            continue
+        scores.append(sum(difflib.SequenceMatcher(None, output, other).ratio() for other in others) / len(others))
+    return scores
+
+
+class BenchmarkRunner:
+    """同じ入力を複数のプロバイダー/モデルに並列に送り、速度・コスト・出力を比較する
+    
+    プロバイダー同士は並列に、同じプロバイダー/モデルへの入力は concurrency 件ずつ送る。
+    """
+    
+    def __init__(self, prompt_template, concurrency=2):
+        self.prompt_template = prompt_template
+        self.concurrency = concurrency
         
-        result = ""
-        for part in response.parts:
-            if hasattr(part, 'text'):
-                result += part.text
-        return result
+    async def run(self, targets, inputs, progress=None):
+        """targets は (プロバイダー, モデル) のリスト。結果をレポートの dict で返す"""
+        total = len(targets) * len(inputs)
+        done = 0
+        records = {}
+        
+        async def run_target(target):
+            semaphore = asyncio.Semaphore(self.concurrency)
+            
+            async def run_input(index, text):
+                nonlocal done
+                async with semaphore:
+                    records[(target, index)] = await self._measure(target[0], target[1], text)
+                done += 1
+                if progress:
+                    progress(done, total)
+                    
+            await asyncio.gather(*(run_input(i, text) for i, text in enumerate(inputs)))
+            
+        started = time.perf_counter()
+        await asyncio.gather(*(run_target(target) for target in targets))
+        elapsed = time.perf_counter() - started
+        
+        rows = [[records[(target, i)] for target in targets] for i in range(len(inputs))]
+        # 入力ごとに、各モデルの出力が他のモデルとどれだけ一致しているか
+        for row in rows:
+            scores = await asyncio.to_thread(agreement_scores, [r['output'] for r in row])
+            for record, score in zip(row, scores):
+                record['agreement'] = score
+                
+        return {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'prompt_template': self.prompt_template,
+            'elapsed': elapsed,
+            'inputs': inputs,
+            'targets': [{'provider': p, 'model': m} for p, m in targets],
+            'results': rows,
+            'summary': [self._summarize(target, [row[j] for row in rows]) for j, target in enumerate(targets)],
+        }
+    
+    async def _measure(self, provider, model, text):
+        backend = PROVIDERS[provider]
+        messages = build_prompt_messages(self.prompt_template, text)
+        usage = {}
+        started = time.perf_counter()
+        first_token = None
+        
+        async def call(api_key, call_usage):
+            nonlocal first_token
+            parts = []
+            async for delta in backend.stream(api_key, model, messages, None, call_usage):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                parts.append(delta)
+            return "".join(parts)
+        
+        record = {'provider': provider, 'model': model, 'output': None, 'error': None}
+        try:
+            # 接続待ちの時間は計測に含めたくないため、接続エラーはそのままエラーとして記録する
+            output = await backend.request(call, usage, max_wait=0, model=model, operation="ベンチマーク")
+        except Exception as e:
+            record.update(error=str(e), latency=time.perf_counter() - started)
+            return record
+        latency = time.perf_counter() - started
+        # 使用量を返さないプロバイダーは概算
+        input_tokens = usage.get('input_tokens') or estimate_tokens(_messages_to_text(messages))
+        output_tokens = usage.get('output_tokens') or estimate_tokens(output)
+        record.update(
+            output=output,
+            latency=latency,
+            first_token=first_token,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            tokens_per_second=output_tokens / latency if latency > 0 else 0.0,
+            cost=backend.estimate_cost(model, input_tokens, output_tokens),
+        )
+        return record
+    
+    def _summarize(self, target, records):
+        ok = [r for r in records if r['error'] is None]
+        mean = lambda values: sum(values) / len(values) if values else None
+        return {
+            'provider': target[0],
+            'model': target[1],
+            'requests': len(records),
+            'errors': len(records) - len(ok),
+            'latency': mean([r['latency'] for r in ok]),
+            'first_token': mean([r['first_token'] for r in ok if r['first_token'] is not None]),
+            'tokens_per_second': mean([r['tokens_per_second'] for r in ok]),
+            'cost': sum(r['cost'] for r in ok),
+            'agreement': mean([r['agreement'] for r in ok if r['agreement'] is not None]),
+        }
+
+
+def _format_metric(value, fmt):
+    return "-" if value is None else fmt.format(value)
+
+
+def benchmark_summary_rows(report):
+    """サマリーを表示用の文字列の行にする（GUIの表・Markdown・CLI出力で共通）"""
+    rows = []
+    for summary in report['summary']:
+        rows.append([
+            f"{summary['provider']} / {summary['model']}",
+            _format_metric(summary['latency'], "{:.2f}s"),
+            _format_metric(summary['first_token'], "{:.2f}s"),
+            _format_metric(summary['tokens_per_second'], "{:.1f}"),
+            _format_metric(summary['cost'], "${:.5f}"),
+            _format_metric(summary['agreement'], "{:.0%}"),
+            f"{summary['errors']}/{summary['requests']}",
+        ])
+    return rows
+
+
+BENCHMARK_COLUMNS = ["Provider / Model", "Latency", "First token", "Tokens/s", "Cost", "Agreement", "Errors"]
+
+
+def save_benchmark_report(report, directory):
+    """レポートをJSONとMarkdownで保存し、パスを返す"""
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
     
-    def _call_openai_compatible(self):
-        if not OPENAI_AVAILABLE:
-            raise Exception("openai パッケージがインストールされていません")
-        
-        provider_config = PROVIDERS[self.provider]
+    cell = lambda text: (text or "").replace('|', '\\|').replace('\n', '<br>')
+    lines = [
+        f"# Benchmark {report['created_at']}",
+        "",
+        "| " + " | ".join(BENCHMARK_COLUMNS) + " |",
+        "|" + "---|" * len(BENCHMARK_COLUMNS),
+    ]
+    lines += ["| " + " | ".join(row) + " |" for row in benchmark_summary_rows(report)]
+    lines += ["", "## Outputs", ""]
+    headers = ["Input"] + [f"{t['provider']} / {t['model']}" for t in report['targets']]
+    lines += ["| " + " | ".join(headers) + " |", "|" + "---|" * len(headers)]
+    for text, row in zip(report['inputs'], report['results']):
+        outputs = [cell(r['output']) if r['error'] is None else f"❌ {cell(r['error'])}" for r in row]
+        lines.append("| " + " | ".join([cell(text)] + outputs) + " |")
+    with open(base + '.md', 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return base + '.json', base + '.md'
+
+
+class BenchmarkWorker(EngineWorker):
+    """ベンチマーク実行用ワーカー"""
+    finished = pyqtSignal(object)
+    progress = pyqtSignal(int, int)
+    error = pyqtSignal(str)
+    
+    def __init__(self, targets, inputs, prompt_template, output_dir, concurrency=2, parent=None):
+        super().__init__(parent)
+        self.targets = targets
+        self.inputs = inputs
+        self.prompt_template = prompt_template
+        self.output_dir = output_dir
+        self.concurrency = concurrency
         
-        headers = {}
-        if self.provider == "OpenRouter":
-            headers = {
-                "HTTP-Referer": "https://github.com/translator-app",
-                "X-Title": "Multi-Provider Translator"
-            }
+    async def run_async(self):
+        runner = BenchmarkRunner(self.prompt_template, self.concurrency)
+        report = await runner.run(self.targets, self.inputs, self.progress.emit)
+        report['paths'] = await asyncio.to_thread(save_benchmark_report, report, self.output_dir)
+        return report
+
+
+def app_data_dir():
+    """設定・ログ・データベースの保存先（実行ファイルまたはスクリプトのあるディレクトリ）
+    
+    CLIから常駐インスタンスを起動した場合も、呼び出し元の作業ディレクトリによらず同じ設定を使う。
+    """
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+# 単一インスタンス
+# 最初に起動したプロセスがローカルソケットで待ち受け、以降の起動やCLI呼び出しは
+# リクエストを渡して結果を受け取るだけにする（SDKの読み込みやモデル取得を繰り返さない）
+IPC_SERVER_NAME = f"gtsfh-{getpass.getuser()}"
+IPC_CONNECT_TIMEOUT_MS = 300
+IPC_REPLY_TIMEOUT_MS = 600000
+DAEMON_START_TIMEOUT = 30
+
+
+class InstanceServer(QObject):
+    """1行1リクエストのJSONを受け付け、同じ接続に1行のJSONで応答する
+    
+    二重起動を防ぐため、アプリを作る前に listen() し、リクエストを処理する app は後から設定する。
+    """
+    
+    def __init__(self, app=None):
+        super().__init__(app)
+        self.app = app
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self._on_new_connection)
+        self._buffers = {}
         
-        client = OpenAI(
-            api_key=self.api_key,
-            base_url=provider_config['base_url'],
-            default_headers=headers if headers else None
-        )
+    def listen(self):
+        """待ち受けを開始する。別のインスタンスが待ち受けている場合は False"""
+        if self.server.listen(IPC_SERVER_NAME):
+            return True
+        if instance_running():
+            # 同時に起動した別のインスタンスが先に待ち受けを始めている
+            return False
+        # 前回異常終了したプロセスのソケットが残っている
+        QLocalServer.removeServer(IPC_SERVER_NAME)
+        return self.server.listen(IPC_SERVER_NAME)
+    
+    def close(self):
+        self.server.close()
         
-        messages = self.messages
-        if self.image_path:
-            base64_image = self._encode_image()
-            mime_type = self._get_mime_type()
+    def _on_new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            self._buffers[socket] = b''
+            socket.readyRead.connect(lambda s=socket: self._on_ready_read(s))
+            socket.disconnected.connect(lambda s=socket: self._on_disconnected(s))
             
-            text_content = ""
-            for msg in self.messages:
-                if isinstance(msg.get('content'), str):
-                    text_content = msg['content']
-                    break
+    def _on_ready_read(self, socket):
+        self._buffers[socket] += bytes(socket.readAll())
+        while b'\n' in self._buffers.get(socket, b''):
+            line, self._buffers[socket] = self._buffers[socket].split(b'\n', 1)
+            try:
+                request = json.loads(line.decode('utf-8'))
+            except ValueError:
+                self._reply(socket, {'status': 'error', 'error': "不正なリクエストです"})
+                continue
+            self.app.handle_request(request, lambda reply, s=socket: self._reply(s, reply))
             
-            messages = [{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": text_content},
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}
-                    }
-                ]
-            }]
-        
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            max_tokens=4096,
-        )
+    def _reply(self, socket, reply):
+        if socket not in self._buffers:
+            return  # 応答前に切断された
+        socket.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+        socket.flush()
         
-        return response.choices[0].message.content
+    def _on_disconnected(self, socket):
+        self._buffers.pop(socket, None)
+        socket.deleteLater()
+
+
+def instance_running():
+    """待ち受けているインスタンスがあるか（接続できるかだけを確認する）"""
+    socket = QLocalSocket()
+    socket.connectToServer(IPC_SERVER_NAME)
+    running = socket.waitForConnected(IPC_CONNECT_TIMEOUT_MS)
+    socket.abort()
+    return running
+
+
+def send_request(request):
+    """起動済みのインスタンスにリクエストを送り、応答を返す（起動していなければ None）"""
+    socket = QLocalSocket()
+    socket.connectToServer(IPC_SERVER_NAME)
+    if not socket.waitForConnected(IPC_CONNECT_TIMEOUT_MS):
+        return None
+    socket.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+    socket.waitForBytesWritten(IPC_CONNECT_TIMEOUT_MS)
     
-    def _encode_image(self):
-        with open(self.image_path, "rb") as f:
-            return base64.b64encode(f.read()).decode('utf-8')
+    data = b''
+    while not data.endswith(b'\n') and socket.waitForReadyRead(IPC_REPLY_TIMEOUT_MS):
+        data += bytes(socket.readAll())
+    socket.disconnectFromServer()
+    if not data.endswith(b'\n'):
+        return {'status': 'error', 'error': "インスタンスから応答がありません"}
+    return json.loads(data.decode('utf-8'))
+
+
+def start_daemon():
+    """常駐インスタンスをバックグラウンドで起動し、待ち受けを開始するまで待つ"""
+    if getattr(sys, 'frozen', False):
+        command = [sys.executable, '--daemon']
+    else:
+        command = [sys.executable, os.path.abspath(__file__), '--daemon']
+    if os.name == 'nt':
+        options = {'creationflags': subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        options = {'start_new_session': True}
+    subprocess.Popen(command, cwd=app_data_dir(), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, **options)
     
-    def _get_mime_type(self):
-        ext = os.path.splitext(self.image_path.lower())[1]
-        return {
-            '.png': 'image/png',
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.gif': 'image/gif',
-            '.webp': 'image/webp',
-        }.get(ext, 'image/png')
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if send_request({'command': 'ping'}) is not None:
+            return True
+        time.sleep(0.2)
+    return False
 
 
 class TranslatorApp(QWidget):
-    def __init__(self):
+    def __init__(self, resident=False, instance_server=None):
         super().__init__()
+        # 常駐モードではウィンドウを閉じても終了せず、--quit で終了する
+        self.resident = resident
+        self._quitting = False
         self.config = self.load_config()
+        self._apply_profiling()
         self.window_config = self.load_window_config()
         self.setWindowFlags(Qt.FramelessWindowHint)
         self.resize_corner_size = 20
         self.resizing = False
         self.current_worker = None
         self.model_cache = {}
+        self._result_streaming = False
+        self._configure_providers()
+        self.live_translator = LiveTranslator(self)
+        self.glossary = None
+        self.instance_server = instance_server or InstanceServer()
+        self.instance_server.setParent(self)
+        self.instance_server.app = self
+        self.jobs = JobQueue(os.path.join(app_data_dir(), 'jobs.db'), self.config.get('job_retention_days', 7))
+        # ジョブID → 実行中のワーカー
+        self.active_jobs = {}
+        # 前回終了時に未完了だったジョブ
+        self.replay_jobs = deque(self.jobs.pending())
+        self.usage_store = open_usage_store(os.path.join(app_data_dir(), 'usage.db'))
+        self.usage_store.recorded.connect(self._schedule_budget_check)
+        self._budget_check_pending = False
+        # 予算を超えているか（'downgrade' の場合は代わりのモデルを使う）
+        self.budget_exceeded = False
+        # (予算の設定キー, 期間) → 通知済みの割合
+        self.budget_alerts = {}
         
         # ボタン参照を先に初期化
         self.img_translate_btn = None
         self.describe_btn = None
         self.translate_btn = None
         self.summarize_btn = None
+        self.file_translate_btn = None
+        self.cancel_btn = None
         
         self.initUI()
         self.start_hotkey_listener()
         self.refresh_models()
+        self.load_glossary()
+        self._check_budget()
+        QTimer.singleShot(0, self.resume_jobs)
 
     def load_config(self):
         default_config = {
@@ -378,22 +2511,66 @@ class TranslatorApp(QWidget):
                 'GitHub Models': '',
                 'OpenRouter': '',
                 'Cerebras': '',
+                'Local': '',
             },
             'selected_models': {
                 'Gemini': 'gemini-2.0-flash-exp',
                 'GitHub Models': 'gpt-4o-mini',
                 'OpenRouter': 'google/gemini-2.0-flash-exp:free',
                 'Cerebras': 'llama-3.3-70b',
+                'Local': 'llama3.1:8b',
             },
+            'provider_base_urls': {
+                'Local': LocalBackend.base_url,
+            },
+            # キーごとの1分あたりの上限（例: {"OpenRouter": {"rpm": 20, "tpm": 0}}）
+            'key_rate_limits': {},
             'font_size': 12,
-            'translate_prompt': "Translate the following text to Japanese. Output only the translation:\n\n{text}",
+            'translate_prompt': DEFAULT_TRANSLATE_PROMPT,
             'summarize_prompt': "Summarize the following text in Japanese:\n\n{text}",
             'image_translate_prompt': "この画像内のテキストを全て抽出し、日本語に翻訳してください。元テキストと翻訳の両方を表示してください。",
             'image_describe_prompt': "この画像の内容を詳しく日本語で説明してください。",
+            'batch_token_budget': 1500,
+            'batch_max_items': 80,
+            'document_chunk_chars': 4000,
+            'document_concurrency': 4,
+            'subtitle_context_cues': 3,
+            'subtitle_concurrency': 6,
+            # 結果ビューに一度に描画する行数（全文は一時ファイルに保持）
+            'result_max_blocks': 5000,
+            'context_cache': True,
+            'context_cache_ttl': 3600,
+            'context_cache_min_tokens': 4096,
+            'live_translate': False,
+            'live_debounce_ms': 800,
+            'live_cache_size': 2000,
+            'live_concurrency': 3,
+            'glossary_path': '',
+            'glossary_target_lang': '',
+            'glossary_max_retries': 1,
+            # 画像翻訳のOCR（pytesseract + tesseract がある場合）
+            'ocr_enabled': True,
+            'ocr_languages': 'eng',
+            'ocr_min_confidence': 80,
+            # 接続エラー時に回復を待つ最大秒数（0 で待たない）。待っている間は ⏹ で取り消せる
+            'offline_max_wait': 120,
+            # 再起動時に未完了ジョブを同時に実行する数
+            'job_concurrency': 4,
+            'job_retention_days': 7,
+            # 予算（USD、0 で無効）。超過時の動作は warn（通知のみ）または downgrade（安いモデルに切り替え）
+            'budget_daily_usd': 0,
+            'budget_monthly_usd': 0,
+            'budget_action': 'warn',
+            # downgrade 時に使うモデル（例: {"OpenRouter": "google/gemini-flash-1.5-8b"}、未指定なら最も安いモデル）
+            'budget_fallback_models': {},
+            # パフォーマンス計測（環境変数 GTSFH_PROFILE=1 / cprofile でも有効になる）
+            'profile_enabled': False,
+            'profile_stall_ms': 100,
+            'profile_cprofile': False,
         }
         
         try:
-            with open('config.json', 'r', encoding='utf-8') as f:
+            with open(os.path.join(app_data_dir(), 'config.json'), 'r', encoding='utf-8') as f:
                 config = json.load(f)
             for key, value in default_config.items():
                 if key not in config:
@@ -404,31 +2581,56 @@ class TranslatorApp(QWidget):
                             config[key][k] = v
             return config
         except FileNotFoundError:
-            with open('config.json', 'w', encoding='utf-8') as f:
+            with open(os.path.join(app_data_dir(), 'config.json'), 'w', encoding='utf-8') as f:
                 json.dump(default_config, f, indent=4, ensure_ascii=False)
             return default_config
 
+    def _configure_providers(self):
+        for backend in PROVIDERS.values():
+            backend.configure(self.config)
+
+    def _apply_profiling(self):
+        env = os.environ.get('GTSFH_PROFILE', '')
+        enabled = self.config.get('profile_enabled', False) or env not in ('', '0')
+        if enabled and not PROFILER.enabled:
+            PROFILER.start(self.config.get('profile_stall_ms', 100),
+                           self.config.get('profile_cprofile', False) or env == 'cprofile')
+        elif not enabled and PROFILER.enabled:
+            self.export_profile()
+
+    def export_profile(self, restart=False):
+        """計測を止めてトレースを profile ディレクトリに書き出す（restart=True なら続けて計測する）"""
+        PROFILER.stop()
+        try:
+            paths = PROFILER.export(os.path.join(app_data_dir(), 'profile'))
+            self.status_label.setText(f"⏱ トレースを保存しました: {os.path.basename(paths[0])}")
+        except Exception as e:
+            self.status_label.setText(f"⚠️ トレースの保存に失敗しました: {e}")
+        if restart:
+            PROFILER.start(self.config.get('profile_stall_ms', 100), PROFILER.use_cprofile)
+
     def load_window_config(self):
         try:
-            with open('window_config.json', 'r') as f:
+            with open(os.path.join(app_data_dir(), 'window_config.json'), 'r') as f:
                 return json.load(f)
         except FileNotFoundError:
             return {'width': 850, 'height': 650, 'x': 100, 'y': 100}
 
     def save_config(self):
-        with open('config.json', 'w', encoding='utf-8') as f:
+        path = os.path.join(app_data_dir(), 'config.json')
+        with PROFILER.span("save_config"), open(path, 'w', encoding='utf-8') as f:
             json.dump(self.config, f, indent=4, ensure_ascii=False)
 
     def save_window_config(self):
         config = {'width': self.width(), 'height': self.height(), 'x': self.x(), 'y': self.y()}
-        with open('window_config.json', 'w') as f:
+        with open(os.path.join(app_data_dir(), 'window_config.json'), 'w') as f:
             json.dump(config, f, indent=4)
 
     def initUI(self):
         self.setStyleSheet("""
             QWidget { background-color: #2B2B2B; color: #FFFFFF; }
             QFrame { border: 1px solid #3C3F41; }
-            QTextEdit { background-color: #3C3F41; color: #FFFFFF; border: 1px solid #555; }
+            QTextEdit, QPlainTextEdit { background-color: #3C3F41; color: #FFFFFF; border: 1px solid #555; }
             QPushButton { background-color: #4C5052; color: #FFFFFF; border: 1px solid #555; }
             QPushButton:hover { background-color: #5C6062; }
             QPushButton:disabled { background-color: #3C3F41; color: #888; }
@@ -471,7 +2673,8 @@ class TranslatorApp(QWidget):
         self._move_button_frame_to_bottom(layout)
 
         self.apply_font_size()
-        self.show()
+        if not self.resident:
+            self.show()
 
     def _create_title_bar(self, layout):
         title_bar = QFrame(self)
@@ -569,6 +2772,21 @@ class TranslatorApp(QWidget):
         self.describe_btn.clicked.connect(self.describe_image)
         button_layout.addWidget(self.describe_btn)
 
+        self.file_translate_btn = QPushButton("📂")
+        self.file_translate_btn.setFixedSize(45, 45)
+        self.file_translate_btn.setStyleSheet(btn_style)
+        self.file_translate_btn.setToolTip("ファイル翻訳 (.po / .json / .strings / .srt / .vtt / .txt / .md / .html / .pdf)")
+        self.file_translate_btn.clicked.connect(lambda: self.translate_file())
+        button_layout.addWidget(self.file_translate_btn)
+
+        self.cancel_btn = QPushButton("⏹")
+        self.cancel_btn.setFixedSize(45, 45)
+        self.cancel_btn.setStyleSheet(btn_style)
+        self.cancel_btn.setToolTip("実行中のリクエストを取り消す")
+        self.cancel_btn.setEnabled(False)
+        self.cancel_btn.clicked.connect(self.cancel_current)
+        button_layout.addWidget(self.cancel_btn)
+
         button_layout.addStretch()
 
         shortcut_label = QLabel("Ctrl+Alt+T: クイック翻訳")
@@ -595,7 +2813,7 @@ class TranslatorApp(QWidget):
 
         control_layout.addWidget(QLabel("Provider:"))
         self.provider_combo = QComboBox()
-        self.provider_combo.addItems(PROVIDERS.keys())
+        self.provider_combo.addItems([name for name, backend in PROVIDERS.items() if not backend.hidden])
         self.provider_combo.setCurrentText(self.config['provider'])
         self.provider_combo.setFixedWidth(120)
         self.provider_combo.currentTextChanged.connect(self.on_provider_changed)
@@ -615,6 +2833,18 @@ class TranslatorApp(QWidget):
         refresh_btn.clicked.connect(self.refresh_models)
         control_layout.addWidget(refresh_btn)
 
+        benchmark_btn = QPushButton("📊")
+        benchmark_btn.setFixedWidth(35)
+        benchmark_btn.setToolTip("モデル比較ベンチマーク")
+        benchmark_btn.clicked.connect(self.open_benchmark_dialog)
+        control_layout.addWidget(benchmark_btn)
+
+        usage_btn = QPushButton("💰")
+        usage_btn.setFixedWidth(35)
+        usage_btn.setToolTip("使用量・コスト")
+        usage_btn.clicked.connect(self.open_usage_dialog)
+        control_layout.addWidget(usage_btn)
+
         control_layout.addWidget(QLabel("Font:"))
         self.font_spinner = QSpinBox()
         self.font_spinner.setRange(8, 24)
@@ -623,6 +2853,12 @@ class TranslatorApp(QWidget):
         self.font_spinner.valueChanged.connect(self.update_font_size)
         control_layout.addWidget(self.font_spinner)
 
+        self.live_checkbox = QCheckBox("⚡ Live")
+        self.live_checkbox.setToolTip("入力中に変更された段落だけを自動で翻訳")
+        self.live_checkbox.setChecked(self.config.get('live_translate', False))
+        self.live_checkbox.toggled.connect(self.toggle_live_translate)
+        control_layout.addWidget(self.live_checkbox)
+
         control_layout.addStretch()
 
         self.status_label = QLabel("")
@@ -650,6 +2886,8 @@ class TranslatorApp(QWidget):
 
         self.source_text = ImageDropTextEdit()
         self.source_text.setMinimumHeight(120)
+        self.source_text.file_dropped.connect(self.translate_file)
+        self.source_text.textChanged.connect(self._on_source_changed)
         source_layout.addWidget(self.source_text)
 
     def _create_result_area(self, layout):
@@ -668,12 +2906,16 @@ class TranslatorApp(QWidget):
         copy_btn.setFixedSize(80, 25)
         copy_btn.clicked.connect(self.copy_result)
         header.addWidget(copy_btn)
+
+        save_btn = QPushButton("💾 Save")
+        save_btn.setFixedSize(80, 25)
+        save_btn.clicked.connect(self.save_result)
+        header.addWidget(save_btn)
         header.addStretch()
         result_layout.addLayout(header)
 
-        self.result_text = QTextEdit()
+        self.result_text = ResultView(self.config.get('result_max_blocks', 5000))
         self.result_text.setMinimumHeight(120)
-        self.result_text.setReadOnly(True)
         result_layout.addWidget(self.result_text)
 
     def _update_model_combo(self):
@@ -682,7 +2924,7 @@ class TranslatorApp(QWidget):
         self.model_combo.blockSignals(True)
         self.model_combo.clear()
         
-        models = self.model_cache.get(provider, PROVIDERS[provider]['default_models'])
+        models = self.model_cache.get(provider, PROVIDERS[provider].default_models)
         self.model_combo.addItems(models)
         
         saved = self.config['selected_models'].get(provider, '')
@@ -700,10 +2942,9 @@ class TranslatorApp(QWidget):
             
         provider = self.config['provider']
         model = self.model_combo.currentText() if hasattr(self, 'model_combo') else ''
-        keywords = PROVIDERS[provider].get('vision_keywords', [])
-        
-        supports_vision = any(kw.lower() in model.lower() for kw in keywords)
-        self.img_translate_btn.setEnabled(supports_vision)
+        supports_vision = PROVIDERS[provider].supports_vision(model)
+        # OCRが使えれば画像翻訳はテキストのみのモデルでも実行できる
+        self.img_translate_btn.setEnabled(supports_vision or (self.config.get('ocr_enabled', True) and ocr_available()))
         self.describe_btn.setEnabled(supports_vision)
 
     def on_provider_changed(self, provider):
@@ -723,15 +2964,14 @@ class TranslatorApp(QWidget):
 
     def refresh_models(self):
         provider = self.config['provider']
-        api_key = self.config['api_keys'].get(provider, '')
         
-        if not api_key:
+        if not PROVIDERS[provider].has_credentials():
             self.status_label.setText("⚠️ APIキー未設定")
             return
         
         self.status_label.setText("🔄 モデル取得中...")
         
-        self.model_worker = ModelFetchWorker(provider, api_key)
+        self.model_worker = ModelFetchWorker(provider)
         self.model_worker.finished.connect(self._on_models_fetched)
         self.model_worker.error.connect(self._on_models_error)
         self.model_worker.start()
@@ -801,25 +3041,54 @@ class TranslatorApp(QWidget):
         font.setPointSize(size)
         style = f"background-color: #3C3F41; color: #FFFFFF; font-size: {size}pt;"
         
-        self.source_text.setStyleSheet(style)
-        self.source_text.setFont(font)
-        self.result_text.setStyleSheet(style)
-        self.result_text.setFont(font)
+        with PROFILER.span("apply_font_size", size=size):
+            self.source_text.setStyleSheet(style)
+            self.source_text.setFont(font)
+            self.result_text.setStyleSheet(style)
+            self.result_text.setFont(font)
+
+    def toggle_live_translate(self, enabled):
+        self.config['live_translate'] = enabled
+        self.save_config()
+        if enabled:
+            self.live_translator.refresh()
+        else:
+            self.live_translator.stop()
+
+    def _on_source_changed(self):
+        if self.config.get('live_translate'):
+            self.live_translator.schedule()
 
     def clear_source(self):
         self.source_text.clear_image()
 
     def copy_result(self):
-        text = self.result_text.toPlainText()
+        text = self.result_text.text()
         if text:
             QApplication.clipboard().setText(text)
             self.status_label.setText("✓ コピーしました")
 
+    def save_result(self):
+        if not self.result_text.length():
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "結果を保存", "result.txt", "Text (*.txt);;All Files (*)")
+        if not path:
+            return
+        try:
+            self.result_text.save_to(path)
+            self.status_label.setText(f"✓ 保存しました: {os.path.basename(path)}")
+        except Exception as e:
+            self.status_label.setText(f"⚠️ 保存に失敗しました: {e}")
+
     def _set_buttons_enabled(self, enabled):
         if self.translate_btn:
             self.translate_btn.setEnabled(enabled)
         if self.summarize_btn:
             self.summarize_btn.setEnabled(enabled)
+        if self.file_translate_btn:
+            self.file_translate_btn.setEnabled(enabled)
+        if self.cancel_btn:
+            self.cancel_btn.setEnabled(not enabled)
         if enabled:
             self._update_vision_buttons()
         else:
@@ -828,83 +3097,626 @@ class TranslatorApp(QWidget):
             if self.describe_btn:
                 self.describe_btn.setEnabled(False)
 
-    def _call_api(self, prompt, image_path=None, operation=""):
+    def cancel_current(self):
+        """実行中（接続待ちを含む）のリクエストを取り消し、ジョブを失敗として記録する"""
+        worker = self.current_worker
+        if worker is None or not worker.isRunning():
+            return
+        worker.requestInterruption()
+        if worker.job_id is not None:
+            # 取り消したジョブは次回起動時に再実行しない
+            self.jobs.fail(worker.job_id, "キャンセルされました")
+        # 同じジョブを待っているCLIの呼び出しにも結果を返す
+        worker.error.emit("キャンセルされました")
+
+    def _call_api(self, messages, image=None, operation="", source_text=None):
         provider = self.config['provider']
-        api_key = self.config['api_keys'].get(provider, '')
-        model = self.model_combo.currentText()
+        model = self.current_model()
         
-        if not api_key:
-            self.result_text.setText("❌ APIキーが設定されていません。\nSettingsでAPIキーを設定してください。")
+        if not PROVIDERS[provider].has_credentials():
+            self.result_text.set_text("❌ APIキーが設定されていません。\nSettingsでAPIキーを設定してください。")
             return
         
         if not model:
-            self.result_text.setText("❌ モデルが選択されていません。")
+            self.result_text.set_text("❌ モデルが選択されていません。")
             return
         
-        self.result_text.setText("⏳ 処理中...")
+        job = self._request_job(operation, messages, image, source_text)
+        self._start_api_job(job, operation)
+
+    def _start_api_job(self, job, operation):
+        self.result_text.set_text("⏳ 処理中...")
+        self._result_streaming = False
         self._set_buttons_enabled(False)
         self.status_label.setText(f"🔄 {operation}...")
         
-        messages = [{"role": "user", "content": prompt}]
-        
-        self.current_worker = APIWorker(provider, api_key, model, messages, image_path)
+        self.current_worker = self._worker_for_job(job)
+        self.current_worker.partial.connect(self._on_api_partial)
+        self.current_worker.retrying.connect(self._on_api_retrying)
         self.current_worker.finished.connect(lambda r: self._on_api_success(r, operation))
         self.current_worker.error.connect(self._on_api_error)
-        self.current_worker.start()
+        self._start_job_worker(self.current_worker)
+
+    def _request_job(self, operation, messages, image=None, source_text=None):
+        payload = {
+            'operation': operation,
+            'provider': self.config['provider'],
+            'model': self.current_model(),
+            'messages': messages,
+            'source_text': source_text,
+            'image_path': image.path if image is not None else None,
+            # 用語集を変えたら別のリクエストとして扱う
+            'glossary': self.config.get('glossary_path', '') if self.glossary and source_text else '',
+        }
+        return self.jobs.submit('request', payload, image.data if image is not None else None)
+
+    def _worker_for_job(self, job):
+        """ジョブを実行するワーカーを返す（同じジョブを実行中ならそのワーカー）"""
+        worker = self.active_jobs.get(job['id'])
+        if worker is not None:
+            return worker
+        
+        payload = json.loads(job['payload'])
+        provider, model = payload['provider'], payload['model']
+        if job['kind'] == 'request':
+            image = ImageData(payload['image_path'], job['image']) if job['image'] is not None else None
+            worker = APIWorker(provider, model, payload['messages'], image,
+                               glossary=self.glossary, source_text=payload['source_text'])
+        elif job['kind'] == 'image_translate':
+            worker = ImageTranslateWorker(provider, model, ImageData(payload['image_path'], job['image']),
+                                          payload['translate_prompt'], payload['image_prompt'],
+                                          payload['ocr_languages'], payload['ocr_min_confidence'],
+                                          glossary=self.glossary)
+        elif job['kind'] == 'batch':
+            worker = BatchTranslateWorker(provider, model, payload['prompt_template'], payload['input_path'],
+                                          payload['output_path'], glossary=self.glossary, **payload['options'])
+        else:
+            worker = DocumentTranslateWorker(provider, model, payload['prompt_template'], payload['input_path'],
+                                             payload['output_path'], glossary=self.glossary, **payload['options'])
+        worker.operation = payload['operation']
+        worker.job_queue = self.jobs
+        worker.job_id = job['id']
+        self.active_jobs[job['id']] = worker
+        worker.finished.connect(lambda r, job_id=job['id']: self.active_jobs.pop(job_id, None))
+        worker.error.connect(lambda e, job_id=job['id']: self.active_jobs.pop(job_id, None))
+        return worker
+
+    def _start_job_worker(self, worker):
+        if worker.future is None:
+            worker.start()
+
+    def resume_jobs(self):
+        """前回終了時に未完了だったジョブを再実行する"""
+        if self.replay_jobs:
+            self.status_label.setText(f"📥 未完了のリクエスト {len(self.replay_jobs)} 件を再実行中...")
+        for _ in range(self.config.get('job_concurrency', 4)):
+            self._replay_next_job()
+
+    def _replay_next_job(self):
+        if not self.replay_jobs:
+            return
+        job = self.replay_jobs.popleft()
+        payload = json.loads(job['payload'])
+        operation = payload['operation']
+        source = payload.get('source_text') or payload.get('input_path') or "[Image]"
+        worker = self._worker_for_job(job)
+        worker.finished.connect(lambda r: self._on_job_replayed(source, r, operation))
+        worker.error.connect(lambda e: self._on_job_replayed(source, None, operation, e))
+        self._start_job_worker(worker)
+
+    def _on_job_replayed(self, source, result, operation, error=None):
+        if error is None:
+            self.save_log(source, result, operation)
+            self.status_label.setText(f"📥 未完了だった{operation}が完了しました（結果はログに保存）")
+        else:
+            self.status_label.setText(f"⚠️ 未完了だった{operation}が失敗しました: {error}")
+        self._replay_next_job()
+
+    def _on_api_retrying(self, error):
+        self.status_label.setText("📡 接続待ち... 回復したら自動で再試行します")
+
+    def _on_api_partial(self, delta):
+        if not self._result_streaming:
+            # 最初の差分で「処理中」表示を置き換える
+            self._result_streaming = True
+            self.result_text.clear()
+        self._append_result(delta)
+
+    def _ocr_note(self):
+        confidence = getattr(self.current_worker, 'ocr_confidence', None)
+        if confidence is None:
+            return ""
+        if self.current_worker.image is None:
+            return f" (OCR 信頼度 {confidence:.0f}%)"
+        return f" (OCR 信頼度 {confidence:.0f}% のため画像を送信)"
+
+    def _cache_note(self):
+        cached = self.current_worker.usage.get('cached_tokens', 0) if self.current_worker else 0
+        return f" (キャッシュ {cached:,} tokens)" if cached else ""
 
     def _on_api_success(self, result, operation):
         self._set_buttons_enabled(True)
-        self.result_text.setText(result)
-        self.status_label.setText(f"✓ {operation}完了")
+        with PROFILER.span("set_text", chars=len(result)):
+            self.result_text.set_text(result)
+        self.status_label.setText(f"✓ {operation}完了{self._cache_note()}{self._ocr_note()}")
         
         source = self.source_text.toPlainText() or "[Image]"
         self.save_log(source, result, operation)
 
     def _on_api_error(self, error):
         self._set_buttons_enabled(True)
-        self.result_text.setText(f"❌ エラー:\n{error}")
+        self.result_text.set_text(f"❌ エラー:\n{error}")
         self.status_label.setText("⚠️ エラー")
 
     def translate_text(self):
         text = self.source_text.toPlainText().strip()
         if not text:
-            self.result_text.setText("翻訳するテキストを入力してください。")
+            self.result_text.set_text("翻訳するテキストを入力してください。")
             return
         
-        prompt = self.config['translate_prompt'].format(text=text)
-        self._call_api(prompt, operation="翻訳")
+        messages = build_prompt_messages(self.config['translate_prompt'], text)
+        self._call_api(messages, operation="翻訳", source_text=text)
 
     def summarize_text(self):
         text = self.source_text.toPlainText().strip()
         if not text:
-            self.result_text.setText("要約するテキストを入力してください。")
+            self.result_text.set_text("要約するテキストを入力してください。")
             return
         
-        prompt = self.config['summarize_prompt'].format(text=text)
-        self._call_api(prompt, operation="要約")
+        messages = build_prompt_messages(self.config['summarize_prompt'], text)
+        self._call_api(messages, operation="要約")
 
     def translate_image(self):
-        image_path = self.source_text.get_dropped_image_path()
-        if not image_path:
-            self.result_text.setText("画像をドロップしてください。")
+        if not self.source_text.get_dropped_image_path():
+            self.result_text.set_text("画像をドロップしてください。")
+            return
+        image = self.source_text.get_dropped_image()
+        if image is None:
+            self.result_text.set_text("⏳ 画像を読み込み中です。しばらくしてから再度お試しください。")
+            return
+        
+        operation = "画像翻訳"
+        provider = self.config['provider']
+        model = self.current_model()
+        if not PROVIDERS[provider].has_credentials():
+            self.result_text.set_text("❌ APIキーが設定されていません。\nSettingsでAPIキーを設定してください。")
+            return
+        if not model:
+            self.result_text.set_text("❌ モデルが選択されていません。")
             return
         
-        prompt = self.config['image_translate_prompt']
-        self._call_api(prompt, image_path, "画像翻訳")
+        job = self.jobs.submit('image_translate', {
+            'operation': operation,
+            'provider': provider,
+            'model': model,
+            'translate_prompt': self.config['translate_prompt'],
+            'image_prompt': self.config['image_translate_prompt'],
+            'image_path': image.path,
+            'ocr_languages': self.config.get('ocr_languages', 'eng'),
+            'ocr_min_confidence': self.config.get('ocr_min_confidence', 80) if self.config.get('ocr_enabled', True) else None,
+            'glossary': self.config.get('glossary_path', '') if self.glossary else '',
+        }, image.data)
+        self._start_api_job(job, operation)
 
     def describe_image(self):
-        image_path = self.source_text.get_dropped_image_path()
-        if not image_path:
-            self.result_text.setText("画像をドロップしてください。")
+        if not self.source_text.get_dropped_image_path():
+            self.result_text.set_text("画像をドロップしてください。")
+            return
+        image = self.source_text.get_dropped_image()
+        if image is None:
+            self.result_text.set_text("⏳ 画像を読み込み中です。しばらくしてから再度お試しください。")
             return
         
         prompt = self.config['image_describe_prompt']
-        self._call_api(prompt, image_path, "画像説明")
+        self._call_api([{"role": "user", "content": prompt}], image, "画像説明")
+
+    def translate_file(self, file_path=None):
+        if not file_path:
+            file_path, _ = QFileDialog.getOpenFileName(
+                self, "翻訳するファイルを選択", "",
+                "Translatable files (*.po *.json *.strings *.srt *.vtt *.txt *.md *.html *.htm *.pdf)"
+            )
+            if not file_path:
+                return
+        
+        root, ext = os.path.splitext(file_path)
+        ext = ext.lower()
+        if ext in LOCALIZATION_FORMATS or ext in SUBTITLE_FORMATS:
+            default_output = f"{root}_translated{ext}"
+        elif ext in DOCUMENT_FORMATS:
+            default_output = f"{root}_translated{ext if ext in ('.txt', '.md') else '.txt'}"
+        else:
+            self.result_text.set_text(f"❌ 未対応のファイル形式です: {ext}")
+            return
+        
+        provider = self.config['provider']
+        model = self.current_model()
+        if not model:
+            self.result_text.set_text("❌ モデルが選択されていません。")
+            return
+        if not PROVIDERS[provider].has_credentials():
+            self.result_text.set_text("❌ APIキーが設定されていません。\nSettingsでAPIキーを設定してください。")
+            return
+        
+        output_path, _ = QFileDialog.getSaveFileName(self, "保存先を選択", default_output)
+        if not output_path:
+            return
+        
+        operation = "ファイル翻訳"
+        self._set_buttons_enabled(False)
+        self.status_label.setText(f"🔄 {operation}...")
+        
+        if ext in LOCALIZATION_FORMATS or ext in SUBTITLE_FORMATS:
+            self.result_text.set_text(f"⏳ 処理中...\n{file_path}")
+            if ext in SUBTITLE_FORMATS:
+                # 字幕は前後の文脈付きで並列に翻訳する
+                context_size = self.config.get('subtitle_context_cues', 3)
+                concurrency = self.config.get('subtitle_concurrency', 6)
+            else:
+                context_size, concurrency = 0, 1
+            backend = PROVIDERS[provider]
+            token_budget = self.config.get('batch_token_budget', 1500)
+            if backend.batch_token_budget:
+                token_budget = min(token_budget, backend.batch_token_budget)
+            max_items = self.config.get('batch_max_items', 80) if backend.supports_batching else 1
+            job = self._file_job('batch', operation, file_path, output_path, {
+                'token_budget': token_budget,
+                'max_items': max_items,
+                'context_size': context_size,
+                'concurrency': concurrency,
+            })
+            self.current_worker = self._worker_for_job(job)
+            self.current_worker.progress.connect(
+                lambda done, total: self.status_label.setText(f"🔄 {operation} {done}/{total}"))
+        else:
+            # 翻訳済みのチャンクは結果ビューに追記する（描画するのは表示範囲だけ）
+            self.result_text.clear()
+            job = self._file_job('document', operation, file_path, output_path, {
+                'chunk_chars': self.config.get('document_chunk_chars', 4000),
+                'concurrency': self.config.get('document_concurrency', 4),
+            })
+            self.current_worker = self._worker_for_job(job)
+            self.current_worker.chunk_translated.connect(self._append_result)
+            self.current_worker.progress.connect(
+                lambda percent: self.status_label.setText(f"🔄 {operation} {percent}%"))
+        
+        self.current_worker.retrying.connect(self._on_api_retrying)
+        self.current_worker.finished.connect(lambda r: self._on_file_success(r, file_path, operation))
+        self.current_worker.error.connect(self._on_api_error)
+        self._start_job_worker(self.current_worker)
+
+    def _file_job(self, kind, operation, input_path, output_path, options):
+        payload = {
+            'operation': operation,
+            'provider': self.config['provider'],
+            'model': self.current_model(),
+            'prompt_template': self.config['translate_prompt'],
+            'input_path': input_path,
+            'output_path': output_path,
+            'options': options,
+        }
+        return self.jobs.submit(kind, payload)
+
+    def _append_result(self, text):
+        self.result_text.append_text(text)
+
+    def _on_file_success(self, summary, file_path, operation):
+        self._set_buttons_enabled(True)
+        if isinstance(self.current_worker, DocumentTranslateWorker):
+            self._append_result(f"\n\n{summary}")
+        else:
+            self.result_text.set_text(summary)
+        self.status_label.setText(f"✓ {operation}完了{self._cache_note()}")
+        self.save_log(file_path, summary, operation)
+
+    def open_benchmark_dialog(self):
+        dialog = QWidget()
+        dialog.setWindowTitle("Benchmark")
+        dialog.setGeometry(150, 150, 950, 750)
+        dialog.setStyleSheet(self.styleSheet())
+        
+        layout = QVBoxLayout()
+        layout.setSpacing(10)
+        dialog.setLayout(layout)
+
+        # 比較するプロバイダー/モデル
+        target_group = QGroupBox("🎯 Targets")
+        target_layout = QVBoxLayout()
+        target_group.setLayout(target_layout)
+
+        filter_entry = QLineEdit()
+        filter_entry.setPlaceholderText("モデル名で絞り込み...")
+        target_layout.addWidget(filter_entry)
+
+        self.benchmark_targets = QListWidget()
+        self.benchmark_targets.setMaximumHeight(180)
+        for provider, backend in PROVIDERS.items():
+            for model in self.model_cache.get(provider) or backend.default_models:
+                item = QListWidgetItem(f"{provider} / {model}")
+                item.setData(Qt.UserRole, [provider, model])
+                item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+                if not backend.has_credentials():
+                    item.setFlags(item.flags() & ~Qt.ItemIsEnabled)
+                current = provider == self.config['provider'] and model == self.model_combo.currentText()
+                item.setCheckState(Qt.Checked if current else Qt.Unchecked)
+                self.benchmark_targets.addItem(item)
+        target_layout.addWidget(self.benchmark_targets)
+        filter_entry.textChanged.connect(lambda text: [
+            self.benchmark_targets.item(i).setHidden(text.lower() not in self.benchmark_targets.item(i).text().lower())
+            for i in range(self.benchmark_targets.count())])
+        layout.addWidget(target_group)
+
+        # 入力（空行区切りで複数）
+        input_group = QGroupBox("📝 Inputs (空行区切りで複数)")
+        input_layout = QVBoxLayout()
+        input_group.setLayout(input_layout)
+        self.benchmark_inputs = QTextEdit()
+        self.benchmark_inputs.setPlainText(self.source_text.toPlainText())
+        self.benchmark_inputs.setMaximumHeight(120)
+        input_layout.addWidget(self.benchmark_inputs)
+        layout.addWidget(input_group)
+
+        run_layout = QHBoxLayout()
+        run_layout.addWidget(QLabel("同時リクエスト数/モデル:"))
+        self.benchmark_concurrency = QSpinBox()
+        self.benchmark_concurrency.setRange(1, 16)
+        self.benchmark_concurrency.setValue(2)
+        run_layout.addWidget(self.benchmark_concurrency)
+        self.benchmark_status = QLabel("")
+        run_layout.addWidget(self.benchmark_status, 1)
+        self.benchmark_run_btn = QPushButton("▶ Run")
+        self.benchmark_run_btn.setStyleSheet("background-color: #1E90FF; padding: 6px; font-weight: bold;")
+        self.benchmark_run_btn.clicked.connect(self._run_benchmark)
+        run_layout.addWidget(self.benchmark_run_btn)
+        layout.addLayout(run_layout)
+
+        # 結果
+        self.benchmark_summary = QTableWidget(0, len(BENCHMARK_COLUMNS))
+        self.benchmark_summary.setHorizontalHeaderLabels(BENCHMARK_COLUMNS)
+        self.benchmark_summary.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.benchmark_summary)
+        
+        self.benchmark_outputs = QTableWidget(0, 0)
+        self.benchmark_outputs.setWordWrap(True)
+        layout.addWidget(self.benchmark_outputs, 1)
+
+        dialog.show()
+        self.benchmark_dialog = dialog
+
+    def _run_benchmark(self):
+        targets = []
+        for i in range(self.benchmark_targets.count()):
+            item = self.benchmark_targets.item(i)
+            if item.checkState() == Qt.Checked and not item.isHidden():
+                targets.append(tuple(item.data(Qt.UserRole)))
+        inputs = split_paragraphs(self.benchmark_inputs.toPlainText())
+        if not targets or not inputs:
+            self.benchmark_status.setText("⚠️ モデルと入力を指定してください")
+            return
+        
+        self.benchmark_run_btn.setEnabled(False)
+        self.benchmark_status.setText(f"🔄 0/{len(targets) * len(inputs)}")
+        self.benchmark_worker = BenchmarkWorker(
+            targets, inputs, self.config['translate_prompt'], os.path.join(app_data_dir(), 'benchmark'),
+            self.benchmark_concurrency.value())
+        self.benchmark_worker.progress.connect(
+            lambda done, total: self.benchmark_status.setText(f"🔄 {done}/{total}"))
+        self.benchmark_worker.finished.connect(self._on_benchmark_finished)
+        self.benchmark_worker.error.connect(self._on_benchmark_error)
+        self.benchmark_worker.start()
+
+    def _on_benchmark_finished(self, report):
+        self.benchmark_run_btn.setEnabled(True)
+        self.benchmark_status.setText(f"✓ {report['elapsed']:.1f}s — {os.path.basename(report['paths'][1])} に保存")
+        
+        rows = benchmark_summary_rows(report)
+        self.benchmark_summary.setRowCount(len(rows))
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                self.benchmark_summary.setItem(r, c, QTableWidgetItem(value))
+        self.benchmark_summary.resizeColumnsToContents()
+        
+        # 入力ごとに各モデルの出力を横に並べる
+        headers = ["Input"] + [f"{t['provider']} / {t['model']}" for t in report['targets']]
+        self.benchmark_outputs.setColumnCount(len(headers))
+        self.benchmark_outputs.setHorizontalHeaderLabels(headers)
+        self.benchmark_outputs.setRowCount(len(report['inputs']))
+        for r, (text, results) in enumerate(zip(report['inputs'], report['results'])):
+            self.benchmark_outputs.setItem(r, 0, QTableWidgetItem(text))
+            for c, record in enumerate(results, 1):
+                if record['error'] is not None:
+                    value = f"❌ {record['error']}"
+                else:
+                    agreement = "" if record['agreement'] is None else f" / 一致度 {record['agreement']:.0%}"
+                    value = f"{record['output']}\n\n{record['latency']:.2f}s{agreement}"
+                self.benchmark_outputs.setItem(r, c, QTableWidgetItem(value))
+        self.benchmark_outputs.resizeRowsToContents()
+
+    def _on_benchmark_error(self, error):
+        self.benchmark_run_btn.setEnabled(True)
+        self.benchmark_status.setText(f"❌ {error}")
+
+    def current_model(self):
+        """リクエストに使うモデル（予算超過時に切り替える設定なら代わりのモデル）"""
+        model = self.model_combo.currentText()
+        if self.budget_exceeded and self.config.get('budget_action') == 'downgrade':
+            return self._fallback_model(self.config['provider'], model) or model
+        return model
+
+    def _fallback_model(self, provider, model):
+        """予算超過時の代わりのモデル。指定がなければ料金が分かるモデルのうち最も安いもの"""
+        fallback = self.config.get('budget_fallback_models', {}).get(provider)
+        if fallback:
+            return fallback
+        backend = PROVIDERS[provider]
+        price = backend.price(model)
+        if price is None:
+            return None
+        # 画像を扱うモデルの代わりには画像を扱えるモデルを選ぶ
+        vision = backend.supports_vision(model)
+        candidates = [(sum(backend.price(m)), m) for m in self.model_cache.get(provider) or backend.default_models
+                      if backend.price(m) is not None and (backend.supports_vision(m) or not vision)]
+        if not candidates:
+            return None
+        cheapest_price, cheapest = min(candidates)
+        return cheapest if cheapest_price < sum(price) else None
+
+    def _schedule_budget_check(self):
+        # 連続したリクエストの記録はまとめて確認する
+        if not self._budget_check_pending:
+            self._budget_check_pending = True
+            QTimer.singleShot(1000, self._check_budget)
+
+    def _check_budget(self):
+        """今日・今月の支出を予算と比べ、80% と 100% に達したときに通知する"""
+        self._budget_check_pending = False
+        exceeded = False
+        budgets = [('budget_daily_usd', 'today', "今日", '%Y-%m-%d'),
+                   ('budget_monthly_usd', 'month', "今月", '%Y-%m')]
+        for key, period, label, period_format in budgets:
+            limit = self.config.get(key, 0)
+            if not limit:
+                continue
+            spent = self.usage_store.spend_since(usage_period_start(period))
+            ratio = spent / limit
+            exceeded = exceeded or ratio >= 1
+            level = 100 if ratio >= 1 else 80 if ratio >= 0.8 else 0
+            alert_key = (key, datetime.now().strftime(period_format))
+            if level <= self.budget_alerts.get(alert_key, 0):
+                continue
+            self.budget_alerts[alert_key] = level
+            message = f"💰 {label}の支出が予算の{ratio:.0%}です (${spent:.2f} / ${limit:.2f})"
+            if level == 100 and self.config.get('budget_action') == 'downgrade':
+                fallback = self._fallback_model(self.config['provider'], self.model_combo.currentText())
+                message += f" — {fallback} に切り替えます" if fallback else " — 切り替え先のモデルがありません"
+            self.status_label.setText(message)
+        self.budget_exceeded = exceeded
+
+    def open_usage_dialog(self):
+        dialog = QWidget()
+        dialog.setWindowTitle("Usage")
+        dialog.setGeometry(150, 150, 950, 750)
+        dialog.setStyleSheet(self.styleSheet())
+        
+        layout = QVBoxLayout()
+        layout.setSpacing(10)
+        dialog.setLayout(layout)
+
+        period_layout = QHBoxLayout()
+        period_layout.addWidget(QLabel("期間:"))
+        self.usage_period_combo = QComboBox()
+        for label, period in [("今日", 'today'), ("7日間", '7d'), ("30日間", '30d'), ("今月", 'month')]:
+            self.usage_period_combo.addItem(label, period)
+        self.usage_period_combo.currentIndexChanged.connect(self._refresh_usage_dialog)
+        period_layout.addWidget(self.usage_period_combo)
+        self.usage_totals_label = QLabel("")
+        period_layout.addWidget(self.usage_totals_label, 1)
+        refresh_btn = QPushButton("🔄")
+        refresh_btn.setFixedWidth(35)
+        refresh_btn.clicked.connect(self._refresh_usage_dialog)
+        period_layout.addWidget(refresh_btn)
+        layout.addLayout(period_layout)
+
+        # 予算
+        budget_group = QGroupBox("🎯 Budget")
+        budget_layout = QVBoxLayout()
+        budget_group.setLayout(budget_layout)
+        self.usage_budget_label = QLabel("")
+        budget_layout.addWidget(self.usage_budget_label)
+        layout.addWidget(budget_group)
+
+        # プロバイダー・モデル・操作ごと
+        self.usage_breakdown = QTableWidget(0, len(USAGE_COLUMNS))
+        self.usage_breakdown.setHorizontalHeaderLabels(USAGE_COLUMNS)
+        self.usage_breakdown.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.usage_breakdown, 2)
+
+        # 日ごと
+        daily_columns = ["Date", "Requests", "Tokens", "Cost", ""]
+        self.usage_daily = QTableWidget(0, len(daily_columns))
+        self.usage_daily.setHorizontalHeaderLabels(daily_columns)
+        self.usage_daily.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.usage_daily, 1)
+
+        # キーごとの直近1分のクォータ
+        quota_group = QGroupBox("🔑 Quota (直近1分)")
+        quota_layout = QVBoxLayout()
+        quota_group.setLayout(quota_layout)
+        quota_columns = ["Provider", "Key", "Requests", "Tokens", "In flight", "Cooldown", "Failures"]
+        self.usage_quota = QTableWidget(0, len(quota_columns))
+        self.usage_quota.setHorizontalHeaderLabels(quota_columns)
+        self.usage_quota.horizontalHeader().setStretchLastSection(True)
+        quota_layout.addWidget(self.usage_quota)
+        layout.addWidget(quota_group, 1)
+
+        # 新しい記録とクォータの変化を反映するため、開いている間は定期的に更新する
+        timer = QTimer(dialog)
+        timer.timeout.connect(self._refresh_usage_dialog)
+        timer.start(5000)
+
+        dialog.show()
+        self.usage_dialog = dialog
+        self._refresh_usage_dialog()
+
+    def _refresh_usage_dialog(self):
+        if not self.usage_dialog.isVisible():
+            return
+        since = usage_period_start(self.usage_period_combo.currentData())
+        
+        totals = self.usage_store.totals(since)
+        self.usage_totals_label.setText(
+            f"{totals['requests']:,} requests ({totals['errors']:,} errors) / "
+            f"{totals['input_tokens'] + totals['output_tokens']:,} tokens / ${totals['cost']:.4f}")
+        
+        lines = []
+        for key, period, label in [('budget_daily_usd', 'today', "今日"), ('budget_monthly_usd', 'month', "今月")]:
+            limit = self.config.get(key, 0)
+            spent = self.usage_store.spend_since(usage_period_start(period))
+            if limit:
+                lines.append(f"{label}: ${spent:.4f} / ${limit:.2f}  {usage_bar(spent, limit)} {spent / limit:.0%}")
+            else:
+                lines.append(f"{label}: ${spent:.4f}（予算なし）")
+        if self.budget_exceeded and self.config.get('budget_action') == 'downgrade':
+            lines.append(f"⚠️ 予算超過のため {self.current_model()} を使用中")
+        self.usage_budget_label.setText("\n".join(lines))
+        
+        rows = usage_breakdown_rows(self.usage_store.breakdown(since))
+        self.usage_breakdown.setRowCount(len(rows))
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                self.usage_breakdown.setItem(r, c, QTableWidgetItem(value))
+        self.usage_breakdown.resizeColumnsToContents()
+        
+        days = self.usage_store.daily(since)
+        max_cost = max([day['cost'] for day in days] + [0])
+        self.usage_daily.setRowCount(len(days))
+        for r, day in enumerate(days):
+            values = [day['day'], f"{day['requests']:,}", f"{day['input_tokens'] + day['output_tokens']:,}",
+                      f"${day['cost']:.4f}", usage_bar(day['cost'], max_cost)]
+            for c, value in enumerate(values):
+                self.usage_daily.setItem(r, c, QTableWidgetItem(value))
+        self.usage_daily.resizeColumnsToContents()
+        
+        quota = []
+        for provider, backend in PROVIDERS.items():
+            if backend.hidden:
+                continue
+            rpm = f"/{backend.keys.rpm}" if backend.keys.rpm else ""
+            tpm = f"/{backend.keys.tpm:,}" if backend.keys.tpm else ""
+            for state in backend.keys.snapshot():
+                quota.append([provider, state['key'], f"{state['requests']}{rpm}",
+                              f"{state['tokens']:,}{tpm}", str(state['in_flight']),
+                              f"{state['cooldown']:.0f}s" if state['cooldown'] else "-", str(state['failures'])])
+        self.usage_quota.setRowCount(len(quota))
+        for r, row in enumerate(quota):
+            for c, value in enumerate(row):
+                self.usage_quota.setItem(r, c, QTableWidgetItem(value))
+        self.usage_quota.resizeColumnsToContents()
 
     def open_settings_dialog(self):
         dialog = QWidget()
         dialog.setWindowTitle("Settings")
-        dialog.setGeometry(200, 200, 600, 750)
+        dialog.setGeometry(200, 200, 600, 850)
         dialog.setStyleSheet(self.styleSheet())
         
         layout = QVBoxLayout()
@@ -917,14 +3729,15 @@ class TranslatorApp(QWidget):
         api_group.setLayout(api_layout)
 
         self.api_entries = {}
-        for provider in PROVIDERS.keys():
+        self.base_url_entries = {}
+        for provider in [name for name, backend in PROVIDERS.items() if not backend.hidden]:
             h = QHBoxLayout()
             label = QLabel(f"{provider}:")
             label.setFixedWidth(120)
             entry = QLineEdit()
             entry.setEchoMode(QLineEdit.Password)
-            entry.setText(self.config['api_keys'].get(provider, ''))
-            entry.setPlaceholderText(f"Enter {provider} API key...")
+            entry.setText(", ".join(parse_api_keys(self.config['api_keys'].get(provider))))
+            entry.setPlaceholderText(f"Enter {provider} API key(s), comma-separated...")
             self.api_entries[provider] = entry
             
             show_btn = QPushButton("👁")
@@ -937,6 +3750,20 @@ class TranslatorApp(QWidget):
             h.addWidget(entry)
             h.addWidget(show_btn)
             api_layout.addLayout(h)
+            
+            if not PROVIDERS[provider].requires_api_key:
+                # APIキー不要のプロバイダーは接続先URLを設定する
+                entry.setPlaceholderText(f"{provider} API key (optional)")
+                h = QHBoxLayout()
+                label = QLabel(f"{provider} URL:")
+                label.setFixedWidth(120)
+                url_entry = QLineEdit()
+                url_entry.setText(PROVIDERS[provider].base_url or '')
+                url_entry.setPlaceholderText("http://localhost:11434/v1")
+                self.base_url_entries[provider] = url_entry
+                h.addWidget(label)
+                h.addWidget(url_entry)
+                api_layout.addLayout(h)
 
         layout.addWidget(api_group)
 
@@ -963,6 +3790,112 @@ class TranslatorApp(QWidget):
 
         layout.addWidget(prompt_group)
 
+        # 用語集設定
+        glossary_group = QGroupBox("📚 Glossary (CSV / TBX)")
+        glossary_layout = QHBoxLayout()
+        glossary_group.setLayout(glossary_layout)
+
+        self.glossary_entry = QLineEdit()
+        self.glossary_entry.setText(self.config.get('glossary_path', ''))
+        self.glossary_entry.setPlaceholderText("用語集ファイル（source,target の CSV または TBX）")
+        glossary_layout.addWidget(self.glossary_entry)
+
+        browse_btn = QPushButton("📂")
+        browse_btn.setFixedWidth(35)
+        browse_btn.clicked.connect(self._browse_glossary)
+        glossary_layout.addWidget(browse_btn)
+
+        glossary_layout.addWidget(QLabel("Target lang:"))
+        self.glossary_lang_entry = QLineEdit()
+        self.glossary_lang_entry.setText(self.config.get('glossary_target_lang', ''))
+        self.glossary_lang_entry.setPlaceholderText("ja")
+        self.glossary_lang_entry.setFixedWidth(50)
+        glossary_layout.addWidget(self.glossary_lang_entry)
+
+        layout.addWidget(glossary_group)
+
+        # OCR設定
+        ocr_group = QGroupBox("🔎 OCR (Tesseract)")
+        ocr_layout = QHBoxLayout()
+        ocr_group.setLayout(ocr_layout)
+
+        self.ocr_check = QCheckBox("画像翻訳でOCRを使う")
+        self.ocr_check.setChecked(self.config.get('ocr_enabled', True))
+        self.ocr_check.setEnabled(ocr_available())
+        if not ocr_available():
+            self.ocr_check.setToolTip("pytesseract と tesseract をインストールすると使用できます")
+        ocr_layout.addWidget(self.ocr_check)
+
+        ocr_layout.addWidget(QLabel("Lang:"))
+        self.ocr_lang_entry = QLineEdit()
+        self.ocr_lang_entry.setText(self.config.get('ocr_languages', 'eng'))
+        self.ocr_lang_entry.setPlaceholderText("eng+jpn")
+        self.ocr_lang_entry.setFixedWidth(90)
+        ocr_layout.addWidget(self.ocr_lang_entry)
+
+        ocr_layout.addWidget(QLabel("Min confidence:"))
+        self.ocr_confidence_spin = QSpinBox()
+        self.ocr_confidence_spin.setRange(0, 100)
+        self.ocr_confidence_spin.setSuffix("%")
+        self.ocr_confidence_spin.setValue(self.config.get('ocr_min_confidence', 80))
+        ocr_layout.addWidget(self.ocr_confidence_spin)
+
+        layout.addWidget(ocr_group)
+
+        # 予算設定
+        budget_group = QGroupBox("💰 Budget (USD, 0 で無効)")
+        budget_layout = QHBoxLayout()
+        budget_group.setLayout(budget_layout)
+
+        self.budget_spins = {}
+        for key, label_text in [('budget_daily_usd', "Daily:"), ('budget_monthly_usd', "Monthly:")]:
+            budget_layout.addWidget(QLabel(label_text))
+            spin = QDoubleSpinBox()
+            spin.setRange(0, 100000)
+            spin.setDecimals(2)
+            spin.setPrefix("$")
+            spin.setValue(self.config.get(key, 0))
+            self.budget_spins[key] = spin
+            budget_layout.addWidget(spin)
+
+        budget_layout.addWidget(QLabel("超過時:"))
+        self.budget_action_combo = QComboBox()
+        self.budget_action_combo.addItem("通知のみ", 'warn')
+        self.budget_action_combo.addItem("安いモデルに切り替え", 'downgrade')
+        self.budget_action_combo.setCurrentIndex(max(self.budget_action_combo.findData(
+            self.config.get('budget_action', 'warn')), 0))
+        budget_layout.addWidget(self.budget_action_combo)
+
+        layout.addWidget(budget_group)
+
+        # パフォーマンス計測
+        profile_group = QGroupBox("⏱ Profiling (Chrome trace / Perfetto)")
+        profile_layout = QHBoxLayout()
+        profile_group.setLayout(profile_layout)
+
+        self.profile_check = QCheckBox("計測する")
+        self.profile_check.setChecked(self.config.get('profile_enabled', False))
+        profile_layout.addWidget(self.profile_check)
+
+        profile_layout.addWidget(QLabel("Stall ≥"))
+        self.profile_stall_spin = QSpinBox()
+        self.profile_stall_spin.setRange(0, 5000)
+        self.profile_stall_spin.setSuffix(" ms")
+        self.profile_stall_spin.setValue(self.config.get('profile_stall_ms', 100))
+        profile_layout.addWidget(self.profile_stall_spin)
+
+        self.profile_cprofile_check = QCheckBox("cProfile")
+        self.profile_cprofile_check.setChecked(self.config.get('profile_cprofile', False))
+        profile_layout.addWidget(self.profile_cprofile_check)
+
+        export_btn = QPushButton("📤 Export")
+        export_btn.setToolTip("ここまでのトレースを profile ディレクトリに保存")
+        export_btn.setEnabled(PROFILER.enabled)
+        export_btn.clicked.connect(lambda: self.export_profile(restart=True))
+        profile_layout.addWidget(export_btn)
+
+        layout.addWidget(profile_group)
+
         # 保存ボタン
         save_btn = QPushButton("💾 Save Settings")
         save_btn.setStyleSheet("background-color: #1E90FF; padding: 10px; font-weight: bold;")
@@ -976,9 +3909,39 @@ class TranslatorApp(QWidget):
         for provider, entry in self.api_entries.items():
             self.config['api_keys'][provider] = entry.text()
         
+        for provider, entry in self.base_url_entries.items():
+            self.config['provider_base_urls'][provider] = entry.text().strip()
+        self._configure_providers()
+        
         for key, entry in self.prompt_entries.items():
             self.config[key] = entry.toPlainText()
         
+        glossary_changed = (
+            self.glossary_entry.text().strip() != self.config.get('glossary_path', '')
+            or self.glossary_lang_entry.text().strip() != self.config.get('glossary_target_lang', '')
+        )
+        self.config['glossary_path'] = self.glossary_entry.text().strip()
+        self.config['glossary_target_lang'] = self.glossary_lang_entry.text().strip()
+        if glossary_changed:
+            self.load_glossary()
+        
+        self.config['ocr_enabled'] = self.ocr_check.isChecked()
+        self.config['ocr_languages'] = self.ocr_lang_entry.text().strip() or 'eng'
+        self.config['ocr_min_confidence'] = self.ocr_confidence_spin.value()
+        self._update_vision_buttons()
+        
+        for key, spin in self.budget_spins.items():
+            self.config[key] = spin.value()
+        self.config['budget_action'] = self.budget_action_combo.currentData()
+        # 予算を変えたら通知をやり直す
+        self.budget_alerts.clear()
+        self._check_budget()
+        
+        self.config['profile_enabled'] = self.profile_check.isChecked()
+        self.config['profile_stall_ms'] = self.profile_stall_spin.value()
+        self.config['profile_cprofile'] = self.profile_cprofile_check.isChecked()
+        self._apply_profiling()
+        
         self.save_config()
         self.status_label.setText("✓ 設定を保存しました")
         
@@ -987,15 +3950,36 @@ class TranslatorApp(QWidget):
         
         dialog.close()
 
+    def _browse_glossary(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self.settings_dialog, "用語集を選択", "", "Glossary (*.csv *.tsv *.tbx)")
+        if path:
+            self.glossary_entry.setText(path)
+
+    def load_glossary(self):
+        path = self.config.get('glossary_path', '')
+        if not path:
+            self.glossary = None
+            return
+        
+        self.glossary_worker = GlossaryLoadWorker(
+            path, self.config.get('glossary_target_lang', ''), self.config.get('glossary_max_retries', 1))
+        self.glossary_worker.finished.connect(self._on_glossary_loaded)
+        self.glossary_worker.error.connect(lambda e: self.status_label.setText(f"⚠️ 用語集: {e[:30]}"))
+        self.glossary_worker.start()
+
+    def _on_glossary_loaded(self, glossary):
+        self.glossary = glossary
+        self.status_label.setText(f"✓ 用語集 {len(glossary):,} 件")
+
     def save_log(self, source, result, operation):
         try:
-            base_dir = os.path.dirname(sys.executable) if getattr(sys, 'frozen', False) else os.path.dirname(os.path.abspath(__file__))
-            log_dir = os.path.join(base_dir, 'log')
+            log_dir = os.path.join(app_data_dir(), 'log')
             os.makedirs(log_dir, exist_ok=True)
             
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             provider = self.config['provider']
-            model = self.model_combo.currentText()
+            model = self.current_model()
             
             content = f"""[{operation}]
 Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
@@ -1008,7 +3992,8 @@ Model: {model}
 === Result ===
 {result}
 """
-            with open(os.path.join(log_dir, f"{timestamp}_{operation}.txt"), 'w', encoding='utf-8') as f:
+            with PROFILER.span("save_log", chars=len(content)), \
+                    open(os.path.join(log_dir, f"{timestamp}_{operation}.txt"), 'w', encoding='utf-8') as f:
                 f.write(content)
         except Exception as e:
             print(f"Log error: {e}")
@@ -1046,19 +4031,231 @@ Model: {model}
                 self.source_text.clear()
                 self.source_text.setPlainText(text)
                 self.translate_text()
-                self.activateWindow()
-                self.raise_()
+                self.show_window()
         except Exception as e:
             print(f"Quick translate error: {e}")
 
+    def show_window(self):
+        self.show()
+        self.raise_()
+        self.activateWindow()
+
+    def open_path(self, file_path):
+        if self.source_text._is_image_file(file_path):
+            self.source_text.load_image(file_path)
+        elif self.source_text._is_translatable_file(file_path):
+            self.translate_file(file_path)
+        else:
+            self.status_label.setText(f"⚠️ 未対応のファイル: {os.path.basename(file_path)}")
+
+    def handle_request(self, request, reply):
+        """後から起動されたプロセスからのリクエストを処理する。reply(dict) は1回だけ呼ばれる"""
+        command = request.get('command')
+        if command == 'ping':
+            reply({'status': 'ok'})
+        elif command == 'show':
+            self.show_window()
+            reply({'status': 'ok'})
+        elif command == 'open':
+            self.show_window()
+            for file_path in request.get('paths', []):
+                self.open_path(file_path)
+            reply({'status': 'ok'})
+        elif command in ('translate', 'summarize'):
+            self.run_request(command, request.get('text', ''), reply)
+        elif command == 'quit':
+            reply({'status': 'ok'})
+            QTimer.singleShot(0, self.quit_app)
+        else:
+            reply({'status': 'error', 'error': f"不明なコマンドです: {command}"})
+
+    def run_request(self, command, text, reply):
+        """画面の入出力を使わずに翻訳・要約し、結果を reply で返す"""
+        text = text.strip()
+        provider = self.config['provider']
+        model = self.current_model()
+        if not text:
+            reply({'status': 'error', 'error': "テキストが空です"})
+            return
+        if not PROVIDERS[provider].has_credentials():
+            reply({'status': 'error', 'error': "APIキーが設定されていません"})
+            return
+        if not model:
+            reply({'status': 'error', 'error': "モデルが選択されていません"})
+            return
+        
+        translate = command == 'translate'
+        operation = "翻訳" if translate else "要約"
+        template = self.config['translate_prompt' if translate else 'summarize_prompt']
+        job = self._request_job(operation, build_prompt_messages(template, text),
+                                source_text=text if translate else None)
+        
+        def done(result=None, error=None):
+            if error is not None:
+                reply({'status': 'error', 'error': error})
+                return
+            self.save_log(text, result, operation)
+            reply({'status': 'ok', 'result': result})
+            
+        worker = self._worker_for_job(job)
+        worker.finished.connect(lambda r: done(result=r))
+        worker.error.connect(lambda e: done(error=e))
+        self.status_label.setText(f"📨 CLI {operation}...")
+        self._start_job_worker(worker)
+
+    def quit_app(self):
+        self._quitting = True
+        self.close()
+
     def closeEvent(self, event):
         self.save_window_config()
+        if self.resident and not self._quitting:
+            # 常駐モードではウィンドウを隠すだけ
+            self.hide()
+            event.ignore()
+            return
+        if self.current_worker is not None and self.current_worker.isRunning():
+            self.current_worker.requestInterruption()
+        for worker in list(self.active_jobs.values()):
+            # 中断したジョブは次回起動時に再実行される
+            worker.requestInterruption()
         if hasattr(self, 'hotkey'):
             self.hotkey.stop()
+        self.instance_server.close()
+        if PROFILER.enabled:
+            self.export_profile()
+        get_engine().stop()
+        self.jobs.close()
+        self.usage_store.close()
         event.accept()
+        if self.resident:
+            QApplication.instance().quit()
 
 
-if __name__ == "__main__":
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Gemini Translator。起動済みのインスタンスがあれば、そちらに処理を渡します。")
+    parser.add_argument('paths', nargs='*', help="開くファイル（画像・翻訳対象ファイル）")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-t', '--translate', metavar='TEXT', help="翻訳して結果を標準出力に表示（- で標準入力）")
+    group.add_argument('-s', '--summarize', metavar='TEXT', help="要約して結果を標準出力に表示（- で標準入力）")
+    group.add_argument('--quit', action='store_true', help="常駐しているインスタンスを終了")
+    parser.add_argument('--daemon', action='store_true', help="ウィンドウを表示せずに常駐（閉じても終了しない）")
+    parser.add_argument('--benchmark', metavar='FILE',
+                        help="FILE の段落（空行区切り）を --target のモデルに送って比較し、レポートを保存")
+    parser.add_argument('--target', metavar='PROVIDER:MODEL', action='append',
+                        help="ベンチマークの対象（複数指定可、省略時はオフラインの Stub:echo）")
+    return parser.parse_args(argv)
+
+
+def run_benchmark_cli(args):
+    """GUIを起動せずにベンチマークを実行し、サマリーを表示する"""
+    load_optional_modules()
+    try:
+        with open(os.path.join(app_data_dir(), 'config.json'), 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {}
+    for backend in PROVIDERS.values():
+        backend.configure(config)
+    # 実際のプロバイダーで計測した分も使用量に含める
+    open_usage_store(os.path.join(app_data_dir(), 'usage.db'))
+    
+    targets = []
+    for target in args.target or ["Stub:echo"]:
+        provider, sep, model = target.partition(':')
+        if not sep or provider not in PROVIDERS:
+            print(f"エラー: 不正な対象です: {target}（{', '.join(PROVIDERS)} のいずれか:モデル名）", file=sys.stderr)
+            return 2
+        targets.append((provider, model))
+    with open(args.benchmark, 'r', encoding='utf-8') as f:
+        inputs = split_paragraphs(f.read())
+    
+    runner = BenchmarkRunner(config.get('translate_prompt', DEFAULT_TRANSLATE_PROMPT))
+    try:
+        report = get_engine().submit(runner.run(targets, inputs)).result()
+    finally:
+        get_engine().stop()
+    paths = save_benchmark_report(report, os.path.join(app_data_dir(), 'benchmark'))
+    
+    rows = [BENCHMARK_COLUMNS] + benchmark_summary_rows(report)
+    widths = [max(len(row[i]) for row in rows) for i in range(len(BENCHMARK_COLUMNS))]
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)))
+    print(f"\nReport: {paths[0]}\n        {paths[1]}")
+    return 0
+
+
+def build_request(args):
+    if args.quit:
+        return {'command': 'quit'}
+    for command in ('translate', 'summarize'):
+        text = getattr(args, command)
+        if text is not None:
+            return {'command': command, 'text': sys.stdin.read() if text == '-' else text}
+    if args.paths:
+        return {'command': 'open', 'paths': [os.path.abspath(p) for p in args.paths]}
+    return {'command': 'show'}
+
+
+def print_reply(reply):
+    """インスタンスからの応答を表示し、終了コードを返す"""
+    if reply.get('status') != 'ok':
+        print(f"エラー: {reply.get('error')}", file=sys.stderr)
+        return 1
+    if 'result' in reply:
+        print(reply['result'])
+    return 0
+
+
+def run_gui(args, request):
     app = QApplication(sys.argv)
-    translator = TranslatorApp()
-    sys.exit(app.exec_())
+    if args.daemon:
+        app.setQuitOnLastWindowClosed(False)
+    # ホットキーなどを登録する前に名前を確保し、同時に起動した場合は先に起動した方に渡して終了する
+    server = InstanceServer()
+    if not server.listen():
+        if instance_running():
+            if args.daemon:
+                return 0
+            return print_reply(send_request(request) or {'status': 'error', 'error': "インスタンスに接続できません"})
+        print(f"Instance server error: {server.server.errorString()}")
+    load_optional_modules()
+    translator = TranslatorApp(resident=args.daemon, instance_server=server)
+    if request['command'] == 'open':
+        translator.handle_request(request, lambda reply: None)
+    return app.exec_()
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.benchmark:
+        return run_benchmark_cli(args)
+    request = build_request(args)
+    
+    # QLocalSocket の待機にはアプリケーションオブジェクトが必要。GUIを起動する場合は作り直す
+    core_app = QCoreApplication(sys.argv)
+    if args.daemon:
+        if send_request({'command': 'ping'}) is not None:
+            print("既に常駐しています", file=sys.stderr)
+            return 0
+        reply = None
+    else:
+        reply = send_request(request)
+    if reply is None and request['command'] in ('translate', 'summarize'):
+        # 常駐インスタンスを起動してから渡す（次回からはすぐに応答できる）
+        if not start_daemon():
+            print("エラー: 常駐インスタンスを起動できませんでした", file=sys.stderr)
+            return 1
+        reply = send_request(request)
+    if reply is None:
+        if request['command'] == 'quit':
+            print("起動中のインスタンスはありません", file=sys.stderr)
+            return 1
+        del core_app
+        return run_gui(args, request)
+    return print_reply(reply)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,961 @@
+"""gtsfh の GUI（Qt）に依存しない部分
+
+プロンプトの組み立て、APIキーのプール、永続ジョブキュー、用語集、バッチ翻訳と
+ローカライズ・字幕ファイルの読み書き。Qt なしで読み込めるため、単体テストからも使う。
+"""
+import os
+import re
+import json
+import csv
+import time
+import socket
+import sqlite3
+import hashlib
+import asyncio
+import threading
+from xml.etree import ElementTree
+from collections import Counter, OrderedDict, deque
+
+
+def build_prompt_messages(template, text):
+    """プロンプトテンプレートを静的な前半（キャッシュ対象）と入力部分のメッセージに分ける
+    
+    {text} より前の部分はリクエスト間で共通なので system メッセージとして先頭に置き、
+    プロバイダー側のプレフィックスキャッシュが効くようにする。
+    """
+    prefix, sep, suffix = template.partition('{text}')
+    if not sep or not prefix.strip():
+        return [{"role": "user", "content": template.format(text=text)}]
+    unescape = lambda s: s.replace('{{', '{').replace('}}', '}')
+    return [
+        {"role": "system", "content": unescape(prefix).strip()},
+        {"role": "user", "content": text + unescape(suffix)},
+    ]
+
+
+def _split_system_messages(messages):
+    """(system メッセージを連結したテキスト, それ以外のメッセージ) を返す"""
+    system = [m['content'] for m in messages if m.get('role') == 'system' and isinstance(m.get('content'), str)]
+    others = [m for m in messages if m.get('role') != 'system']
+    return "\n\n".join(system), others
+
+
+# APIキーのプール
+def parse_api_keys(value):
+    """設定値（文字列またはリスト）をキーのリストにする。文字列はカンマ・改行区切りで複数指定できる"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = re.split(r'[,\n]', value)
+    keys = []
+    for key in value:
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def _error_status(error):
+    """例外からHTTPステータスを取り出す（openai: status_code、google-api-core: code）"""
+    for attr in ('status_code', 'code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return getattr(getattr(error, 'response', None), 'status_code', None)
+
+
+def _retry_after(error):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+# 時間をおけば成功する見込みのあるHTTPステータス（500 はリクエスト自体の問題のことが多いため含めない）
+TRANSIENT_STATUS = {408, 429, 502, 503, 504}
+
+
+def is_transient_error(error):
+    """接続できない・サーバー側の一時的なエラーか"""
+    status = _error_status(error)
+    if status is not None:
+        return status in TRANSIENT_STATUS
+    if isinstance(error, (ConnectionError, TimeoutError, socket.gaierror, asyncio.TimeoutError)):
+        return True
+    # openai.APIConnectionError / httpx.ConnectError / google.api_core.exceptions.DeadlineExceeded など
+    name = type(error).__name__
+    return any(word in name for word in ('Connect', 'Timeout', 'Unavailable', 'DeadlineExceeded'))
+
+
+class KeyState:
+    """プール内の1キーの状態"""
+    
+    def __init__(self, key):
+        self.key = key
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        # クールダウン中の理由（'rate_limit' / 'auth'）
+        self.cooldown_reason = None
+        # 連続でレート制限・認証エラーになった回数
+        self.failures = 0
+        self.request_times = deque()
+        self.token_log = deque()
+        
+    def usage(self, now, window):
+        """直近 window 秒のリクエスト数とトークン数"""
+        while self.request_times and self.request_times[0] <= now - window:
+            self.request_times.popleft()
+        while self.token_log and self.token_log[0][0] <= now - window:
+            self.token_log.popleft()
+        return len(self.request_times), sum(tokens for _, tokens in self.token_log)
+
+
+class KeyPool:
+    """1プロバイダー分のAPIキーのプール
+    
+    リクエストごとに、クールダウン中でなく残りクォータが最も多いキーを割り当てる。
+    レート制限(429)を受けたキーは Retry-After の間、認証エラーのキーはより長く割り当てから外す。
+    rpm / tpm（キーごとの1分あたりの上限）を設定すると、上限に達したキーも空くまで使わない。
+    """
+    WINDOW = 60
+    RATE_LIMIT_COOLDOWN = 30
+    AUTH_COOLDOWN = 600
+    # 全キーが使えない場合にこれ以上待つならエラーにする
+    MAX_WAIT = 120
+    
+    def __init__(self):
+        self._states = []
+        self.rpm = 0
+        self.tpm = 0
+        
+    def configure(self, keys, rpm=0, tpm=0):
+        """キーを入れ替える。残っているキーの状態は引き継ぐ"""
+        states = {state.key: state for state in self._states}
+        self._states = [states.get(key) or KeyState(key) for key in keys]
+        self.rpm = rpm or 0
+        self.tpm = tpm or 0
+        
+    def __len__(self):
+        return len(self._states)
+    
+    def peek(self):
+        """モデル一覧の取得など、使用量を記録しない用途のキー"""
+        now = time.monotonic()
+        for state in sorted(self._states, key=lambda s: s.failures):
+            if state.cooldown_until <= now:
+                return state.key
+        return self._states[0].key if self._states else ''
+    
+    def snapshot(self):
+        """ダッシュボード表示用の各キーの状態
+        
+        GUIスレッドから呼ばれるため、エンジンのスレッドが更新する履歴は複製してから数える。
+        """
+        now = time.monotonic()
+        rows = []
+        for state in list(self._states):
+            requests = sum(1 for t in list(state.request_times) if t > now - self.WINDOW)
+            tokens = sum(n for t, n in list(state.token_log) if t > now - self.WINDOW)
+            rows.append({
+                'key': mask_api_key(state.key),
+                'requests': requests,
+                'tokens': tokens,
+                'in_flight': state.in_flight,
+                'cooldown': max(state.cooldown_until - now, 0),
+                'failures': state.failures,
+            })
+        return rows
+    
+    def _ready_at(self, state, now):
+        """キーが次に使えるようになる時刻"""
+        ready = state.cooldown_until
+        requests, tokens = state.usage(now, self.WINDOW)
+        if self.rpm and requests >= self.rpm:
+            ready = max(ready, state.request_times[0] + self.WINDOW)
+        if self.tpm and tokens >= self.tpm:
+            ready = max(ready, state.token_log[0][0] + self.WINDOW)
+        return ready
+    
+    def _remaining(self, state, now):
+        requests, tokens = state.usage(now, self.WINDOW)
+        if self.rpm or self.tpm:
+            return min(1 - requests / self.rpm if self.rpm else 1, 1 - tokens / self.tpm if self.tpm else 1)
+        return -requests
+    
+    async def acquire(self):
+        if not self._states:
+            return ''
+        while True:
+            now = time.monotonic()
+            available = [s for s in self._states if self._ready_at(s, now) <= now]
+            if available:
+                state = min(available, key=lambda s: (s.failures, s.in_flight, -self._remaining(s, now)))
+                state.in_flight += 1
+                state.request_times.append(now)
+                return state.key
+            wait = min(self._ready_at(s, now) for s in self._states) - now
+            if wait > self.MAX_WAIT:
+                if all(s.cooldown_reason == 'auth' and s.cooldown_until > now for s in self._states):
+                    raise Exception("全てのAPIキーで認証エラーになりました（APIキーと権限を確認してください）")
+                raise Exception(f"全てのAPIキーがレート制限中です（約{int(wait)}秒後に再試行してください）")
+            await asyncio.sleep(wait)
+            
+    def release(self, key, tokens=0, error=None):
+        """リクエスト結果を記録する。別のキーで再試行すべきエラーなら True を返す"""
+        state = next((s for s in self._states if s.key == key), None)
+        if state is None:
+            return False
+        state.in_flight = max(state.in_flight - 1, 0)
+        now = time.monotonic()
+        if error is None:
+            state.failures = 0
+            if tokens:
+                state.token_log.append((now, tokens))
+            return False
+        
+        status = _error_status(error)
+        if status == 429:
+            state.failures += 1
+            # Retry-After がなければ連続回数に応じて延ばす
+            cooldown = _retry_after(error) or self.RATE_LIMIT_COOLDOWN * 2 ** min(state.failures - 1, 4)
+            reason = 'rate_limit'
+        elif status in (401, 403):
+            if not any(s is not state and self._ready_at(s, now) <= now for s in self._states):
+                # 403 はモデル単位の権限エラーのこともあるため、代わりのキーがなければ止めずにそのままエラーにする
+                return False
+            state.failures += 1
+            cooldown = self.AUTH_COOLDOWN
+            reason = 'auth'
+        else:
+            return False
+        state.cooldown_until = now + cooldown
+        state.cooldown_reason = reason
+        return True
+
+
+def mask_api_key(key):
+    if not key:
+        return "(なし)"
+    return f"{key[:4]}…{key[-4:]}" if len(key) > 12 else "****"
+
+
+# 永続リクエストキュー
+class JobQueue:
+    """リクエストをジョブとしてSQLiteに記録する永続キュー
+    
+    同じ内容のリクエストは冪等キーで1つのジョブにまとめ、実行中・接続待ちの重複リクエストや再起動後の再実行を1回にする。
+    完了・失敗したジョブと同じリクエストは、ユーザーがやり直したものとして再実行する。
+    実行中・接続待ちのままアプリが終了したジョブは、次回起動時に pending に戻して再実行する。
+    GUIスレッドとエンジンのスレッドプールの両方から呼ばれるため、接続はロックで保護する。
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    WAITING = 'waiting'
+    DONE = 'done'
+    FAILED = 'failed'
+    
+    def __init__(self, path, retention_days=7):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    image BLOB,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+            self._conn.execute("UPDATE jobs SET state = ? WHERE state IN (?, ?)",
+                               (self.PENDING, self.RUNNING, self.WAITING))
+            self._conn.execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                               (self.DONE, self.FAILED, time.time() - retention_days * 86400))
+            
+    @staticmethod
+    def make_key(kind, payload, image=None):
+        digest = hashlib.sha256(json.dumps([kind, payload], sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        if image is not None:
+            digest.update(image)
+        return digest.hexdigest()
+    
+    def submit(self, kind, payload, image=None):
+        """ジョブを登録して行を dict で返す
+        
+        同じ冪等キーの未完了のジョブがあればそれを返す。完了済み・失敗済みなら pending に戻す。
+        """
+        key = self.make_key(kind, payload, image)
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (key,)).fetchone()
+            if row is None:
+                self._conn.execute(
+                    "INSERT INTO jobs (idempotency_key, kind, payload, image, state, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, kind, json.dumps(payload, ensure_ascii=False), image, self.PENDING, now, now))
+            elif row['state'] in (self.DONE, self.FAILED):
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, attempts = 0, result = NULL, error = NULL, updated_at = ? "
+                    "WHERE id = ?", (self.PENDING, now, row['id']))
+            return dict(self._conn.execute("SELECT * FROM jobs WHERE idempotency_key = ?", (key,)).fetchone())
+        
+    def pending(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (self.PENDING,)).fetchall()
+        return [dict(row) for row in rows]
+    
+    def start(self, job_id):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                               (self.RUNNING, time.time(), job_id))
+            
+    def set_state(self, job_id, state):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?",
+                               (state, time.time(), job_id))
+            
+    def finish(self, job_id, result):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, result = ?, error = NULL, updated_at = ? WHERE id = ?",
+                               (self.DONE, result, time.time(), job_id))
+            
+    def fail(self, job_id, error):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                               (self.FAILED, error, time.time(), job_id))
+            
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 用語集
+GLOSSARY_INSTRUCTIONS = "Always use the following translations for these terms:"
+
+GLOSSARY_FIX_PROMPT = (
+    "The translation below does not use the required terminology. "
+    "Revise it so that each listed term is translated exactly as specified, changing nothing else. "
+    "Output only the revised translation.\n\n"
+    "Required terms:\n{terms}\n\nSource text:\n{source}\n\nTranslation:\n{translation}"
+)
+
+
+class AhoCorasick:
+    """Aho-Corasick 法による複数パターンの同時検索（テキスト長に線形）"""
+    
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        # 出力を持つ最寄りの失敗リンク先（0 はなし）
+        self.dict_link = [0]
+        self.lengths = []
+        
+    def add(self, pattern):
+        """パターンを追加してIDを返す（同じパターンは同じID）"""
+        node = 0
+        for ch in pattern:
+            child = self.goto[node].get(ch)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][ch] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.dict_link.append(0)
+            node = child
+        if self.output[node] is None:
+            self.output[node] = len(self.lengths)
+            self.lengths.append(len(pattern))
+        return self.output[node]
+    
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                target = self.fail[child]
+                self.dict_link[child] = target if self.output[target] is not None else self.dict_link[target]
+                
+    def finditer(self, text):
+        """(開始位置, 終了位置, パターンID) を順に返す"""
+        goto, fail, output, dict_link, lengths = self.goto, self.fail, self.output, self.dict_link, self.lengths
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            n = node if output[node] is not None else dict_link[node]
+            while n:
+                pattern_id = output[n]
+                yield i + 1 - lengths[pattern_id], i + 1, pattern_id
+                n = dict_link[n]
+
+
+def _is_word_char(ch):
+    return ch.isascii() and (ch.isalnum() or ch == '_')
+
+
+class Glossary:
+    """用語集（CSV / TBX）と訳語の注入・検証"""
+    
+    def __init__(self, entries, max_entries=200, max_retries=1):
+        self.entries = []
+        self.max_entries = max_entries
+        self.max_retries = max_retries
+        self.matcher = AhoCorasick()
+        for source, target in entries:
+            source, target = source.strip(), (target or source).strip()
+            if not source:
+                continue
+            pattern_id = self.matcher.add(source.lower())
+            if pattern_id == len(self.entries):
+                self.entries.append((source, target))
+        self.matcher.build()
+        
+    @classmethod
+    def load(cls, path, target_lang='', **kwargs):
+        ext = os.path.splitext(path.lower())[1]
+        if ext == '.tbx':
+            return cls(cls._read_tbx(path, target_lang), **kwargs)
+        return cls(cls._read_csv(path), **kwargs)
+    
+    @staticmethod
+    def _read_csv(path):
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            sample = f.read(4096)
+            f.seek(0)
+            delimiter = '\t' if sample.count('\t') > sample.count(',') else ','
+            for i, row in enumerate(csv.reader(f, delimiter=delimiter)):
+                if not row or not row[0].strip() or row[0].startswith('#'):
+                    continue
+                if i == 0 and row[0].strip().lower() in ('source', 'term', 'src'):
+                    continue
+                # 1列だけの行は翻訳しない用語（製品名など）
+                yield row[0], row[1] if len(row) > 1 else ''
+                
+    @staticmethod
+    def _read_tbx(path, target_lang):
+        lang_attr = '{http://www.w3.org/XML/1998/namespace}lang'
+        local = lambda tag: tag.rsplit('}', 1)[-1]
+        for _, element in ElementTree.iterparse(path):
+            if local(element.tag) not in ('termEntry', 'conceptEntry'):
+                continue
+            terms = []
+            for lang_set in element.iter():
+                if local(lang_set.tag) != 'langSet':
+                    continue
+                term = next((t.text for t in lang_set.iter() if local(t.tag) == 'term' and t.text), None)
+                if term:
+                    terms.append((lang_set.get(lang_attr, lang_set.get('lang', '')).lower(), term))
+            element.clear()
+            if not terms:
+                continue
+            target = next((t for lang, t in terms if target_lang and lang.startswith(target_lang.lower())), None)
+            source = next((t for lang, t in terms if t != target), terms[0][1])
+            if target is None:
+                target = terms[1][1] if len(terms) > 1 else source
+            yield source, target
+            
+    def __len__(self):
+        return len(self.entries)
+    
+    def match(self, text):
+        """テキストに出現する用語を出現順に返す（重なりは最左最長を優先）"""
+        lowered = text.lower()
+        candidates = []
+        for start, end, pattern_id in self.matcher.finditer(lowered):
+            if start > 0 and _is_word_char(lowered[start]) and _is_word_char(lowered[start - 1]):
+                continue
+            if end < len(lowered) and _is_word_char(lowered[end - 1]) and _is_word_char(lowered[end]):
+                continue
+            candidates.append((start, -end, pattern_id))
+        candidates.sort()
+        
+        matched = []
+        seen = set()
+        position = 0
+        for start, neg_end, pattern_id in candidates:
+            if start < position:
+                continue
+            position = -neg_end
+            if pattern_id not in seen:
+                seen.add(pattern_id)
+                matched.append(self.entries[pattern_id])
+                if len(matched) >= self.max_entries:
+                    break
+        return matched
+    
+    def inject(self, messages, entries):
+        """最後の user メッセージの先頭に該当する用語だけを追加"""
+        if not entries:
+            return messages
+        block = GLOSSARY_INSTRUCTIONS + "\n" + self.format_entries(entries) + "\n\n"
+        messages = list(messages)
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].get('role') == 'user' and isinstance(messages[i].get('content'), str):
+                messages[i] = dict(messages[i], content=block + messages[i]['content'])
+                break
+        return messages
+    
+    def format_entries(self, entries):
+        return "\n".join(f"- {source} → {target}" for source, target in entries)
+    
+    def verify(self, translation, entries):
+        """訳文に含まれていない必須訳語のエントリを返す"""
+        lowered = (translation or '').lower()
+        return [entry for entry in entries if entry[1].lower() not in lowered]
+
+
+# バッチ翻訳設定
+BATCH_INSTRUCTIONS = (
+    "The text below consists of numbered items. Each item starts with a marker line such as [[1]]. "
+    "Translate every item separately and repeat each marker line unchanged, in the same order. "
+    "Keep placeholders such as %s, %1$d, {name} and HTML tags exactly as they are. "
+    "Do not merge, split or skip items, and do not add any commentary."
+)
+
+BATCH_CONTEXT_INSTRUCTIONS = (
+    "The following lines come right before the items and are given only as context. "
+    "Do not translate or repeat them:"
+)
+
+BATCH_MARKER_PATTERN = re.compile(r'^[ \t]*\[\[(\d+)\]\][ \t]*$', re.M)
+
+PLACEHOLDER_PATTERN = re.compile(
+    r'%(?:\d+\$)?(?:\([^)]*\))?[-+ #0]*(?:\d+|\*)?(?:\.\d+)?(?:hh|h|ll|l|q|z|t|j|L)?[diouxXeEfFgGaAcspn@%]'
+    r'|\{\{?[^{}]*\}\}?'
+    r'|\$\{[^}]*\}'
+    r'|<[^<>]+>'
+)
+
+
+def estimate_tokens(text):
+    """トークン数の概算（ASCIIは4文字で1トークン、それ以外は1文字1トークン）"""
+    non_ascii = sum(1 for c in text if ord(c) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def placeholders_match(source, translation):
+    """原文と訳文のプレースホルダーが一致するか確認"""
+    return Counter(PLACEHOLDER_PATTERN.findall(source)) == Counter(PLACEHOLDER_PATTERN.findall(translation))
+
+
+def pack_batches(items, token_budget, max_items, breaks=()):
+    """(番号, テキスト) のリストをトークン予算内のバッチに分割
+    
+    breaks に含まれる番号では、予算の半分以上埋まっていればバッチを区切る。
+    """
+    batch, used = [], 0
+    for item in items:
+        cost = estimate_tokens(item[1]) + 4
+        if batch and (used + cost > token_budget or len(batch) >= max_items
+                      or (item[0] in breaks and used >= token_budget // 2)):
+            yield batch
+            batch, used = [], 0
+        batch.append(item)
+        used += cost
+    if batch:
+        yield batch
+
+
+def build_batch_messages(template, items, context=None):
+    body = "\n".join(f"[[{n}]]\n{text}" for n, text in items)
+    if context:
+        body = BATCH_CONTEXT_INSTRUCTIONS + "\n" + "\n".join(context) + "\n\n" + body
+    messages = build_prompt_messages(template, body)
+    # 指示文は全バッチで共通なのでキャッシュ対象の先頭に置く
+    if messages[0]['role'] == 'system':
+        messages[0] = {"role": "system", "content": BATCH_INSTRUCTIONS + "\n\n" + messages[0]['content']}
+        return messages
+    return [{"role": "system", "content": BATCH_INSTRUCTIONS}] + messages
+
+
+def parse_batch_response(response, expected):
+    """バッチ応答を解析し、検証を通過した項目だけを返す"""
+    lines = response.strip().splitlines()
+    if lines and lines[0].startswith("```"):
+        lines = lines[1:]
+    if lines and lines[-1].startswith("```"):
+        lines = lines[:-1]
+    response = "\n".join(lines)
+    
+    matches = list(BATCH_MARKER_PATTERN.finditer(response))
+    if not matches and len(expected) == 1:
+        # 単一項目ではマーカーが省略されることがある
+        (n, source), = expected.items()
+        text = response.strip()
+        return {n: text} if text and placeholders_match(source, text) else {}
+    
+    results = {}
+    for i, m in enumerate(matches):
+        n = int(m.group(1))
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(response)
+        text = response[m.end():end].strip('\n').rstrip()
+        if n in expected and n not in results and text.strip() and placeholders_match(expected[n], text):
+            results[n] = text
+    return results
+
+
+class BatchTranslator:
+    """短い文字列を番号付きバッチにまとめて翻訳"""
+    
+    def __init__(self, complete, prompt_template, token_budget=1500, max_items=80, max_retries=2,
+                 context_size=0, concurrency=1, glossary=None):
+        self.complete = complete
+        self.prompt_template = prompt_template
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self.max_retries = max_retries
+        self.context_size = context_size
+        self.concurrency = concurrency
+        self.glossary = glossary
+        self.request_count = 0
+        self._glossary_entries = {}
+        
+    async def translate(self, texts, progress=None, breaks=()):
+        """翻訳結果のリストと、未翻訳のまま残ったインデックスのリストを返す"""
+        results = list(texts)
+        # 空文字列やプレースホルダーのみの項目は送信しない
+        pending = [i for i, t in enumerate(texts) if PLACEHOLDER_PATTERN.sub('', t).strip()]
+        total = len(pending)
+        done = 0
+        last_error = None
+        break_numbers = {i + 1 for i in breaks}
+        
+        for attempt in range(self.max_retries + 1):
+            if not pending:
+                break
+            retry = []
+            batches = list(pack_batches([(i + 1, texts[i]) for i in pending],
+                                        self.token_budget, self.max_items, break_numbers))
+            async for batch, response, error in self._run_batches(texts, batches):
+                self.request_count += 1
+                expected = dict(batch)
+                parsed = {}
+                if error is not None:
+                    last_error = error
+                else:
+                    parsed = parse_batch_response(response or "", expected)
+                    if self.glossary and attempt < self.max_retries:
+                        # 必須訳語が欠けた項目だけを再リクエストに回す
+                        parsed = {n: text for n, text in parsed.items()
+                                  if not self.glossary.verify(text, self._entries_for(texts, n - 1))}
+                for n in expected:
+                    if n in parsed:
+                        results[n - 1] = parsed[n]
+                        done += 1
+                    else:
+                        retry.append(n - 1)
+                if progress:
+                    progress(done, total)
+            pending = sorted(retry)
+            
+        if pending and done == 0 and last_error is not None:
+            raise last_error
+        return results, pending
+    
+    def _entries_for(self, texts, index):
+        if index not in self._glossary_entries:
+            self._glossary_entries[index] = self.glossary.match(texts[index])
+        return self._glossary_entries[index]
+    
+    def _build_messages(self, texts, batch):
+        first = batch[0][0] - 1
+        context = texts[max(0, first - self.context_size):first] if self.context_size else None
+        messages = build_batch_messages(self.prompt_template, batch, context)
+        if self.glossary:
+            entries = list(OrderedDict.fromkeys(
+                entry for n, _ in batch for entry in self._entries_for(texts, n - 1)))
+            messages = self.glossary.inject(messages, entries[:self.glossary.max_entries])
+        return messages
+    
+    async def _run_batches(self, texts, batches):
+        """(バッチ, 応答, 例外) を完了順に返す"""
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        
+        async def run(batch):
+            async with semaphore:
+                try:
+                    return batch, await self.complete(self._build_messages(texts, batch)), None
+                except Exception as e:
+                    return batch, None, e
+                
+        tasks = [asyncio.ensure_future(run(batch)) for batch in batches]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def _unescape_c_string(value):
+    return re.sub(r'\\(u[0-9a-fA-F]{4}|U[0-9a-fA-F]{4}|.)', _unescape_match, value)
+
+
+def _unescape_match(m):
+    seq = m.group(1)
+    if seq[0] in 'uU' and len(seq) == 5:
+        return chr(int(seq[1:], 16))
+    return {'n': '\n', 't': '\t', 'r': '\r', '"': '"', '\\': '\\'}.get(seq, '\\' + seq)
+
+
+def _escape_c_string(value):
+    return (value.replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n').replace('\t', '\\t').replace('\r', '\\r'))
+
+
+class JsonLocalization:
+    """i18n JSON（ネストしたキー）"""
+    
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            self.data = json.load(f)
+        self.keys = []
+        self.texts = []
+        self._collect(self.data, ())
+        
+    def _collect(self, node, key_path):
+        if isinstance(node, dict):
+            for k, v in node.items():
+                # ARB形式の "@key" メタデータは翻訳しない
+                if isinstance(k, str) and k.startswith('@'):
+                    continue
+                self._collect(v, key_path + (k,))
+        elif isinstance(node, list):
+            for i, v in enumerate(node):
+                self._collect(v, key_path + (i,))
+        elif isinstance(node, str):
+            self.keys.append(key_path)
+            self.texts.append(node)
+            
+    def save(self, path, translations, failed=()):
+        for key_path, text in zip(self.keys, translations):
+            node = self.data
+            for k in key_path[:-1]:
+                node = node[k]
+            node[key_path[-1]] = text
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+            f.write('\n')
+
+
+class StringsLocalization:
+    """Apple .strings（コメントと書式はそのまま保持）"""
+    
+    TOKEN_PATTERN = re.compile(
+        r'(/\*.*?\*/|//[^\n]*)|"((?:[^"\\]|\\.)*)"(\s*=\s*)"((?:[^"\\]|\\.)*)"(\s*;)', re.S)
+    
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if raw.startswith((b'\xff\xfe', b'\xfe\xff')):
+            self.encoding = 'utf-16'
+        else:
+            self.encoding = 'utf-8-sig' if raw.startswith(b'\xef\xbb\xbf') else 'utf-8'
+        self.content = raw.decode(self.encoding)
+        self.matches = [m for m in self.TOKEN_PATTERN.finditer(self.content) if not m.group(1)]
+        self.keys = [_unescape_c_string(m.group(2)) for m in self.matches]
+        self.texts = [_unescape_c_string(m.group(4)) for m in self.matches]
+        
+    def save(self, path, translations, failed=()):
+        parts = []
+        pos = 0
+        for m, text in zip(self.matches, translations):
+            parts.append(self.content[pos:m.start()])
+            parts.append(f'"{m.group(2)}"{m.group(3)}"{_escape_c_string(text)}"{m.group(5)}')
+            pos = m.end()
+        parts.append(self.content[pos:])
+        with open(path, 'w', encoding=self.encoding, newline='') as f:
+            f.write("".join(parts))
+
+
+class PoLocalization:
+    """gettext .po（msgstr が空のエントリを翻訳）"""
+    
+    KEYWORD_PATTERN = re.compile(r'^(msgctxt|msgid_plural|msgid|msgstr)(?:\[(\d+)\])?\s+"(.*)"$')
+    NPLURALS_PATTERN = re.compile(r'^Plural-Forms:.*?nplurals\s*=\s*(\d+)', re.MULTILINE)
+    
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8-sig') as f:
+            self.entries = self._parse(f.read())
+        self.nplurals = self._nplurals()
+        self.keys = []
+        self.texts = []
+        for index, entry in enumerate(self.entries):
+            if not entry['msgid'] or any(entry['msgstr'].values()):
+                continue
+            if entry['msgid_plural'] is not None and self.nplurals == 1:
+                # 複数形のない言語（日本語など）は msgstr[0] に複数形の原文の訳を入れる
+                self.keys.append((index, 1))
+                self.texts.append(entry['msgid_plural'])
+                continue
+            self.keys.append((index, 0))
+            self.texts.append(entry['msgid'])
+            if entry['msgid_plural'] is not None:
+                self.keys.append((index, 1))
+                self.texts.append(entry['msgid_plural'])
+                
+    def _nplurals(self):
+        """ヘッダーエントリの Plural-Forms の nplurals（ない場合は gettext の既定の 2）"""
+        for entry in self.entries:
+            if entry['msgid'] == '' and entry['msgctxt'] is None:
+                m = self.NPLURALS_PATTERN.search(entry['msgstr'].get(0, ''))
+                if m and int(m.group(1)) > 0:
+                    return int(m.group(1))
+        return 2
+                
+    def _parse(self, content):
+        entries = []
+        entry = None
+        field = None
+        for line in content.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                if entry:
+                    entries.append(entry)
+                entry, field = None, None
+                continue
+            if entry is None:
+                entry = {'comments': [], 'msgctxt': None, 'msgid': None, 'msgid_plural': None, 'msgstr': {}}
+            if stripped.startswith('#'):
+                entry['comments'].append(line)
+                field = None
+                continue
+            m = self.KEYWORD_PATTERN.match(stripped)
+            if m:
+                keyword, index, value = m.groups()
+                field = (keyword, int(index or 0))
+                self._append(entry, field, _unescape_c_string(value))
+            elif stripped.startswith('"') and stripped.endswith('"') and field:
+                self._append(entry, field, _unescape_c_string(stripped[1:-1]))
+        if entry:
+            entries.append(entry)
+        return entries
+    
+    def _append(self, entry, field, value):
+        keyword, index = field
+        if keyword == 'msgstr':
+            entry['msgstr'][index] = entry['msgstr'].get(index, '') + value
+        else:
+            entry[keyword] = (entry[keyword] or '') + value
+            
+    def _format(self, keyword, value):
+        lines = value.splitlines(keepends=True)
+        if len(lines) <= 1:
+            return [f'{keyword} "{_escape_c_string(value)}"']
+        return [f'{keyword} ""'] + [f'"{_escape_c_string(line)}"' for line in lines]
+    
+    def save(self, path, translations, failed=()):
+        """翻訳を書き込んで保存する
+        
+        failed（翻訳できなかった項目のインデックス）を含むエントリは msgstr を空のまま残す。
+        原文を書き込むと gettext が翻訳済みとして扱い、次回の翻訳でも対象外になるため。
+        """
+        failed_entries = {self.keys[i][0] for i in failed}
+        for (index, form), text in zip(self.keys, translations):
+            if index in failed_entries:
+                continue
+            entry = self.entries[index]
+            if entry['msgid_plural'] is None:
+                entry['msgstr'][0] = text
+            elif self.nplurals == 1:
+                entry['msgstr'] = {0: text}
+            elif form == 0:
+                entry['msgstr'][0] = text
+            else:
+                # msgstr[1] 以降は言語ごとに個別の形があるが、複数形の原文の訳で埋める
+                for i in range(1, self.nplurals):
+                    entry['msgstr'][i] = text
+                        
+        blocks = []
+        for entry in self.entries:
+            lines = list(entry['comments'])
+            if entry['msgctxt'] is not None:
+                lines += self._format('msgctxt', entry['msgctxt'])
+            if entry['msgid'] is not None:
+                lines += self._format('msgid', entry['msgid'])
+                if entry['msgid_plural'] is not None:
+                    lines += self._format('msgid_plural', entry['msgid_plural'])
+                    for i in sorted(entry['msgstr']):
+                        lines += self._format(f'msgstr[{i}]', entry['msgstr'][i])
+                else:
+                    lines += self._format('msgstr', entry['msgstr'].get(0, ''))
+            blocks.append("\n".join(lines))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n\n".join(blocks) + "\n")
+
+
+LOCALIZATION_FORMATS = {
+    '.json': JsonLocalization,
+    '.strings': StringsLocalization,
+    '.po': PoLocalization,
+}
+
+
+class SubtitleDocument:
+    """SRT / WebVTT 字幕（番号・タイムコード・ヘッダーは保持し、本文だけを翻訳）"""
+    
+    TIMING_PATTERN = re.compile(
+        r'(?:(\d+):)?(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(?:(\d+):)?(\d{2}):(\d{2})[,.](\d{3})')
+    # この秒数以上の無音区間はシーンの切れ目としてバッチを区切る
+    SCENE_GAP = 5.0
+    
+    def __init__(self, path):
+        with open(path, 'r', encoding='utf-8-sig', errors='replace') as f:
+            content = f.read().replace('\r\n', '\n').replace('\r', '\n')
+        self.blocks = []
+        self.keys = []
+        self.texts = []
+        self.breaks = []
+        previous_end = None
+        for block in re.split(r'\n[ \t]*\n', content.strip('\n')):
+            lines = block.split('\n')
+            timing = next((i for i, line in enumerate(lines) if self.TIMING_PATTERN.search(line)), None)
+            if timing is None:
+                self.blocks.append((lines, None))
+                continue
+            start, end = self._parse_timing(lines[timing])
+            if previous_end is not None and start - previous_end >= self.SCENE_GAP:
+                self.breaks.append(len(self.texts))
+            previous_end = end
+            self.blocks.append((lines[:timing + 1], len(self.texts)))
+            self.keys.append(lines[timing].strip())
+            self.texts.append("\n".join(lines[timing + 1:]))
+            
+    def _parse_timing(self, line):
+        g = self.TIMING_PATTERN.search(line).groups()
+        to_seconds = lambda h, m, s, ms: int(h or 0) * 3600 + int(m) * 60 + int(s) + int(ms) / 1000
+        return to_seconds(*g[:4]), to_seconds(*g[4:])
+    
+    def save(self, path, translations, failed=()):
+        blocks = []
+        for header, index in self.blocks:
+            lines = list(header)
+            if index is not None and translations[index]:
+                lines.append(translations[index])
+            blocks.append("\n".join(lines))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n\n".join(blocks) + "\n")
+
+
+SUBTITLE_FORMATS = {
+    '.srt': SubtitleDocument,
+    '.vtt': SubtitleDocument,
+}
@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+from gtsfh_core import (BatchTranslator, build_batch_messages, pack_batches, parse_batch_response,
+                        placeholders_match)
+
+
+class PlaceholderTest(unittest.TestCase):
+
+    def test_same_placeholders_in_any_order(self):
+        self.assertTrue(placeholders_match("%1$s has %2$d files", "%2$d 個のファイル（%1$s）"))
+        self.assertTrue(placeholders_match("Hello {name}, <b>{count}</b>", "<b>{count}</b> {name} さん"))
+
+    def test_missing_or_changed_placeholder(self):
+        self.assertFalse(placeholders_match("%d files", "ファイル"))
+        self.assertFalse(placeholders_match("%d files", "%s ファイル"))
+        self.assertFalse(placeholders_match("${user}", "${name}"))
+        self.assertFalse(placeholders_match("a %s b", "%s a %s b"))
+
+
+class ParseBatchResponseTest(unittest.TestCase):
+
+    def test_markers(self):
+        expected = {1: "One", 2: "Two\nlines", 3: "%d items"}
+        response = "[[1]]\n一\n[[2]]\n二\n行\n[[3]]\n%d 項目\n"
+        self.assertEqual(parse_batch_response(response, expected), {1: "一", 2: "二\n行", 3: "%d 項目"})
+
+    def test_code_fence_and_marker_spacing(self):
+        response = "```\n  [[1]]  \nはい\n[[2]]\nいいえ\n```"
+        self.assertEqual(parse_batch_response(response, {1: "Yes", 2: "No"}), {1: "はい", 2: "いいえ"})
+
+    def test_rejects_invalid_items(self):
+        # 未知の番号・重複・空の訳・プレースホルダーの欠落は採用しない
+        response = "[[1]]\n一\n[[1]]\n別の訳\n[[2]]\n\n[[3]]\n項目\n[[9]]\n九"
+        self.assertEqual(parse_batch_response(response, {1: "One", 2: "Two", 3: "%d items"}), {1: "一"})
+
+    def test_single_item_without_marker(self):
+        self.assertEqual(parse_batch_response("こんにちは\n", {5: "Hello"}), {5: "こんにちは"})
+        self.assertEqual(parse_batch_response("ファイル", {5: "%d files"}), {})
+        self.assertEqual(parse_batch_response("一\n二", {1: "One", 2: "Two"}), {})
+
+
+class PackBatchesTest(unittest.TestCase):
+
+    def test_budget_and_max_items(self):
+        items = [(i, "x" * 40) for i in range(1, 8)]
+        batches = list(pack_batches(items, token_budget=50, max_items=80))
+        self.assertEqual([len(b) for b in batches], [3, 3, 1])
+        self.assertEqual([len(b) for b in pack_batches(items, token_budget=10000, max_items=2)], [2, 2, 2, 1])
+
+    def test_breaks_only_when_half_full(self):
+        items = [(i, "x" * 80) for i in range(1, 5)]
+        self.assertEqual([[n for n, _ in b] for b in pack_batches(items, 100, 80, breaks={2, 4})],
+                         [[1, 2, 3], [4]])
+
+    def test_messages_number_items_and_put_instructions_first(self):
+        messages = build_batch_messages("Translate:\n\n{text}", [(1, "a"), (2, "b")], context=["prev"])
+        self.assertEqual(messages[0]['role'], 'system')
+        self.assertTrue(messages[0]['content'].endswith("Translate:"))
+        self.assertTrue(messages[1]['content'].endswith("prev\n\n[[1]]\na\n[[2]]\nb"))
+
+
+class BatchTranslatorTest(unittest.TestCase):
+
+    def test_retries_items_missing_from_the_response(self):
+        calls = []
+
+        async def complete(messages):
+            body = messages[-1]['content']
+            calls.append(body)
+            if len(calls) == 1:
+                return "[[1]]\n一"
+            return "[[2]]\n二" if "[[2]]" in body else ""
+
+        translator = BatchTranslator(complete, "{text}", max_retries=2)
+        results, failed = asyncio.run(translator.translate(["One", "Two", ""]))
+        self.assertEqual((results, failed), (["一", "二", ""], []))
+        self.assertEqual(translator.request_count, 2)
+
+    def test_failed_items_are_reported(self):
+        async def complete(messages):
+            return "[[1]]\n一\n[[2]]\nファイル"
+
+        translator = BatchTranslator(complete, "{text}", max_retries=1)
+        results, failed = asyncio.run(translator.translate(["One", "%d files"]))
+        self.assertEqual(failed, [1])
+        self.assertEqual(results[0], "一")
+
+    def test_raises_when_nothing_was_translated(self):
+        async def complete(messages):
+            raise ConnectionError("offline")
+
+        translator = BatchTranslator(complete, "{text}", max_retries=1)
+        with self.assertRaises(ConnectionError):
+            asyncio.run(translator.translate(["One", "Two"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+
+try:
+    import gtsfh
+except ImportError as e:
+    # gtsfh は PyQt5 / pynput を必要とする。GUIに依存しない部分は gtsfh_core のテストで確認する
+    raise unittest.SkipTest(f"gtsfh を読み込めません: {e}")
+
+
+class BenchmarkRunnerTest(unittest.TestCase):
+    """ネットワークを使わない Stub プロバイダーでベンチマークを実行する"""
+    
+    def setUp(self):
+        self.stub = gtsfh.PROVIDERS['Stub']
+        self.latency, self.word_delay = self.stub.latency, self.stub.word_delay
+        self.stub.latency, self.stub.word_delay = 0.01, 0.0
+        
+    def tearDown(self):
+        self.stub.latency, self.stub.word_delay = self.latency, self.word_delay
+        
+    def test_run_against_stub(self):
+        runner = gtsfh.BenchmarkRunner("{text}", concurrency=2)
+        inputs = ["hello world", "good morning", "abc"]
+        progress = []
+        report = asyncio.run(runner.run([("Stub", "echo"), ("Stub", "upper")], inputs,
+                                        lambda done, total: progress.append((done, total))))
+        
+        self.assertEqual(progress[-1], (6, 6))
+        self.assertEqual([[r['output'] for r in row] for row in report['results']],
+                         [[text, text.upper()] for text in inputs])
+        
+        echo, upper = report['summary']
+        self.assertEqual((echo['model'], echo['requests'], echo['errors']), ("echo", 3, 0))
+        self.assertEqual((upper['model'], upper['requests'], upper['errors']), ("upper", 3, 0))
+        self.assertGreater(echo['cost'], 0)
+        # 2モデルの一致度は互いに同じ値になる。小文字と大文字の出力なので完全一致ではない
+        self.assertAlmostEqual(echo['agreement'], upper['agreement'])
+        self.assertLess(echo['agreement'], 1.0)
+        self.assertEqual(len(gtsfh.benchmark_summary_rows(report)), 2)
+        
+    def test_agreement_scores(self):
+        self.assertEqual(gtsfh.agreement_scores(["same", "same"]), [1.0, 1.0])
+        self.assertEqual(gtsfh.agreement_scores(["only", None]), [None, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from gtsfh_core import AhoCorasick, Glossary
+
+
+class AhoCorasickTest(unittest.TestCase):
+
+    def test_finds_overlapping_patterns(self):
+        matcher = AhoCorasick()
+        ids = [matcher.add(p) for p in ("he", "she", "his", "hers")]
+        self.assertEqual(matcher.add("she"), ids[1])
+        matcher.build()
+        found = sorted((start, end, ["he", "she", "his", "hers"][i]) for start, end, i in matcher.finditer("ushers"))
+        self.assertEqual(found, [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")])
+
+    def test_matches_brute_force(self):
+        patterns = ["a", "ab", "bab", "bc", "bca", "c", "caa"]
+        text = "abccab" * 3 + "bcaab"
+        matcher = AhoCorasick()
+        for pattern in patterns:
+            matcher.add(pattern)
+        matcher.build()
+        expected = sorted((i, i + len(p), n) for n, p in enumerate(patterns)
+                          for i in range(len(text)) if text.startswith(p, i))
+        self.assertEqual(sorted(matcher.finditer(text)), expected)
+
+
+class GlossaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.glossary = Glossary([("API key", "APIキー"), ("key", "キー"), ("Go", ""), ("設定", "Settings")])
+
+    def test_match_is_case_insensitive_longest_and_word_bounded(self):
+        self.assertEqual(self.glossary.match("Enter the api KEY. Google keys"),
+                         [("API key", "APIキー")])
+        self.assertEqual(self.glossary.match("key, go and 設定画面"),
+                         [("key", "キー"), ("Go", "Go"), ("設定", "Settings")])
+
+    def test_inject_and_verify(self):
+        entries = self.glossary.match("API key")
+        messages = self.glossary.inject([{"role": "system", "content": "s"}, {"role": "user", "content": "API key"}],
+                                        entries)
+        self.assertEqual(messages[0]['content'], "s")
+        self.assertIn("- API key → APIキー", messages[1]['content'])
+        self.assertTrue(messages[1]['content'].endswith("\n\nAPI key"))
+        self.assertEqual(self.glossary.verify("APIキーを入力", entries), [])
+        self.assertEqual(self.glossary.verify("鍵を入力", entries), entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from gtsfh_core import JobQueue
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'jobs.db')
+
+    def open(self, **kwargs):
+        queue = JobQueue(self.path, **kwargs)
+        self.addCleanup(queue.close)
+        return queue
+
+    def test_same_request_is_one_job(self):
+        queue = self.open()
+        job = queue.submit('translate', {'text': 'a', 'model': 'm'})
+        self.assertEqual(queue.submit('translate', {'model': 'm', 'text': 'a'})['id'], job['id'])
+        self.assertNotEqual(queue.submit('translate', {'text': 'a', 'model': 'm'}, image=b'png')['id'], job['id'])
+        self.assertNotEqual(queue.submit('summarize', {'text': 'a', 'model': 'm'})['id'], job['id'])
+
+    def test_running_job_is_shared_and_finished_job_runs_again(self):
+        queue = self.open()
+        job = queue.submit('translate', {'text': 'a'})
+        queue.start(job['id'])
+        self.assertEqual(queue.submit('translate', {'text': 'a'})['state'], JobQueue.RUNNING)
+
+        queue.finish(job['id'], "A")
+        again = queue.submit('translate', {'text': 'a'})
+        self.assertEqual((again['id'], again['state'], again['result']), (job['id'], JobQueue.PENDING, None))
+
+    def test_interrupted_jobs_are_pending_after_restart(self):
+        queue = self.open()
+        running = queue.submit('translate', {'text': 'a'})
+        waiting = queue.submit('translate', {'text': 'b'})
+        done = queue.submit('translate', {'text': 'c'})
+        queue.start(running['id'])
+        queue.set_state(waiting['id'], JobQueue.WAITING)
+        queue.finish(done['id'], "C")
+        queue.close()
+
+        pending = self.open().pending()
+        self.assertEqual([job['id'] for job in pending], [running['id'], waiting['id']])
+        self.assertEqual(pending[0]['attempts'], 1)
+
+    def test_old_finished_jobs_are_removed(self):
+        queue = self.open()
+        old = queue.submit('translate', {'text': 'old'})
+        failed = queue.submit('translate', {'text': 'failed'})
+        recent = queue.submit('translate', {'text': 'recent'})
+        queue.finish(old['id'], "x")
+        queue.fail(failed['id'], "error")
+        queue.finish(recent['id'], "y")
+        queue.close()
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("UPDATE jobs SET updated_at = ? WHERE id IN (?, ?)",
+                         (time.time() - 8 * 86400, old['id'], failed['id']))
+        conn.close()
+
+        queue = self.open(retention_days=7)
+        self.assertEqual(queue.submit('translate', {'text': 'recent'})['id'], recent['id'])
+        self.assertNotIn(queue.submit('translate', {'text': 'old'})['id'], (old['id'], failed['id']))
+
+
+if __name__ == '__main__':
+    unittest.main()
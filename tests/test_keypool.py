@@ -0,0 +1,90 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from gtsfh_core import KeyPool, is_transient_error, parse_api_keys
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = mock.Mock(headers={'retry-after': retry_after} if retry_after else {})
+
+
+class KeyPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('gtsfh_core.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def acquire(self, pool):
+        return asyncio.run(pool.acquire())
+
+    def test_parse_api_keys(self):
+        self.assertEqual(parse_api_keys(" a, b\nc,,a "), ["a", "b", "c"])
+        self.assertEqual(parse_api_keys(["x", " x", ""]), ["x"])
+        self.assertEqual(parse_api_keys(None), [])
+
+    def test_rotates_to_the_least_used_key(self):
+        pool = KeyPool()
+        pool.configure(["a", "b"])
+        first = self.acquire(pool)
+        second = self.acquire(pool)
+        self.assertEqual({first, second}, {"a", "b"})
+        pool.release(first)
+        self.assertEqual(self.acquire(pool), first)
+
+    def test_rate_limited_key_cools_down_for_retry_after(self):
+        pool = KeyPool()
+        pool.configure(["a", "b"])
+        key = self.acquire(pool)
+        self.assertTrue(pool.release(key, error=HTTPError(429, retry_after="20")))
+        other = {"a", "b"} - {key}
+        for _ in range(3):
+            self.assertEqual({self.acquire(pool)}, other)
+        self.now += 21
+        # 失敗したキーは成功しているキーより後回しになるが、そちらも制限されれば使う
+        pool.release(other.pop(), error=HTTPError(429, retry_after="20"))
+        self.assertEqual(self.acquire(pool), key)
+
+    def test_auth_error_on_the_only_usable_key_is_not_a_cooldown(self):
+        pool = KeyPool()
+        pool.configure(["a"])
+        self.assertFalse(pool.release(self.acquire(pool), error=HTTPError(401)))
+        self.assertEqual(self.acquire(pool), "a")
+
+        pool.configure(["a", "b"])
+        key = self.acquire(pool)
+        self.assertTrue(pool.release(key, error=HTTPError(403)))
+        self.assertEqual(pool.peek(), ({"a", "b"} - {key}).pop())
+
+    def test_rpm_limit(self):
+        pool = KeyPool()
+        pool.configure(["a", "b"], rpm=1)
+        self.assertEqual({self.acquire(pool), self.acquire(pool)}, {"a", "b"})
+        self.assertEqual(pool._ready_at(pool._states[0], self.now), self.now + KeyPool.WINDOW)
+
+    def test_configure_keeps_state_of_remaining_keys(self):
+        pool = KeyPool()
+        pool.configure(["a", "b"])
+        self.acquire(pool)
+        self.acquire(pool)
+        pool.release("a", error=HTTPError(429))
+        pool.configure(["b", "a", "c"])
+        self.assertGreater(next(s for s in pool._states if s.key == "a").cooldown_until, self.now)
+        self.assertEqual(len(pool), 3)
+
+    def test_transient_errors(self):
+        self.assertTrue(is_transient_error(HTTPError(503)))
+        self.assertTrue(is_transient_error(ConnectionError()))
+        self.assertFalse(is_transient_error(HTTPError(400)))
+        self.assertFalse(is_transient_error(HTTPError(500)))
+        self.assertFalse(is_transient_error(ValueError()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import json
+import os
+import tempfile
+import unittest
+
+from gtsfh_core import JsonLocalization, PoLocalization, StringsLocalization, SubtitleDocument
+
+
+PO_SOURCE = '''# Japanese translation
+msgid ""
+msgstr ""
+"Content-Type: text/plain; charset=UTF-8\\n"
+"Plural-Forms: nplurals=1; plural=0;\\n"
+
+#: main.c:10
+msgid "Hello"
+msgstr ""
+
+msgctxt "menu"
+msgid ""
+"Open a\\n"
+"\\"file\\""
+msgstr ""
+
+msgid "Done"
+msgstr "完了"
+
+msgid "%d file"
+msgid_plural "%d files"
+msgstr[0] ""
+'''
+
+SRT_SOURCE = '''1
+00:00:01,000 --> 00:00:02,500
+Hello
+
+2
+00:00:10,000 --> 00:00:12,000
+Two
+lines
+'''
+
+VTT_SOURCE = '''WEBVTT
+
+NOTE kept as is
+
+intro
+00:01.000 --> 00:02.000 align:start
+Hi there
+'''
+
+
+class LocalizationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, content, encoding='utf-8'):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', encoding=encoding, newline='') as f:
+            f.write(content)
+        return path
+
+    def read(self, path, encoding='utf-8'):
+        with open(path, 'r', encoding=encoding, newline='') as f:
+            return f.read()
+
+
+class PoLocalizationTest(LocalizationTestCase):
+
+    def test_round_trip(self):
+        po = PoLocalization(self.write('ja.po', PO_SOURCE))
+        self.assertEqual(po.nplurals, 1)
+        # 翻訳済みのエントリとヘッダーは対象外。複数形のない言語では複数形の原文だけを訳す
+        self.assertEqual(po.texts, ["Hello", 'Open a\n"file"', "%d files"])
+
+        output = self.write('out.po', '')
+        po.save(output, ["こんにちは", '開く\n"ファイル"', "%d 個のファイル"])
+        saved = self.read(output)
+        self.assertIn('#: main.c:10\nmsgid "Hello"\nmsgstr "こんにちは"', saved)
+        self.assertIn('msgctxt "menu"\nmsgid ""\n"Open a\\n"\n"\\"file\\""\nmsgstr ""\n"開く\\n"\n"\\"ファイル\\""',
+                      saved)
+        self.assertIn('msgid_plural "%d files"\nmsgstr[0] "%d 個のファイル"', saved)
+        self.assertIn('msgstr "完了"', saved)
+
+        # 保存したファイルは翻訳済みとして扱われる
+        self.assertEqual(PoLocalization(output).texts, [])
+
+    def test_failed_items_stay_untranslated(self):
+        source = PO_SOURCE.replace("nplurals=1; plural=0;", "nplurals=2; plural=(n != 1);")
+        po = PoLocalization(self.write('de.po', source))
+        self.assertEqual(po.texts, ["Hello", 'Open a\n"file"', "%d file", "%d files"])
+        output = self.write('out.po', '')
+        # BatchTranslator は翻訳できなかった項目に原文を残して返す
+        po.save(output, ["Hallo", 'Open a\n"file"', "%d Datei", "%d files"], failed=[1, 3])
+        saved = self.read(output)
+        self.assertIn('msgid "Hello"\nmsgstr "Hallo"', saved)
+        self.assertIn('"\\"file\\""\nmsgstr ""\n', saved)
+        # 複数形の一部だけが失敗した場合もエントリ全体を未翻訳のままにする
+        self.assertIn('msgid_plural "%d files"\nmsgstr[0] ""\n', saved)
+        self.assertNotIn("%d Datei", saved)
+
+        # 次回の翻訳で失敗した項目だけが再び対象になる
+        self.assertEqual(PoLocalization(output).texts, ['Open a\n"file"', "%d file", "%d files"])
+
+    def test_plural_forms_follow_nplurals(self):
+        source = PO_SOURCE.replace("nplurals=1; plural=0;", "nplurals=3; plural=(n==1 ? 0 : n<5 ? 1 : 2);")
+        po = PoLocalization(self.write('pl.po', source))
+        self.assertEqual(po.texts[-2:], ["%d file", "%d files"])
+        output = self.write('out.po', '')
+        po.save(output, ["a", "b", "%d plik", "%d pliki"])
+        self.assertIn('msgstr[0] "%d plik"\nmsgstr[1] "%d pliki"\nmsgstr[2] "%d pliki"', self.read(output))
+
+
+class StringsLocalizationTest(LocalizationTestCase):
+
+    SOURCE = ('/* Greeting */\n"hello" = "Hello";\n// "ignored" = "Comment";\n'
+              '"quote \\"key\\"" = "Say \\"hi\\"\\n";\n')
+
+    def test_round_trip_keeps_comments_and_escapes(self):
+        strings = StringsLocalization(self.write('Localizable.strings', self.SOURCE))
+        self.assertEqual(strings.keys, ["hello", 'quote "key"'])
+        self.assertEqual(strings.texts, ["Hello", 'Say "hi"\n'])
+
+        output = os.path.join(self.tmp.name, 'out.strings')
+        strings.save(output, ["こんにちは", '「hi」と言う\n'])
+        self.assertEqual(self.read(output), self.SOURCE.replace('"Hello"', '"こんにちは"')
+                         .replace('"Say \\"hi\\"\\n"', '"「hi」と言う\\n"'))
+
+    def test_utf16_is_kept(self):
+        path = self.write('utf16.strings', '\ufeff"a" = "A";\n', encoding='utf-16-le')
+        strings = StringsLocalization(path)
+        self.assertEqual(strings.texts, ["A"])
+        output = os.path.join(self.tmp.name, 'out.strings')
+        strings.save(output, ["エー"])
+        self.assertEqual(self.read(output, encoding='utf-16'), '"a" = "エー";\n')
+
+
+class JsonLocalizationTest(LocalizationTestCase):
+
+    def test_round_trip_skips_metadata(self):
+        data = {"title": "Title", "@title": {"description": "meta"}, "menu": {"items": ["Open", "Close"]}}
+        localization = JsonLocalization(self.write('en.json', json.dumps(data)))
+        self.assertEqual(localization.texts, ["Title", "Open", "Close"])
+        output = os.path.join(self.tmp.name, 'out.json')
+        localization.save(output, ["タイトル", "開く", "閉じる"])
+        with open(output, encoding='utf-8') as f:
+            self.assertEqual(json.load(f), {"title": "タイトル", "@title": {"description": "meta"},
+                                            "menu": {"items": ["開く", "閉じる"]}})
+
+
+class SubtitleDocumentTest(LocalizationTestCase):
+
+    def test_srt_round_trip_and_scene_breaks(self):
+        document = SubtitleDocument(self.write('a.srt', SRT_SOURCE.replace('\n', '\r\n')))
+        self.assertEqual(document.texts, ["Hello", "Two\nlines"])
+        # 5秒以上の空きはシーンの切れ目
+        self.assertEqual(document.breaks, [1])
+
+        output = os.path.join(self.tmp.name, 'out.srt')
+        document.save(output, ["こんにちは", "二\n行"])
+        self.assertEqual(self.read(output), SRT_SOURCE.replace("Hello", "こんにちは").replace("Two\nlines", "二\n行"))
+
+    def test_vtt_keeps_header_notes_and_cue_settings(self):
+        document = SubtitleDocument(self.write('a.vtt', VTT_SOURCE))
+        self.assertEqual(document.texts, ["Hi there"])
+        output = os.path.join(self.tmp.name, 'out.vtt')
+        document.save(output, ["やあ"])
+        self.assertEqual(self.read(output), VTT_SOURCE.replace("Hi there", "やあ"))
+
+    def test_untranslated_cue_keeps_only_timing(self):
+        document = SubtitleDocument(self.write('a.srt', SRT_SOURCE))
+        output = os.path.join(self.tmp.name, 'out.srt')
+        document.save(output, ["", "二"])
+        self.assertTrue(self.read(output).startswith("1\n00:00:01,000 --> 00:00:02,500\n\n2\n"))
+
+
+if __name__ == '__main__':
+    unittest.main()